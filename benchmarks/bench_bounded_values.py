@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+'''
+Throughput and size of a `QLearner` fitted on a long stream of transitions between states drawn
+from a Zipf distribution over a large state space, keeping every value or at most `max_entries` of
+them with LRU and LFU eviction, along with the hit rate of value lookups.
+
+    python benchmarks/bench_bounded_values.py [n_transitions] [max_entries]
+'''
+import sys
+import time
+import numpy as np
+
+from rltools.learners import QLearner
+
+
+def main(n_transitions=200000, max_entries=10000):
+    rnd = np.random.RandomState(0)
+    states = (rnd.zipf(1.3, n_transitions) % 10000000).tolist()
+    actions = rnd.randint(0, 4, n_transitions).tolist()
+    rewards = rnd.randn(n_transitions).tolist()
+    transitions = list(zip(states, actions, rewards))
+
+    print('%12s %14s %10s %10s %10s' % ('values', 'transitions/s', 'entries', 'states',
+                                         'hit rate'))
+    learners = [('unbounded', QLearner()),
+                ('lru', QLearner(max_entries=max_entries, eviction='lru')),
+                ('lfu', QLearner(max_entries=max_entries, eviction='lfu'))]
+    for name, learner in learners:
+        start = time.time()
+        learner.fit(transitions)
+        stats = learner.eviction_stats or {}
+        print('%12s %14.0f %10d %10d %10s' % (
+            name, n_transitions / (time.time() - start), len(learner._values),  # pylint: disable=protected-access
+            len(learner.get_states()), '%.3f' % stats['hit_rate'] if stats else '-'))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+'''
+Memory and throughput of `EpisodeStore` against keeping every transition as a tuple in a list of
+episodes, with and without a memory budget, and spilling its columns to memory-mapped files.
+
+    python benchmarks/bench_episode_store.py [n_transitions] [episode_length]
+'''
+import sys
+import time
+import shutil
+import tempfile
+import numpy as np
+
+from rltools.learners.episodestore import EpisodeStore
+
+
+def list_nbytes(episodes):
+    ''' Bytes taken by lists of tuples, counting the floats but not the small ints they share '''
+    nbytes = sys.getsizeof(episodes)
+    for episode in episodes:
+        nbytes += sys.getsizeof(episode)
+        for transition in episode:
+            nbytes += sys.getsizeof(transition) + sys.getsizeof(transition[2])
+    return nbytes
+
+
+def main(n_transitions=1000000, episode_length=100):
+    rnd = np.random.RandomState(0)
+    states = rnd.randint(0, 1000, n_transitions + 1).tolist()
+    actions = rnd.randint(0, 4, n_transitions).tolist()
+    rewards = rnd.randn(n_transitions).tolist()
+
+    start = time.time()
+    episodes = []
+    for i in range(n_transitions):
+        if i % episode_length == 0:
+            episodes.append([])
+        episodes[-1].append((states[i], actions[i], rewards[i], states[i + 1]))
+    print('%24s %14s %10s %10s' % ('storage', 'appends/s', 'MB', 'episodes'))
+    print('%24s %14.0f %10.1f %10d' % ('list of tuples', n_transitions / (time.time() - start),
+                                       list_nbytes(episodes) / 1E6, len(episodes)))
+    del episodes
+
+    path = tempfile.mkdtemp()
+    budget = n_transitions * EpisodeStore.TRANSITION_BYTES // 4
+    stores = [('store', EpisodeStore()),
+              ('store, 1/4 budget', EpisodeStore(max_bytes=budget)),
+              ('store, 1/4 reservoir', EpisodeStore(max_bytes=budget, eviction='reservoir')),
+              ('store, memory-mapped', EpisodeStore(path=path))]
+    try:
+        for name, store in stores:
+            start = time.time()
+            for i in range(n_transitions):
+                if i % episode_length == 0:
+                    store.start_episode()
+                store.append(states[i], actions[i], rewards[i], states[i + 1])
+            print('%24s %14.0f %10.1f %10d' % (name, n_transitions / (time.time() - start),
+                                               store.nbytes / 1E6, len(store)))
+    finally:
+        del stores, store
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
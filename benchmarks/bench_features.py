@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+'''
+Time learning transitions one at a time with `ValueFunctionApproximation` over `dof` weights,
+given dense feature vectors of that length, or 2-D states featurized by a hashed `TileCoder` or by
+`RBF` centered on a grid, with and without a `FeatureCache` in front. States are on a grid of
+`n_states`, so that they repeat and the cache can hit.
+
+    python benchmarks/bench_features.py [dof] [n_transitions] [n_states]
+'''
+import sys
+import time
+import random
+import numpy as np
+
+from rltools.features import TileCoder, RBF, FeatureCache
+from rltools.learners import ValueFunctionApproximation
+
+
+def main(dof=4096, n_transitions=20000, n_states=400):
+    rnd = np.random.RandomState(0)
+    side = int(n_states ** 0.5)
+    grid = rnd.randint(0, side, (n_transitions + 1, 2)) / float(side)
+    actions = rnd.randint(0, 4, n_transitions)
+    rewards = rnd.randn(n_transitions)
+    dense = rnd.rand(side, side, dof)
+    centers = np.stack(np.meshgrid(*[np.linspace(0, 1, int(dof ** 0.5))] * 2), -1).reshape(-1, 2)
+
+    print('%24s %14s %10s' % ('features', 'transitions/s', 'hit rate'))
+    for name, features in [('dense', None),
+                           ('tile coder', TileCoder(dof, n_tilings=8, tile_width=0.1)),
+                           ('tile coder, cached', FeatureCache(
+                               TileCoder(dof, n_tilings=8, tile_width=0.1))),
+                           ('rbf', RBF(centers, width=0.02)),
+                           ('rbf, cached', FeatureCache(RBF(centers, width=0.02)))]:
+        random.seed(0)
+        learner = ValueFunctionApproximation(dof, features=features, max_transitions=0)
+        states = grid.tolist() if features is not None else \
+            [dense[i, j] for i, j in (grid * side).astype(int)]
+        start = time.time()
+        for i in range(n_transitions):
+            learner._all_actions.add(actions[i])  # pylint: disable=protected-access
+            learner._learn_incr(states[i], actions[i], rewards[i], states[i + 1])  # pylint: disable=protected-access
+        hit_rate = features.hits / float(features.hits + features.misses) \
+            if isinstance(features, FeatureCache) else 0
+        print('%24s %14.0f %10.2f' % (name, n_transitions / (time.time() - start), hit_rate))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
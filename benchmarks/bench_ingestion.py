@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+'''
+Time ingesting a log of transitions into an `MLMDP` that does not replan while fitting, either as
+a list of tuples, as a generator of tuples, or as columns of arrays with `fit_columns()`.
+
+    python benchmarks/bench_ingestion.py [n_transitions] [n_states]
+'''
+import sys
+import time
+import numpy as np
+
+from rltools.learners import MLMDP
+
+
+def main(n_transitions=1000000, n_states=1000):
+    rnd = np.random.RandomState(0)
+    states = rnd.randint(0, n_states, n_transitions)
+    actions = rnd.randint(0, 4, n_transitions)
+    rewards = rnd.randn(n_transitions)
+    episode_starts = rnd.rand(n_transitions) < 0.01
+    episode_starts[0] = True
+    bounds = np.flatnonzero(episode_starts).tolist() + [n_transitions]
+
+    def episodes():
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            yield zip(states[start:end].tolist(), actions[start:end].tolist(),
+                      rewards[start:end].tolist())
+
+    print('%12s %12s %14s' % ('input', 'time (s)', 'transitions/s'))
+    for name in ['list', 'generator', 'columns']:
+        learner = MLMDP(normalize_count=0)
+        start = time.time()
+        if name == 'columns':
+            learner.fit_columns(states, actions, rewards, episode_starts)
+        else:
+            for episode in episodes():
+                learner.fit(list(episode) if name == 'list' else episode)
+        duration = time.time() - start
+        print('%12s %12.3f %14.0f' % (name, duration, n_transitions / duration))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+'''
+Time value iteration on large sparse and dense random models with the backups of every sweep
+split across an increasing number of threads, and check that the values match those of a single
+thread. Speedups depend on the cores available and, for dense models, on how many threads BLAS
+already uses for each matrix product.
+
+    python benchmarks/bench_parallel_planning.py [max_jobs]
+'''
+import sys
+import time
+import numpy as np
+
+from rltools.learners import planning
+
+
+def random_model(n_actions, n_states, successors=8, seed=0):
+    ''' Sparse model with `successors` random successors for every <action, state> '''
+    rnd = np.random.RandomState(seed)
+    actions = np.repeat(np.arange(n_actions), n_states * successors)
+    states1 = np.tile(np.repeat(np.arange(n_states), successors), n_actions)
+    states2 = rnd.randint(0, n_states, len(actions))
+    shape = (n_actions, n_states, n_states)
+    T = planning.SparseMatrix(
+        shape, actions, states1, states2, np.full(len(actions), 1.0 / successors))
+    R = planning.SparseMatrix(shape, actions, states1, states2, rnd.randn(len(actions)))
+    return T, R
+
+
+def main(max_jobs=32):
+    discount_factor = 0.95
+    print('%8s %8s %8s %12s %10s %12s' % (
+        'states', 'matrix', 'n_jobs', 'time (s)', 'speedup', 'max diff'))
+    for matrix, n_states in [('sparse', 500000), ('dense', 4000)]:
+        T, R = random_model(4, n_states)
+        if matrix == 'dense':
+            T, R = T.toarray(), R.toarray()
+
+        n_jobs, serial, expected = 1, None, None
+        while n_jobs <= max_jobs:
+            start = time.time()
+            values = planning.solve(T, R, discount_factor, atol=1E-6, n_jobs=n_jobs)
+            duration = time.time() - start
+            if expected is None:
+                serial, expected = duration, values
+            print('%8d %8s %8d %12.3f %9.1fx %12.2e' % (
+                n_states, matrix, n_jobs, duration, serial / duration,
+                np.abs(values - expected).max()))
+            n_jobs *= 2
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
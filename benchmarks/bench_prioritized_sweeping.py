@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+'''
+Compare the number of Bellman backups spent keeping values up to date while transitions stream in
+from a large, sparse random walk: `PrioritizedSweepingLearner` against warm-started full value
+iteration replanning every `interval` transitions, as `MLMDP` does.
+
+    python benchmarks/bench_prioritized_sweeping.py [n_states] [n_transitions]
+'''
+import sys
+import time
+import random
+import numpy as np
+
+from rltools.learners import MLMDP, PrioritizedSweepingLearner
+from rltools.learners import planning
+
+
+def random_walk(n_states, n_transitions, seed=0):
+    rnd = random.Random(seed)
+    state = 0
+    transitions = [(state, 0, 0)]
+    for _ in range(n_transitions):
+        action = rnd.randint(0, 1)
+        state = (state + rnd.choice([-1, 1]) * (1 + action)) % n_states
+        transitions.append((state, action, 1 if state % 97 == 0 else 0))
+    return transitions
+
+
+def replan(transitions, interval, discount_factor, atol=1E-6):
+    ''' Full value iteration, warm started, every `interval` transitions; returns backups done '''
+    learner = MLMDP(discount_factor=discount_factor, normalize_count=0, sparse=True)
+    values = np.zeros((0, 0))
+    backups = 0
+    for i in range(0, len(transitions), interval):
+        for transition in transitions[i:i + interval]:
+            learner.fit(transition)
+        T, R, _ = learner._snapshot()  # pylint: disable=protected-access
+        expected_reward = planning.expected_rewards(T, R)
+        prev_values = np.zeros(T.shape[:2])
+        prev_values[:values.shape[0], :values.shape[1]] = values
+        while True:
+            values = planning.bellman_backup(T, expected_reward, prev_values, discount_factor)
+            backups += values.size
+            if np.abs(values - prev_values).max() < atol:
+                break
+            prev_values = values
+    return backups, values
+
+
+def main(n_states=2000, n_transitions=20000):
+    discount_factor = 0.86
+    transitions = random_walk(n_states, n_transitions)
+    reference = MLMDP(discount_factor=discount_factor, normalize_count=0, sparse=True)
+    reference.fit(transitions)
+    reference.converge(atol=1E-14)
+    converged = np.array([[reference.val(state, action) for state in range(n_states)]
+                          for action in range(2)])
+
+    print('%34s %12s %10s %12s' % ('', 'backups', 'time (s)', 'max error'))
+    for interval in [1, 100, 1000]:
+        start = time.time()
+        backups, values = replan(transitions, interval, discount_factor)
+        print('%34s %12d %10.2f %12.2g' % (
+            'Value iteration every %d' % interval, backups, time.time() - start,
+            np.abs(values - converged).max()))
+
+    learner = PrioritizedSweepingLearner(discount_factor=discount_factor, n_backups=10)
+    start = time.time()
+    learner.fit(transitions)
+    values = np.array([[learner.val(state, action) for state in range(n_states)]
+                       for action in range(2)])
+    print('%34s %12d %10.2f %12.2g' % (
+        'PrioritizedSweepingLearner', learner.backups, time.time() - start,
+        np.abs(values - converged).max()))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
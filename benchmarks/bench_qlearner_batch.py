@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+'''
+Throughput of `QLearner.fit_batch()` in transitions per second, learning minibatches of random
+transitions one after the other, versus learning the same transitions one at a time.
+
+    python benchmarks/bench_qlearner_batch.py [n_transitions] [batch_size]
+'''
+import sys
+import time
+import numpy as np
+
+from rltools.learners import QLearner
+
+
+def main(n_transitions=2000000, batch_size=65536):
+    rnd = np.random.RandomState(0)
+    states = rnd.randint(0, 10000, n_transitions)
+    actions = rnd.randint(0, 4, n_transitions)
+    rewards = rnd.randn(n_transitions)
+    next_states = rnd.randint(0, 10000, n_transitions)
+
+    print('%34s %14s' % ('mode', 'transitions/s'))
+    for dense, synchronous in [(False, False), (True, False), (False, True), (True, True)]:
+        learner = QLearner(dense=dense)
+        n = n_transitions if synchronous else min(n_transitions, 200000)
+        start = time.time()
+        for i in range(0, n, batch_size):
+            batch = slice(i, min(n, i + batch_size))
+            learner.fit_batch(states[batch], actions[batch], rewards[batch], next_states[batch],
+                              synchronous=synchronous)
+        print('%34s %14.0f' % ('dense=%s, synchronous=%s' % (dense, synchronous),
+                               n / (time.time() - start)))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
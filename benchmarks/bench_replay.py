@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+'''
+Throughput of `ReplayBuffer` and `PrioritizedReplayBuffer` when inserting transitions one at a
+time and in batches, sampling minibatches, and updating the priorities of the sampled
+transitions, along with the memory each buffer takes for its capacity.
+
+    python benchmarks/bench_replay.py [capacity] [batch_size]
+'''
+import sys
+import time
+import numpy as np
+
+from rltools.buffers import ReplayBuffer, PrioritizedReplayBuffer
+
+
+def timed(fn, n):
+    ''' Operations per second of calling `fn` `n` times '''
+    start = time.time()
+    for i in range(n):
+        fn(i)
+    return n / (time.time() - start)
+
+
+def main(capacity=1000000, batch_size=64):
+    rnd = np.random.RandomState(0)
+    states = rnd.randint(0, 10000, capacity)
+    actions = rnd.randint(0, 4, capacity)
+    rewards = rnd.randn(capacity)
+
+    print('%12s %14s %14s %14s %14s %10s' % (
+        'buffer', 'add/s', 'extend rows/s', 'batches/s', 'updates/s', 'MB'))
+    for cls in [ReplayBuffer, PrioritizedReplayBuffer]:
+        buffer = cls(capacity, seed=0)
+        n_adds = min(capacity, 100000)
+        adds = timed(lambda i, buffer=buffer: buffer.add(
+            states[i], actions[i], rewards[i], states[i]), n_adds)
+
+        start = time.time()
+        for i in range(0, capacity, 65536):
+            batch = slice(i, i + 65536)
+            buffer.extend(states[batch], actions[batch], rewards[batch], states[batch])
+        extends = capacity / (time.time() - start)
+
+        samples = timed(lambda i, buffer=buffer: buffer.sample(batch_size), 2000)
+        updates = 0
+        if isinstance(buffer, PrioritizedReplayBuffer):
+            indices = buffer.sample_indices(batch_size)
+            errors = rnd.randn(batch_size)
+            updates = timed(lambda i, buffer=buffer: buffer.update_priorities(indices, errors),
+                            2000)
+        print('%12s %14.0f %14.0f %14.0f %14.0f %10.1f' % (
+            cls.__name__[:12], adds, extends, samples, updates, buffer.nbytes / 1E6))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
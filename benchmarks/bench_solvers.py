@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+'''
+Compare the iterations and wall-clock time that each of the solvers in
+`rltools.learners.planning.SOLVERS` needs to plan over the model an `MLMDP` estimates of square
+grid worlds, with a discount factor close to 1. Grids are sampled `samples` times from every
+<state, action>, and solved with dense matrices up to 900 states and sparse matrices throughout.
+
+    python benchmarks/bench_solvers.py [samples]
+'''
+import sys
+import time
+import random
+import numpy as np
+
+from rltools.domains.gridworld import GridWorld
+from rltools.learners import MLMDP
+from rltools.learners import planning
+
+
+def grid_model(size, samples, seed=0):
+    ''' Snapshot of the model learned from every <state, action> of a `size` by `size` grid '''
+    random.seed(seed)
+    grid = [[0] * size for _ in range(size)]
+    rewards = [[-0.04] * size for _ in range(size)]
+    for row in range(1, size - 1, 4):
+        for col in range(size // 4, size):
+            grid[row][col] = 1
+    grid[-1][-1], rewards[-1][-1] = -1, 10
+    world = GridWorld(grid, rewards, noise=0.2)
+
+    learner = MLMDP(discount_factor=0.99, learning_rate=1, normalize_count=0, sparse=True)
+    for state in range(size * size):
+        for action in GridWorld.ACTIONS:
+            for _ in range(samples):
+                world.current_state = state
+                try:
+                    _, reward, state2 = world.take_action(action)
+                except RuntimeError:
+                    break
+                learner.init_episode(state)
+                learner.fit((state2, action, reward))
+    return learner._snapshot()[:2]  # pylint: disable=protected-access
+
+
+def run(solver, T, R, discount_factor, atol, max_iter=100000):  # pylint: disable=too-many-arguments, invalid-name
+    ''' Same stopping rule as `planning.solve()`, counting the iterations '''
+    start = time.time()
+    values = np.zeros(T.shape[:2])
+    iterations = 0
+    for values, change in planning.SOLVERS[solver](T, R, discount_factor, values):
+        iterations += 1
+        if change < atol or iterations >= max_iter:
+            break
+    return values, iterations, time.time() - start
+
+
+def main(samples=20):
+    discount_factor = 0.99
+    atol = 1E-10
+    print('%8s %8s %14s %8s %12s %12s' % (
+        'states', 'matrix', 'solver', 'iters', 'time (s)', 'max error'))
+    for size in [10, 30, 70]:
+        T, R = grid_model(size, samples)
+        expected = planning.solve(T, R, discount_factor, 'vi', atol=1E-20, max_iter=100000)
+        models = [('sparse', T, R)]
+        if size * size <= 900:
+            models.insert(0, ('dense', T.toarray(), R.toarray()))
+        for matrix, T_, R_ in models:
+            for solver in ['vi', 'gauss_seidel', 'pi']:
+                values, iterations, duration = run(solver, T_, R_, discount_factor, atol)
+                print('%8d %8s %14s %8d %12.4f %12.2e' % (
+                    size * size, matrix, solver, iterations, duration,
+                    np.abs(values - expected).max()))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+'''
+Compare `TemporalDifferenceLearner.converge()` replaying the episodes fitted over and over with
+batch TD(lambda) over all of them at once, split across `n_jobs` threads, and with solving for
+their values by LSTD(lambda), on episodes of the `RandomWalk` domain. Reports the time each takes
+and the RMSE of the values of the non-terminal states against the true probabilities of
+terminating on the right.
+
+    python benchmarks/bench_td_lstd.py [max_episodes] [n_jobs]
+'''
+import sys
+import time
+import random
+
+from rltools.domains.randomwalk import RandomWalk
+from rltools.learners import TemporalDifferenceLearner
+
+
+TRUE_VALUES = [1. / 6, 1. / 3, 1. / 2, 2. / 3, 5. / 6]
+
+
+def random_walk_episodes(n_episodes, seed=0):
+    random.seed(seed)
+    episodes = []
+    for _ in range(n_episodes):
+        world = RandomWalk()
+        episode = [(world.current_state, 0, 0)]
+        while 0 < world.current_state < world.num_states - 1:
+            action, reward, state = world.take_action(0)
+            episode.append((state, action, reward))
+        episodes.append(episode)
+    return episodes
+
+
+def rmse(learner):
+    return (sum([(learner.val(state, 0) - TRUE_VALUES[state - 1]) ** 2
+                 for state in range(1, 6)]) / 5.) ** 0.5
+
+
+def main(max_episodes=10000, n_jobs=4):
+    print('%9s %8s %12s %10s' % ('episodes', 'method', 'time (s)', 'rmse'))
+    n_episodes = 10
+    while n_episodes <= max_episodes:
+        episodes = random_walk_episodes(n_episodes)
+        for method in ['replay', 'batch', 'lstd']:
+            learner = TemporalDifferenceLearner(l=0.6, discount_factor=1, learning_rate=0.9,
+                                                n_jobs=n_jobs)
+            for episode in episodes:
+                learner.fit(episode)
+            start = time.time()
+            try:
+                learner.converge(atol=1E-6, max_time=60, method=method)
+            except RuntimeError:
+                method += '*'
+            print('%9d %8s %12.4f %10.4f' % (n_episodes, method, time.time() - start,
+                                             rmse(learner)))
+        n_episodes *= 10
+    print('* convergence not achieved')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+'''
+Time that `TemporalDifferenceLearner` takes to learn a single long episode of a random walk over
+`n_states` states, for increasing episode lengths, with and without cutting off eligibility
+traces, and with values kept in a `dict` or in a dense `ValueTable`.
+
+    python benchmarks/bench_td_traces.py [max_steps] [n_states]
+'''
+import sys
+import time
+import random
+
+from rltools.learners import TemporalDifferenceLearner
+
+
+def random_episode(n_steps, n_states, seed=0):
+    random.seed(seed)
+    state = n_states // 2
+    episode = [(state, 0, 0)]
+    for _ in range(n_steps):
+        state = min(n_states - 1, max(0, state + random.choice([-1, 1])))
+        episode.append((state, 0, 1 if state == n_states - 1 else 0))
+    return episode
+
+
+def main(max_steps=10000, n_states=1000):
+    print('%8s %8s %8s %12s %10s' % ('steps', 'cutoff', 'dense', 'time (s)', 'traces'))
+    n_steps = 1000
+    while n_steps <= max_steps:
+        episode = random_episode(n_steps, n_states)
+        for trace_cutoff in [0, 1E-4]:
+            for dense in [False, True]:
+                learner = TemporalDifferenceLearner(
+                    l=0.9, discount_factor=0.99, learning_rate=0.1, dense=dense,
+                    trace_cutoff=trace_cutoff)
+                start = time.time()
+                learner.fit(episode)
+                _, _, _, first, last = learner._traces  # pylint: disable=protected-access
+                print('%8d %8g %8s %12.4f %10d' % (
+                    n_steps, trace_cutoff, dense, time.time() - start, last - first))
+        n_steps *= 10
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
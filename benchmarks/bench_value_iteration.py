@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+'''
+Compare the vectorized value iteration in `rltools.learners.planning` against the Python loop it
+replaced. The loop is timed on a single sweep and extrapolated to the number of sweeps the
+vectorized solver needed, since running it to convergence takes hours at 5k states.
+
+    python benchmarks/bench_value_iteration.py [n_actions]
+'''
+import sys
+import time
+import numpy as np
+
+from rltools.learners import planning
+
+
+def random_model(n_actions, n_states, successors=8, seed=0):
+    rnd = np.random.RandomState(seed)
+    T = np.zeros((n_actions, n_states, n_states))
+    R = np.zeros((n_actions, n_states, n_states))
+    for action in range(n_actions):
+        for state in range(n_states):
+            nxt = rnd.randint(0, n_states, successors)
+            T[action, state, nxt] += 1.0 / successors
+            R[action, state, nxt] = rnd.randn(successors)
+    return T, R
+
+
+def loop_sweep(T, R, discount_factor, prev_values, rows):
+    curr_values = np.zeros_like(prev_values)
+    for action in range(T.shape[0]):
+        for state1 in range(rows):
+            curr_values[action, state1] = (T[action, state1] * R[action, state1]).sum()
+            for state2 in range(T.shape[2]):
+                curr_values[action, state1] += T[action, state1, state2] * \
+                    discount_factor * prev_values[action, state2]
+    return curr_values
+
+
+def main(n_actions=2):
+    discount_factor = 0.9
+    print('%8s %8s %14s %14s %10s' % ('states', 'sweeps', 'loop (s)', 'vectorized (s)', 'speedup'))
+    for n_states in [100, 1000, 5000]:
+        T, R = random_model(n_actions, n_states)
+
+        start = time.time()
+        planning.value_iteration(T, R, discount_factor, atol=1E-6)
+        vectorized = time.time() - start
+        values = np.zeros((n_actions, n_states))
+        sweeps = 0
+        expected_reward = planning.expected_rewards(T, R)
+        while True:
+            sweeps += 1
+            new_values = planning.bellman_backup(T, expected_reward, values, discount_factor)
+            if ((new_values - values) ** 2).mean() < 1E-6:
+                break
+            values = new_values
+
+        # Time a subset of the rows of a single sweep of the loop and extrapolate
+        rows = min(n_states, 100)
+        start = time.time()
+        loop_sweep(T, R, discount_factor, values, rows)
+        loop = (time.time() - start) * n_states / rows * sweeps
+
+        print('%8d %8d %14.3f %14.4f %9.0fx' % (
+            n_states, sweeps, loop, vectorized, loop / vectorized))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
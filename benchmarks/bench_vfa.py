@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+'''
+Throughput of `ValueFunctionApproximation` on random feature vectors, learning transitions one at
+a time with the default `linear_combination` and with a custom value function whose gradient is
+approximated by finite differences or given as `gradient_fn`, then with `fit_minibatches()` for
+increasing batch sizes. BLAS is limited to `n_threads` if given, which requires threadpoolctl.
+
+    python benchmarks/bench_vfa.py [dof] [n_transitions] [n_threads]
+'''
+import sys
+import time
+import random
+import numpy as np
+
+from rltools.learners import ValueFunctionApproximation
+
+
+def custom_value(params, state):
+    return float(np.tanh(np.dot(params, state)))
+
+
+def custom_gradient(params, state):
+    return (1 - np.tanh(np.dot(params, state)) ** 2) * np.asarray(state)
+
+
+def main(dof=512, n_transitions=5000, n_threads=None):
+    rnd = np.random.RandomState(0)
+    states = rnd.rand(n_transitions + 1, dof)
+    actions = rnd.randint(0, 4, n_transitions)
+    rewards = rnd.randn(n_transitions)
+
+    print('%28s %14s' % ('learner', 'transitions/s'))
+    learners = [
+        ('linear', ValueFunctionApproximation(dof), n_transitions),
+        ('custom, finite differences', ValueFunctionApproximation(
+            dof, value_fn=custom_value), min(n_transitions, 100)),
+        ('custom, gradient_fn', ValueFunctionApproximation(
+            dof, value_fn=custom_value, gradient_fn=custom_gradient), n_transitions)]
+    for name, learner, n in learners:
+        random.seed(0)
+        start = time.time()
+        for i in range(n):
+            learner.fit_batch(states[i:i + 1], actions[i:i + 1], rewards[i:i + 1],
+                              states[i + 1:i + 2], synchronous=False)
+        print('%28s %14.0f' % (name, n / (time.time() - start)))
+
+    for batch_size in [16, 64, 256, 1024]:
+        learner = ValueFunctionApproximation(dof, max_transitions=0)
+        start = time.time()
+        learner.fit_minibatches(states[:-1], actions, rewards, states[1:], batch_size=batch_size,
+                                n_epochs=5, n_threads=n_threads)
+        print('%28s %14.0f' % ('minibatches of %d' % batch_size,
+                               5 * n_transitions / (time.time() - start)))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+'''
+Time `ValueFunctionApproximation.converge()` solving for the weights by fitted Q-iteration over
+increasing numbers of random transitions between feature vectors, along with the number of
+iterations it takes and the memory the transitions kept take.
+
+    python benchmarks/bench_vfa_converge.py [max_transitions] [dof] [n_actions]
+'''
+import sys
+import time
+import numpy as np
+
+from rltools.learners import ValueFunctionApproximation
+
+
+def main(max_transitions=1000000, dof=16, n_actions=4):
+    rnd = np.random.RandomState(0)
+    print('%12s %12s %12s %10s' % ('transitions', 'time (s)', 'iterations', 'MB'))
+    n_transitions = 10000
+    while n_transitions <= max_transitions:
+        states = rnd.rand(n_transitions, dof)
+        next_states = rnd.rand(n_transitions, dof)
+        actions = rnd.randint(0, n_actions, n_transitions)
+        rewards = states[:, 0] - next_states[:, 1] + rnd.randn(n_transitions) * 0.1
+
+        learner = ValueFunctionApproximation(dof, discount_factor=0.9,
+                                             max_transitions=n_transitions)
+        for i in range(0, n_transitions, 65536):
+            batch = slice(i, i + 65536)
+            learner.fit_batch(states[batch], actions[batch], rewards[batch], next_states[batch])
+        start = time.time()
+        iterations = len(list(learner._iter_converge(atol=1E-8)))  # pylint: disable=protected-access
+        elapsed = time.time() - start
+        print('%12d %12.3f %12d %10.1f' % (n_transitions, elapsed, iterations,
+                                           learner._memory.nbytes / 1E6))  # pylint: disable=protected-access
+        n_transitions *= 10
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,4 @@
+from .sumtree import SumTree
+from .replaybuffer import ReplayBuffer, PrioritizedReplayBuffer
+
+__all__ = ['SumTree', 'ReplayBuffer', 'PrioritizedReplayBuffer']
@@ -0,0 +1,180 @@
+import numpy as np
+
+from rltools.buffers.sumtree import SumTree
+
+class ReplayBuffer(object):
+    '''
+    Fixed capacity ring buffer of <state, action, reward, next_state> transitions, kept in NumPy
+    columns that are allocated upfront so that memory use does not grow past `nbytes`. Once full,
+    every new transition overwrites the oldest one.
+
+    Batches are sampled uniformly and returned as the `(states, actions, rewards, next_states)`
+    arrays that `QLearner.fit_batch()` and `ValueFunctionApproximation.fit_batch()` take.
+
+    Parameters
+    ----------
+    capacity : int
+        Maximum number of transitions kept.
+    state_shape : tuple
+        Shape of each state, `()` for integer state ids or `(n_features,)` for feature vectors.
+    state_dtype, action_dtype : numpy dtype
+        Types of the state and action columns.
+    seed : int, optional
+        Seed of the random number generator used for sampling.
+    '''
+
+    def __init__(self, capacity, state_shape=(), state_dtype=np.int64, action_dtype=np.int64,  # pylint: disable=too-many-arguments
+                 seed=None):
+        if capacity < 1:
+            raise ValueError('Capacity must be at least 1, got %d' % capacity)
+        self.capacity = capacity
+        self._states = np.zeros((capacity,) + tuple(state_shape), dtype=state_dtype)
+        self._actions = np.zeros(capacity, dtype=action_dtype)
+        self._rewards = np.zeros(capacity)
+        self._next_states = np.zeros_like(self._states)
+        self._next = 0
+        self._count = 0
+        self._random = np.random.RandomState(seed)
+
+
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in self._columns())
+
+
+    def _columns(self):
+        return self._states, self._actions, self._rewards, self._next_states
+
+
+    def add(self, state, action, reward, next_state):
+        ''' Record a single transition, returning its index in the buffer '''
+        ix = self._next
+        self._states[ix] = state
+        self._actions[ix] = action
+        self._rewards[ix] = reward
+        self._next_states[ix] = next_state
+        self._next = (ix + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+        return ix
+
+
+    def extend(self, states, actions, rewards, next_states):
+        '''
+        Record a batch of transitions given as columns, returning their indices in the buffer. If
+        there are more transitions than capacity, only the last ones are kept.
+        '''
+        columns = [np.asarray(column) for column in [states, actions, rewards, next_states]]
+        n = len(columns[0])
+        if any(len(column) != n for column in columns):
+            raise ValueError('Columns must all have the same length, got %s' % (
+                ', '.join(str(len(column)) for column in columns)))
+
+        indices = (self._next + np.arange(n)) % self.capacity
+        keep = slice(max(0, n - self.capacity), n)
+        for buffer_column, column in zip(self._columns(), columns):
+            buffer_column[indices[keep]] = column[keep]
+        self._next = (self._next + n) % self.capacity
+        self._count = min(self._count + n, self.capacity)
+        return indices[keep]
+
+
+    def sample_indices(self, batch_size):
+        ''' Indices of `batch_size` transitions drawn uniformly, with replacement '''
+        if self._count == 0:
+            raise ValueError('Cannot sample from an empty buffer')
+        return self._random.randint(0, self._count, batch_size)
+
+
+    def take(self, indices):
+        ''' Columns `(states, actions, rewards, next_states)` of the transitions at `indices` '''
+        return tuple(column[indices] for column in self._columns())
+
+
+    def sample(self, batch_size):
+        ''' Columns `(states, actions, rewards, next_states)` of `batch_size` random transitions '''
+        return self.take(self.sample_indices(batch_size))
+
+
+    def clear(self):
+        self._next = 0
+        self._count = 0
+
+
+    def __len__(self):
+        return self._count
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    '''
+    Replay buffer that samples transitions proportionally to their priority, as described by
+    Schaul et al. in `Prioritized Experience Replay`. Priorities are kept in a `SumTree`, so both
+    sampling and updating them take O(log n) operations. New transitions get the largest priority
+    seen so far, and `update_priorities()` sets them from the errors that learning them gave, for
+    example as returned by `QLearner.fit_batch()`.
+
+    Parameters
+    ----------
+    alpha : float
+        Exponent applied to the errors, 0 samples uniformly and 1 fully proportionally.
+    epsilon : float
+        Added to the absolute errors so that no transition stops being sampled altogether.
+    '''
+
+    def __init__(self, capacity, alpha=0.6, epsilon=1E-6, state_shape=(), state_dtype=np.int64,  # pylint: disable=too-many-arguments
+                 action_dtype=np.int64, seed=None):
+        ReplayBuffer.__init__(self, capacity, state_shape, state_dtype, action_dtype, seed)
+        self.alpha = alpha
+        self.epsilon = epsilon
+        self._tree = SumTree(capacity)
+        self._max_priority = 1.0
+
+
+    @property
+    def nbytes(self):
+        return ReplayBuffer.nbytes.fget(self) + self._tree.nbytes
+
+
+    def add(self, state, action, reward, next_state):
+        ix = ReplayBuffer.add(self, state, action, reward, next_state)
+        self._tree.update(ix, self._max_priority)
+        return ix
+
+
+    def extend(self, states, actions, rewards, next_states):
+        indices = ReplayBuffer.extend(self, states, actions, rewards, next_states)
+        self._tree.update(indices, self._max_priority)
+        return indices
+
+
+    def sample_indices(self, batch_size):
+        '''
+        Indices of `batch_size` transitions drawn proportionally to their priority, one from each
+        of `batch_size` equal segments of the total priority
+        '''
+        if self._count == 0:
+            raise ValueError('Cannot sample from an empty buffer')
+        segments = (np.arange(batch_size) + self._random.random_sample(batch_size)) / batch_size
+        return self._tree.find(segments * self._tree.total)
+
+
+    def importance_weights(self, indices, beta=0.4):
+        '''
+        Weights that correct for the bias of sampling the transitions at `indices` by priority,
+        scaled so that the largest is 1. Meant to be passed as `weights` to `fit_batch()`.
+        '''
+        probabilities = self._tree[indices] / self._tree.total
+        weights = (self._count * probabilities) ** -beta
+        return weights / weights.max()
+
+
+    def update_priorities(self, indices, errors):
+        ''' Set the priorities of the transitions at `indices` from their absolute `errors` '''
+        priorities = (np.abs(errors) + self.epsilon) ** self.alpha
+        self._max_priority = max(self._max_priority, float(np.max(priorities)))
+        self._tree.update(indices, priorities)
+
+
+    def clear(self):
+        ReplayBuffer.clear(self)
+        self._tree = SumTree(self.capacity)
+        self._max_priority = 1.0
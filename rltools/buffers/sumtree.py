@@ -0,0 +1,90 @@
+import numpy as np
+
+class SumTree(object):
+    '''
+    Binary tree stored in a flat array where every leaf holds a non-negative priority and every
+    inner node the sum of its children, so that the root holds the total. Updating priorities and
+    finding the leaf that a prefix sum falls into both take O(log n) operations, vectorized over
+    as many leaves or prefix sums as given at once.
+
+    Parameters
+    ----------
+    capacity : int
+        Number of leaves, rounded up to the next power of two internally.
+    '''
+
+    def __init__(self, capacity):
+        if capacity < 1:
+            raise ValueError('Capacity must be at least 1, got %d' % capacity)
+        self.capacity = capacity
+        self._n_leaves = 1
+        while self._n_leaves < capacity:
+            self._n_leaves *= 2
+        self._tree = np.zeros(2 * self._n_leaves)
+
+
+    @property
+    def total(self):
+        ''' Sum of all the priorities '''
+        return float(self._tree[1])
+
+
+    @property
+    def nbytes(self):
+        return self._tree.nbytes
+
+
+    def update(self, indices, priorities):
+        '''
+        Set the priorities of the leaves at `indices` and the sums of their ancestors, one level
+        of the tree at a time. If an index is repeated, the last of its priorities is kept.
+        '''
+        nodes = np.atleast_1d(np.asarray(indices, dtype=np.intp)) + self._n_leaves
+        priorities = np.asarray(priorities, dtype=float)
+        if (priorities < 0).any():
+            raise ValueError('Priorities must be non-negative')
+        if len(nodes) == 1:
+            self._update_one(int(nodes[0]), float(priorities.ravel()[-1]))
+            return
+        self._tree[nodes] = priorities
+
+        # Every leaf sits at the same depth, so their ancestors do too. Repeated ancestors are
+        # assigned the same sum more than once, which is cheaper than removing them.
+        while len(nodes) and nodes[0] > 1:
+            nodes = nodes // 2
+            self._tree[nodes] = self._tree[2 * nodes] + self._tree[2 * nodes + 1]
+
+
+    def _update_one(self, node, priority):
+        ''' Same as `update()` for a single leaf, without the overhead of array operations '''
+        tree = self._tree
+        tree[node] = priority
+        while node > 1:
+            node //= 2
+            tree[node] = tree[2 * node] + tree[2 * node + 1]
+
+
+    def find(self, prefix_sums):
+        '''
+        Indices of the leaves where each of `prefix_sums`, between zero and `total`, falls when
+        laying out every priority one after the other. Leaves with zero priority are never found.
+        '''
+        remaining = np.array(prefix_sums, dtype=float, ndmin=1)
+        nodes = np.ones(len(remaining), dtype=np.intp)
+        for _ in range(self._n_leaves.bit_length() - 1):
+            left = 2 * nodes
+            left_sums = self._tree[left]
+
+            # Rounding may leave sums past the total, which must not lead to an empty subtree
+            go_right = (remaining >= left_sums) & (self._tree[left + 1] > 0)
+            remaining -= np.where(go_right, left_sums, 0)
+            nodes = left + go_right
+        return nodes - self._n_leaves
+
+
+    def __getitem__(self, indices):
+        return self._tree[np.asarray(indices, dtype=np.intp) + self._n_leaves]
+
+
+    def __len__(self):
+        return self.capacity
@@ -0,0 +1,5 @@
+from .tilecoder import TileCoder
+from .rbf import RBF
+from .featurecache import FeatureCache
+
+__all__ = ['TileCoder', 'RBF', 'FeatureCache']
@@ -0,0 +1,49 @@
+from collections import OrderedDict
+
+import numpy as np
+
+class FeatureCache(object):
+    '''
+    Least recently used cache of the features of the last `maxsize` states, in front of a feature
+    constructor such as `TileCoder` or `RBF`, so that states seen again are not featurized again.
+    States that are not hashable, like lists or arrays, are looked up by the tuple of their values.
+    '''
+
+    def __init__(self, features, maxsize=10000):
+        self.features = features
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+
+
+    @property
+    def size(self):
+        return self.features.size
+
+
+    def __call__(self, state):
+        try:
+            key = state
+            entry = self._cache.pop(key, None)
+        except TypeError:
+            key = tuple(np.ravel(state).tolist())
+            entry = self._cache.pop(key, None)
+
+        if entry is None:
+            self.misses += 1
+            entry = self.features(state)
+            if len(self._cache) >= self.maxsize:
+                self._cache.popitem(last=False)
+        else:
+            self.hits += 1
+        self._cache[key] = entry
+        return entry
+
+
+    def clear(self):
+        self._cache.clear()
+
+
+    def __len__(self):
+        return len(self._cache)
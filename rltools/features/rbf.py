@@ -0,0 +1,34 @@
+import numpy as np
+
+class RBF(object):
+    '''
+    Gaussian radial basis functions centered on given states. Calling it with a state returns
+    `(indices, values)`, the indices of the centers whose activation is at least `min_activation`
+    and those activations, as taken by `ValueFunctionApproximation(features=...)`.
+
+    Parameters
+    ----------
+    centers : array
+        One center per row, the `dof` of the learner being their number.
+    width : float
+        Standard deviation of the Gaussians.
+    min_activation : float
+        Activations below it are left out, so that only centers near the state are updated.
+    '''
+
+    def __init__(self, centers, width=1.0, min_activation=1E-3):
+        self.centers = np.atleast_2d(np.asarray(centers, dtype=float))
+        self.width = width
+        self.min_activation = min_activation
+
+
+    @property
+    def size(self):
+        return len(self.centers)
+
+
+    def __call__(self, state):
+        offsets = self.centers - np.asarray(state, dtype=float).ravel()
+        activations = np.exp(-np.einsum('ij,ij->i', offsets, offsets) / (2 * self.width ** 2))
+        indices = np.flatnonzero(activations >= self.min_activation)
+        return indices, activations[indices]
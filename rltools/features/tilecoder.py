@@ -0,0 +1,66 @@
+import numpy as np
+
+class TileCoder(object):
+    '''
+    Hashed tile coding of continuous states, as described by Richard Sutton and Andrew Barto in
+    `Reinforcement Learning: An Introduction`. The state space is covered by `n_tilings` grids of
+    tiles offset from one another, and every state activates the tile it falls in on each of them.
+    Tiles are hashed into `size` indices rather than enumerated, so memory does not depend on the
+    extent of the state space.
+
+    Calling the coder with a state returns `(indices, values)`, the indices of its active tiles and
+    a value of one for each, as taken by `ValueFunctionApproximation(features=...)`.
+
+    Parameters
+    ----------
+    size : int
+        Number of indices that tiles are hashed into, the `dof` of the learner.
+    n_tilings : int
+        Number of tilings, and of tiles active for every state.
+    tile_width : float or array
+        Width of the tiles along every dimension of the state, or along each of them.
+    seed : int
+        Seed of the hash function.
+    '''
+
+    def __init__(self, size, n_tilings=8, tile_width=1.0, seed=0):
+        self.size = size
+        self.n_tilings = n_tilings
+        self.tile_width = tile_width
+        self._random = np.random.RandomState(seed)
+        self._multipliers = None
+        self._offsets = None
+        self._values = np.ones(n_tilings)
+
+
+    def _setup(self, n_dims):
+        '''
+        Offsets of every tiling, a fraction of a tile along the odd multiples of its index as
+        recommended by Miller and Glanz, and random odd 64-bit multipliers of the coordinates and
+        of the index of the tiling that make up the hash of a tile
+        '''
+        factors = 2 * np.arange(n_dims) + 1
+        self._offsets = (np.arange(self.n_tilings)[:, None] * factors % self.n_tilings) / \
+            float(self.n_tilings)
+        halves = self._random.randint(0, 2 ** 32, size=(2, n_dims + 1)).astype(np.uint64)
+        self._multipliers = (halves[0] << np.uint64(32)) | halves[1] | np.uint64(1)
+
+
+    def tiles(self, state):
+        ''' Indices of the tiles active for `state`, one per tiling '''
+        scaled = np.asarray(state, dtype=float).ravel() / self.tile_width
+        if self._offsets is None or self._offsets.shape[1] != len(scaled):
+            self._setup(len(scaled))
+        coords = np.floor(scaled + self._offsets).astype(np.int64).astype(np.uint64)
+        hashes = coords.dot(self._multipliers[1:]) + \
+            np.arange(self.n_tilings, dtype=np.uint64) * self._multipliers[0]
+
+        # Mix the high bits into the low ones, which the modulo keeps
+        hashes ^= hashes >> np.uint64(31)
+        hashes *= np.uint64(0xbf58476d1ce4e5b9)
+        hashes ^= hashes >> np.uint64(29)
+        return (hashes % np.uint64(self.size)).astype(np.intp)
+
+
+    def __call__(self, state):
+        return self.tiles(state), self._values
@@ -3,5 +3,10 @@ from .qlearner import QLearner
 from .temporaldifference import TemporalDifferenceLearner
 from .mlmpd import MLMDP
 from .valuefunctionapprox import ValueFunctionApproximation
+from .prioritizedsweeping import PrioritizedSweepingLearner
+from .valuetable import Interner, ValueTable
+from .boundedvalues import BoundedValues
 
-__all__ = ['Learner', 'QLearner', 'TemporalDifferenceLearner', 'MLMDP', 'ValueFunctionApproximation']
+__all__ = ['Learner', 'QLearner', 'TemporalDifferenceLearner', 'MLMDP',
+           'ValueFunctionApproximation', 'PrioritizedSweepingLearner', 'Interner', 'ValueTable',
+           'BoundedValues']
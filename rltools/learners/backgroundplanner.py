@@ -0,0 +1,131 @@
+import time
+import threading
+
+
+class BackgroundPlanner(object):
+    '''
+    Runs planning jobs in a daemon worker thread, so that the thread observing transitions never
+    waits for them. Every job submitted is passed to `solve(*job)` and its result is then handed to
+    `apply(result, *job)`, both in the worker thread. Only the most recent job is kept while the
+    worker is busy, since any older snapshot of the model is superseded by a newer one. The worker
+    stops as soon as it runs out of jobs, and is started again by the next one submitted, so no
+    thread outlives the jobs; `close()` also drops the job pending.
+
+    Jobs that raise are counted as `failed` rather than `completed`, and the last error is kept
+    until `raise_error()` or `wait()` re-raises it.
+    '''
+
+    def __init__(self, solve, apply):
+        self._solve = solve
+        self._apply = apply
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = False
+        self._pending = None
+        self._busy = False
+        self._error = None
+
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.superseded = 0
+        self.last_duration = None
+
+
+    def submit(self, *job):
+        ''' Queue a job, replacing the one pending if the worker has not picked it up yet '''
+        with self._condition:
+            if self._pending is not None:
+                self.superseded += 1
+            self._pending = job
+            self.submitted += 1
+            if not self._running:
+                self._running = True
+                self._thread = threading.Thread(target=self._run, name='BackgroundPlanner')
+                self._thread.daemon = True
+                self._thread.start()
+            self._condition.notify_all()
+
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if self._pending is None:
+                    self._running = False
+                    self._condition.notify_all()
+                    return
+                job, self._pending = self._pending, None
+                self._busy = True
+
+            start = time.time()
+            error = None
+            try:
+                self._apply(self._solve(*job), *job)
+            except Exception as exc:  # pylint: disable=broad-except
+                error = exc
+
+            with self._condition:
+                self._busy = False
+                if error is None:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+                    self._error = error
+                self.last_duration = time.time() - start
+                self._condition.notify_all()
+
+
+    @property
+    def pending(self):
+        ''' Whether a job is queued or being solved '''
+        return self._pending is not None or self._busy
+
+
+    def close(self, timeout=None):
+        '''
+        Drop the job pending, if any, and block until the worker is done with the one it is solving
+        and stops, or until `timeout` seconds have elapsed. Jobs submitted afterwards start a new
+        worker.
+
+        Returns
+        -------
+        done : bool
+            False if the timeout expired before the worker stopped.
+        '''
+        with self._condition:
+            if self._pending is not None:
+                self._pending = None
+                self.superseded += 1
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        return thread is None or not thread.is_alive()
+
+
+    def raise_error(self):
+        ''' Re-raise the error of the last job that failed, if any did since the last call '''
+        with self._condition:
+            error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+
+    def wait(self, timeout=None):
+        '''
+        Block until every job submitted has been applied, or until `timeout` seconds have elapsed.
+        Errors raised by a job are re-raised here.
+
+        Returns
+        -------
+        done : bool
+            False if the timeout expired before the worker became idle.
+        '''
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while self.pending:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        self.raise_error()
+        return True
@@ -0,0 +1,224 @@
+from collections import OrderedDict
+
+try:
+    from collections.abc import MutableMapping
+except ImportError:  # Python 2
+    from collections import MutableMapping
+
+
+class BoundedValues(MutableMapping):
+    '''
+    Storage for <state, action> value estimates that behaves like the `dict` that `Learner` uses
+    by default, but holds at most `max_entries` of them. Setting a new entry once full evicts the
+    least recently used one with `eviction='lru'`, or the least frequently used one with
+    `eviction='lfu'`, ties going to the least recently used. An entry is used every time it is
+    looked up or set, and every operation takes O(1) time.
+
+    Lookups are counted as `hits` or `misses` depending on whether the entry was there, and
+    entries removed to make room as `evictions`. Evicted entries read as missing, like those that
+    were never set. Reading an entry with `peek()`, checking for it with `in` or iterating over the
+    entries neither uses them nor counts as a lookup.
+
+    Parameters
+    ----------
+    max_entries : int
+        Largest number of <state, action> entries kept.
+    eviction : str
+        Entries evicted first: `'lru'` for the least recently used, `'lfu'` for the least
+        frequently used.
+    '''
+
+    def __init__(self, max_entries, eviction='lru'):
+        if eviction not in ('lru', 'lfu'):
+            raise ValueError('Unknown eviction %r, expected "lru" or "lfu"' % eviction)
+        if max_entries < 1:
+            raise ValueError('There must be room for at least one entry, got %r' % max_entries)
+        self.max_entries = max_entries
+        self.eviction = eviction
+        self.evictions = 0
+        self.hits = 0
+        self.misses = 0
+
+        # Entries in order of last use, and for LFU their use count and the entries with each
+        # count, in order of last use too
+        self._entries = OrderedDict()
+        self._counts = {}
+        self._buckets = {}
+        self._min_count = 0
+        self._state_counts = {}
+
+
+    @property
+    def hit_rate(self):
+        ''' Fraction of the lookups that found their entry, or `None` before the first one '''
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else None
+
+
+    def has_state(self, state):
+        ''' Whether any <state, action> entry is kept for `state` '''
+        return state in self._state_counts
+
+
+    @property
+    def states(self):
+        ''' `KeptStates` view of the states with an entry kept '''
+        return KeptStates(self)
+
+
+    def _touch(self, key):
+        ''' Mark the entry `key` as used '''
+        if self.eviction == 'lru':
+            self._entries[key] = self._entries.pop(key)
+            return
+        count = self._counts[key]
+        bucket = self._buckets[count]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[count]
+            if self._min_count == count:
+                self._min_count = count + 1
+        self._counts[key] = count + 1
+        self._buckets.setdefault(count + 1, OrderedDict())[key] = None
+
+
+    def _remove(self, key):
+        ''' Remove the entry `key`, which must exist, and return its value '''
+        val = self._entries.pop(key)
+        if self.eviction == 'lfu':
+            count = self._counts.pop(key)
+            bucket = self._buckets[count]
+            del bucket[key]
+            if not bucket:
+                del self._buckets[count]
+        state = key[0]
+        self._state_counts[state] -= 1
+        if not self._state_counts[state]:
+            del self._state_counts[state]
+        return val
+
+
+    def _evict(self):
+        ''' Remove the entry that goes first according to the eviction policy and return its key '''
+        if self.eviction == 'lru':
+            key = next(iter(self._entries))
+        else:
+            if self._min_count not in self._buckets:
+                # Deleting entries can leave the least used ones with a larger count
+                self._min_count = min(self._buckets)
+            key = next(iter(self._buckets[self._min_count]))
+        self._remove(key)
+        self.evictions += 1
+        return key
+
+
+    def put(self, key, val):
+        '''
+        Set the value of `key`, returning the list of keys evicted to make room for it, if any
+        '''
+        if key in self._entries:
+            self._touch(key)
+            self._entries[key] = val
+            return []
+
+        evicted = []
+        while len(self._entries) >= self.max_entries:
+            evicted.append(self._evict())
+        self._entries[key] = val
+        if self.eviction == 'lfu':
+            self._counts[key] = 1
+            self._buckets.setdefault(1, OrderedDict())[key] = None
+            self._min_count = 1
+        state = key[0]
+        self._state_counts[state] = self._state_counts.get(state, 0) + 1
+        return evicted
+
+
+    def get(self, key, default=None):
+        if key not in self._entries:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._touch(key)
+        return self._entries[key]
+
+
+    def peek(self, key, default=None):
+        ''' Value of `key`, or `default` if missing, without using the entry or counting it '''
+        return self._entries.get(key, default)
+
+
+    def keys(self):
+        return list(self._entries.keys())
+
+
+    def values(self):
+        return list(self._entries.values())
+
+
+    def items(self):
+        # Iterating the entries must not use them, which would reorder them along the way
+        return list(self._entries.items())
+
+
+    def __getitem__(self, key):
+        if key not in self._entries:
+            self.misses += 1
+            raise KeyError(key)
+        return self.get(key)
+
+
+    def __setitem__(self, key, val):
+        self.put(key, val)
+
+
+    def __delitem__(self, key):
+        if key not in self._entries:
+            raise KeyError(key)
+        self._remove(key)
+
+
+    def __contains__(self, key):
+        return key in self._entries
+
+
+    def __iter__(self):
+        return iter(self.keys())
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class KeptStates(object):
+    '''
+    Set-like view of the states that `BoundedValues` keeps at least one <state, action> entry for.
+    States are only known along with their values, so adding them to the view does nothing.
+    '''
+
+    def __init__(self, values):
+        self._values = values
+
+
+    def add(self, state):
+        pass
+
+
+    def update(self, states):
+        pass
+
+
+    def discard(self, state):
+        pass
+
+
+    def __contains__(self, state):
+        return self._values.has_state(state)
+
+
+    def __iter__(self):
+        return iter(list(self._values._state_counts))  # pylint: disable=protected-access
+
+
+    def __len__(self):
+        return len(self._values._state_counts)  # pylint: disable=protected-access
@@ -0,0 +1,236 @@
+import os
+import numpy as np
+
+from rltools.learners.valuetable import Interner
+
+class EpisodeStore(object):
+    '''
+    Episodes of <state1, action, reward, state2> transitions stored one after the other in
+    contiguous typed columns, along with the offset where each episode starts. States and actions
+    are interned to integer ids, so each transition takes 32 bytes regardless of their type. Unless
+    `release_ids` is set, ids are never released, so the interners grow with the number of
+    distinct states, not transitions.
+
+    Parameters
+    ----------
+    max_bytes : int, optional
+        Memory budget of the columns. Once exceeded, whole episodes are evicted, except for the
+        last one, which may take the store over budget by itself.
+    eviction : str
+        Episodes evicted first: `'oldest'`, or `'reservoir'` to keep a uniform random sample of
+        all the episodes ever stored.
+    path : str, optional
+        Directory where columns are kept as memory-mapped files instead of in memory. Unpickled
+        copies keep their columns in memory, so that they never share the files of the original.
+    seed : int, optional
+        Seed of the random number generator used by reservoir eviction.
+    release_ids : bool
+        Release the ids of the states and actions of evicted episodes, renumbering the others, so
+        that the interners stay within the budget too. Ids then change whenever episodes are
+        evicted.
+    '''
+
+    COLUMNS = [('states1', np.int64), ('actions', np.int64), ('rewards', np.float64),
+               ('states2', np.int64)]
+    TRANSITION_BYTES = sum(np.dtype(dtype).itemsize for _, dtype in COLUMNS)
+
+    # Transitions moved at a time when evicting, so that memory-mapped columns are never loaded
+    CHUNK_SIZE = 1 << 20
+
+    # Defaults for instances pickled before these attributes existed
+    release_ids = False
+
+    def __init__(self, max_bytes=None, eviction='oldest', path=None, seed=None,  # pylint: disable=too-many-arguments
+                 release_ids=False):
+        if eviction not in ('oldest', 'reservoir'):
+            raise ValueError('Unknown eviction %r, expected "oldest" or "reservoir"' % eviction)
+        self.max_bytes = max_bytes
+        self.eviction = eviction
+        self.path = path
+        self.release_ids = release_ids
+        self.evicted = 0
+        self.started = 0
+
+        self.states = Interner()
+        self.actions = Interner()
+        self._random = np.random.RandomState(seed)
+        self._columns = {}
+        self._size = 0
+        self._starts = []
+        self._priorities = []
+        self._allocate(16)
+
+
+    def _allocate(self, capacity):
+        ''' Resize the columns to hold `capacity` transitions, keeping the ones stored '''
+        for name, dtype in self.COLUMNS:
+            if self.path is None:
+                column = np.zeros(capacity, dtype=dtype)
+                column[:self._size] = self._columns[name][:self._size] if self._size else 0
+            else:
+                # Files are extended in place, so the memory map sees the transitions stored
+                if not os.path.isdir(self.path):
+                    os.makedirs(self.path)
+                filename = os.path.join(self.path, '%s.bin' % name)
+                with open(filename, 'ab') as fh:
+                    fh.truncate(capacity * np.dtype(dtype).itemsize)
+                column = np.memmap(filename, dtype=dtype, mode='r+', shape=(capacity,))
+            self._columns[name] = column
+
+
+    @property
+    def capacity(self):
+        return len(self._columns['rewards'])
+
+
+    @property
+    def nbytes(self):
+        return self.capacity * self.TRANSITION_BYTES
+
+
+    @property
+    def n_transitions(self):
+        return self._size
+
+
+    def start_episode(self):
+        ''' Start a new, empty episode that transitions are appended to '''
+        self._starts.append(self._size)
+        self._priorities.append(self._random.random_sample() if self.eviction == 'reservoir'
+                                else self.started)
+        self.started += 1
+
+
+    def append(self, state1, action, reward, state2):
+        ''' Append a transition to the last episode '''
+        if not self._starts:
+            self.start_episode()
+        if self._size == self.capacity:
+            self._make_room()
+        ix = self._size
+        columns = self._columns
+        columns['states1'][ix] = self.states.intern(state1)
+        columns['actions'][ix] = self.actions.intern(action)
+        columns['rewards'][ix] = reward
+        columns['states2'][ix] = self.states.intern(state2)
+        self._size += 1
+
+
+    def _make_room(self):
+        '''
+        Called when the columns are full: evict episodes down to 3/4 of the budget if it has been
+        reached, grow the columns otherwise
+        '''
+        max_size = None if self.max_bytes is None else self.max_bytes // self.TRANSITION_BYTES
+        if max_size is not None and self._size >= max_size and len(self._starts) > 1:
+            self._evict(max_size * 3 // 4)
+            if self.release_ids:
+                self._release_ids()
+        if self._size == self.capacity:
+            capacity = self.capacity * 2
+            if max_size is not None:
+                capacity = max(min(capacity, max_size), self._size + 1)
+            self._allocate(capacity)
+
+
+    def _evict(self, target_size):
+        ''' Evict episodes in order of priority until `target_size` transitions are left '''
+        lengths = np.diff(self._starts + [self._size])
+        order = np.argsort(self._priorities[:-1], kind='mergesort')
+        freed = np.cumsum(lengths[order])
+        n_evicted = min(len(order), int(np.searchsorted(freed, self._size - target_size)) + 1)
+        alive = np.ones(len(self._starts), dtype=bool)
+        alive[order[:n_evicted]] = False
+
+        # Move the transitions of the episodes kept to the front, one run of them at a time
+        size = 0
+        starts = np.array(self._starts)
+        bounds = np.flatnonzero(np.diff(np.concatenate([[0], alive.astype(np.int8), [0]])))
+        for first, last in zip(bounds[::2].tolist(), bounds[1::2].tolist()):
+            begin = starts[first]
+            end = starts[last] if last < len(starts) else self._size
+            for chunk in range(0, end - begin, self.CHUNK_SIZE):
+                src, dst = begin + chunk, size + chunk
+                n = min(self.CHUNK_SIZE, end - src)
+                for column in self._columns.values():
+                    column[dst:dst + n] = column[src:src + n]
+            starts[first:last] += size - begin
+            size += end - begin
+
+        self._starts = starts[alive].tolist()
+        self._priorities = np.array(self._priorities)[alive].tolist()
+        self._size = size
+        self.evicted += n_evicted
+
+
+    def _release_ids(self):
+        ''' Release the ids of the states and actions that no transition stored refers to '''
+        for interner, names in [(self.states, ['states1', 'states2']), (self.actions, ['actions'])]:
+            chunks = [(start, min(start + self.CHUNK_SIZE, self._size))
+                      for start in range(0, self._size, self.CHUNK_SIZE)]
+            used = np.zeros(len(interner), dtype=bool)
+            for start, end in chunks:
+                for name in names:
+                    used[self._columns[name][start:end]] = True
+            mapping = interner.retain(used)
+            for start, end in chunks:
+                for name in names:
+                    column = self._columns[name]
+                    column[start:end] = mapping[column[start:end]]
+
+
+    def _bounds(self, ix):
+        ''' Offsets of the first and past the last transition of the `ix`-th episode '''
+        ix = range(len(self._starts))[ix]
+        end = self._starts[ix + 1] if ix + 1 < len(self._starts) else self._size
+        return self._starts[ix], end
+
+
+    def episode_length(self, ix):
+        start, end = self._bounds(ix)
+        return end - start
+
+
+    def transitions(self, ix):
+        ''' List of the <state1, action, reward, state2> of the `ix`-th episode stored '''
+        start, end = self._bounds(ix)
+        state, action = self.states.key, self.actions.key
+        columns = [self._columns[name][start:end].tolist() for name, _ in self.COLUMNS]
+        return [(state(state1), action(action_), reward, state(state2))
+                for state1, action_, reward, state2 in zip(*columns)]
+
+
+    def columns(self):
+        '''
+        Arrays of every transition stored, in order, as `(states1, actions, rewards, states2,
+        starts)` where states and actions are ids in `states` and `actions`, and `starts` are the
+        offsets of every episode
+        '''
+        return tuple(self._columns[name][:self._size] for name, _ in self.COLUMNS) + \
+            (np.array(self._starts, dtype=np.intp),)
+
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_columns'] = {name: np.array(column[:self._size])
+                             for name, column in self._columns.items()}
+        return state
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.path = None
+        columns = self._columns
+        self._columns = dict(columns)
+        self._allocate(max(16, self._size))
+        for name, column in columns.items():
+            self._columns[name][:self._size] = column
+
+
+    def __len__(self):
+        return len(self._starts)
+
+
+    def __iter__(self):
+        for ix in range(len(self._starts)):
+            yield self.transitions(ix)
@@ -1,13 +1,72 @@
 import time
 import numpy as np
 
+from rltools.learners import planning
+from rltools.learners.valuetable import ValueTable, Interner
+from rltools.learners.boundedvalues import BoundedValues
+
 class Learner(object):
     '''
     Define interface of methods that must be implemented by all inhereting classes.
+
+    Value estimates are kept in a `dict` keyed by <state, action>, or in a `ValueTable` backed by
+    a dense array when `dense=True`, which takes a fraction of the memory for large tables. Given
+    `max_entries`, they are kept in `BoundedValues` instead, which evicts the least recently or
+    frequently used <state, action> according to `eviction` once full, so that memory stays
+    capped however many states are visited. States are only known while they have a value kept,
+    and their best value is only cached then, see `eviction_stats` to monitor how often evicted
+    values are missed. Actions are the exception, they stay known once seen: there are usually few
+    of them, and every state must keep reading the ones whose values it lost as zero.
+
+    Learners that plan over a model of the MDP do so with the `solver` given, one of
+    `rltools.learners.planning.SOLVERS`, splitting the work of each iteration across `n_jobs`
+    threads.
+
+    The best value of each state over all known actions, along with the actions that tie for it,
+    is cached as it is looked up and kept up to date as values change, see `best_actions()`.
+
+    States and actions can be any hashable ids. Learners map them to dense indices with the
+    interners in `state_ids` and `action_ids`, shared by the arrays, matrices and `ValueTable` they
+    keep, so that the size of those tracks the number of distinct ids seen rather than their
+    values. Unless values are bounded, the interners double as the states and actions known.
     '''
 
-    def __init__(self, discount_factor=1, learning_rate=1):
-        self._values = {}
+    # Defaults for instances pickled before these attributes existed
+    solver = 'vi'
+    n_jobs = 1
+    _converging = None
+    _best = None
+    _best_key = None
+    _state_ids = None
+    _action_ids = None
+
+    # Values closer than this to the best one are considered a tie
+    _tie_atol = 1E-5
+
+    # Learners whose values are not stored <state, action> by <state, action> cannot be cached
+    _cache_best = True
+
+    def __init__(self, discount_factor=1, learning_rate=1, dense=False, solver='vi', n_jobs=1,  # pylint: disable=too-many-arguments
+                 max_entries=None, eviction='lru'):
+        if solver not in planning.SOLVERS:
+            raise ValueError('Unknown solver %r, expected one of %s' % (
+                solver, sorted(planning.SOLVERS)))
+        if dense and max_entries is not None:
+            raise ValueError('Values cannot be both dense and bounded by max_entries')
+        self.solver = solver
+        self.n_jobs = n_jobs
+
+        # Subclasses whose ids are interned elsewhere set the interners to share before this, and
+        # classes other than learners, like `RMaxStrategy`, call this without the class defaults
+        if getattr(self, '_state_ids', None) is None:
+            self._state_ids = Interner()
+            self._action_ids = Interner()
+        if max_entries is not None:
+            self._values = BoundedValues(max_entries, eviction)
+        elif dense:
+            self._values = ValueTable(states=self._state_ids, actions=self._action_ids)
+        else:
+            self._values = {}
         self._prev_values = {}
         self._discount_factor = discount_factor
         self._learning_rate = learning_rate
@@ -15,15 +74,44 @@ class Learner(object):
         self._curr_episode = 0
         self._last_state = None
 
-        self._all_states = set()
-        self._all_actions = set()
+        # The states and actions known to a learner are those it interns, unless states are
+        # only known as long as they have a value kept. Bounded learners keep a set of the actions
+        # known instead, which is left unbounded on purpose, see the class docstring.
+        if isinstance(self._values, BoundedValues):
+            self._all_states = self._values.states
+            self._all_actions = set()
+        else:
+            self._all_states = self._state_ids
+            self._all_actions = self._action_ids
+
+
+    @property
+    def state_ids(self):
+        ''' `Interner` of the states to their index in the arrays of the learner '''
+        return self._state_ids
+
+
+    @property
+    def action_ids(self):
+        ''' `Interner` of the actions to their index in the arrays of the learner '''
+        return self._action_ids
+
+
+    def __getstate__(self):
+        # A convergence in progress cannot be pickled, converge_step() starts a new one instead
+        state = dict(self.__dict__)
+        state.pop('_converging', None)
+        state.pop('_best', None)
+        state.pop('_best_key', None)
+        return state
 
 
     def _set_value(self, state, action, val):
         ''' Helper method to override the value of specific <state, action> '''
         self._all_states.add(state)
         self._all_actions.add(action)
-        self._values[(state, action)] = val
+        self._store_value(state, action, val)
+        self._track_best(state, action, val)
 
 
     def _update_value(self, state, action, val):
@@ -31,16 +119,150 @@ class Learner(object):
         Helper method to add/subtract value estimated for specific <state, action> using the
         current learning rate
         '''
+        if isinstance(self._values, ValueTable):
+            # Interning the state and action also makes them known, see `__init__()`, except for
+            # learners pickled before that which kept them in sets of their own
+            val = self._values.blend(state, action, val, self._learning_rate)
+            if self._all_states is not self._values.states:
+                self._all_states.add(state)
+                self._all_actions.add(action)
+            self._track_best(state, action, val)
+            return
         self._all_states.add(state)
         self._all_actions.add(action)
-        self._values[(state, action)] = val * self._learning_rate + \
+        val = val * self._learning_rate + \
             (1.0 - self._learning_rate) * self._values.get((state, action), 0)
+        self._store_value(state, action, val)
+        self._track_best(state, action, val)
+
+
+    def _store_value(self, state, action, val):
+        '''
+        Write the value of <state, action>. When values are bounded, the states of the entries
+        evicted to make room for it lose their cached best value, and are forgotten if they have
+        no other value left.
+        '''
+        if not isinstance(self._values, BoundedValues):
+            self._values[(state, action)] = val
+            return
+        for state_, _ in self._values.put((state, action), val):
+            if self._best is not None:
+                self._best.pop(state_, None)
+            # Learners pickled before states were tracked by `BoundedValues` kept a set of them
+            if not self._values.has_state(state_):
+                self._all_states.discard(state_)
+
+
+    def _set_values(self, values):
+        '''
+        Helper method to override the value of every <state, action> at once given an array of
+        shape `(n_actions, n_states)`, where states and actions are given by their index in
+        `state_ids` and `action_ids`
+        '''
+        n_actions, n_states = values.shape
+        states = self._state_ids.keys()[:n_states]
+        actions = self._action_ids.keys()[:n_actions]
+        self._best = None
+        self._all_states.update(states)
+        self._all_actions.update(actions)
+        if isinstance(self._values, ValueTable):
+            self._values.assign(states, actions, values.T)
+        else:
+            for action, row in zip(actions, values.tolist()):
+                self._values.update(((state, action), val) for state, val in zip(states, row))
+
+
+    @property
+    def eviction_stats(self):
+        '''
+        Monitoring information about the values of learners created with `max_entries`, as a
+        `dict` with:
+
+        * `entries`, `max_entries`: number of <state, action> values kept, and at most.
+        * `evictions`: number of values evicted to make room for others.
+        * `hits`, `misses`: number of value lookups that found a value, and that did not because
+          it was never set or has been evicted.
+        * `hit_rate`: fraction of the lookups that were hits, `None` before the first one.
+
+        `None` for learners whose values are not bounded.
+        '''
+        values = self._values
+        if not isinstance(values, BoundedValues):
+            return None
+        return {
+            'entries': len(values),
+            'max_entries': values.max_entries,
+            'evictions': values.evictions,
+            'hits': values.hits,
+            'misses': values.misses,
+            'hit_rate': values.hit_rate,
+        }
 
 
     def _copy_values(self):
+        if isinstance(self._values, ValueTable):
+            return self._values.copy()
         return {k:v for k, v in self._values.items()}
 
 
+    def _best_entries(self):
+        '''
+        Cache of <best value, tied actions> by state. It is only valid for the current values and
+        set of actions, both of which are noted down with it.
+        '''
+        key = (self._values, len(self._all_actions))
+        if self._best is None or self._best_key[0] is not key[0] or self._best_key[1] != key[1]:
+            self._best = {}
+            self._best_key = key
+        return self._best
+
+
+    def _track_best(self, state, action, val):
+        ''' Keep the cached best value of `state` up to date after setting <state, action> '''
+        entry = self._best.get(state) if self._best is not None else None
+        if entry is None:
+            return
+        best, ties = entry
+        if val >= best + self._tie_atol:
+            self._best[state] = (val, [action])
+        elif action in ties or best - val < self._tie_atol:
+            del self._best[state]
+
+
+    def _greedy(self, state):
+        ''' Best value of `state` and the actions within `_tie_atol` of it '''
+        cache = self._best_entries() if self._cache_best else None
+        entry = cache.get(state) if cache is not None else None
+        if entry is None:
+            values = self._values
+            if isinstance(values, BoundedValues):
+                # Actions without a value kept read as zero, and are not counted as misses
+                action_values = [(self.val(state, action) if (state, action) in values else 0,
+                                  action) for action in self._all_actions]
+            else:
+                action_values = [(self.val(state, action), action) for action in self._all_actions]
+            best = max([value for value, _ in action_values]) if action_values else 0
+            entry = (best, [action for value, action in action_values
+                            if best - value < self._tie_atol])
+            if cache is not None and (not isinstance(self._values, BoundedValues) or
+                                      self._values.has_state(state)):
+                cache[state] = entry
+        return entry
+
+
+    def best_value(self, state):
+        ''' Largest estimated value of `state` over every known action '''
+        return self._greedy(state)[0]
+
+
+    def best_actions(self, state):
+        '''
+        Actions whose estimated value from `state` is the largest over every known action, or
+        within a small tolerance of it. Empty if no action is known yet.
+        '''
+        return list(self._greedy(state)[1])
+
+
     def get_states(self):
         return set(self._all_states)
 
@@ -112,7 +334,8 @@ class Learner(object):
             `state` is an integer representing the current state (that the agent just landed on),
             `action` is an integer representing the action taken by the agent to migrate from the
             previews state to `state`, and reward is a number (int or float type) representing the
-            reward given for reaching the `state` after taking `action`.
+            reward given for reaching the `state` after taking `action`. Iterables other than lists,
+            tuples or arrays, such as generators, are consumed lazily in a single pass.
 
         Examples
         --------
@@ -134,12 +357,13 @@ class Learner(object):
         if not hasattr(X, '__iter__'):
             raise ValueError('Parameter must be tuple of <state, reward> or iterable of tuples'
                              'of <state, reward>')
-        elif all((hasattr(tup, '__iter__') and len(tup) == 3 for tup in X)):
-            self.init_episode()
-        else:
+        elif hasattr(X, '__len__') and len(X) == 3 and \
+            not all((hasattr(tup, '__iter__') and len(tup) == 3 for tup in X)):
             if self._last_state is None:
                 self.init_episode()
             X = [X]
+        else:
+            self.init_episode()
 
         for (state, action, reward) in X:
             self._all_states.add(state)
@@ -149,42 +373,146 @@ class Learner(object):
             self._last_state = state
 
 
-    def _learn_incr(self, prev_state, action, reward, curr_state):  # pylint: disable=unused-argument
-        ''' Incrementally update the value estimates after observing a transition between states '''
-        self._update_value(prev_state, action, reward * self._learning_rate)
+    def fit_columns(self, states, actions, rewards, episode_starts=None):
+        '''
+        Columnar alternative to `fit()` for large batches, equivalent to fitting the tuples
+        <states[i], actions[i], rewards[i]> in order.
 
+        Parameters
+        ----------
+        states, actions, rewards : array-like
+            Columns of <state, action, reward>, all of the same length. States that are vectors of
+            features are given as the rows of a 2D array.
+        episode_starts : array-like of bool, optional
+            Marks the tuples that start a new episode. By default only the first one does, like
+            fitting a list of tuples with `fit()`. If the first tuple is not marked, it continues
+            the current episode like fitting it on its own would.
 
-    def _value_iteration(self, T, R, atol=1E-3, max_iter=1000, max_time=0):  # pylint: disable=too-many-arguments, invalid-name
+        Examples
+        --------
+        >>> learner = Learner()
+        >>> learner.fit_columns(
+        ...     states=np.array([0, 1, 2, 3, 0, 2, 3]),
+        ...     actions=np.zeros(7, dtype=int),
+        ...     rewards=np.array([0, 0.1, 0.5, -1, 0, 0.3, -1]),
+        ...     episode_starts=np.array([1, 0, 0, 0, 1, 0, 0], dtype=bool))
+        >>>
+        >>> # The prior line is equivalent to:
+        >>> learner.fit([(0, 0, 0), (1, 0, 0.1), (2, 0, 0.5), (3, 0, -1)])
+        >>> learner.fit([(0, 0, 0), (2, 0, 0.3), (3, 0, -1)])
         '''
-        Given transition matrix T and reward matrix R, compute value of <state, action> vectors
-        using value iteration algorithm.
+        states, actions, rewards = [np.asarray(column) for column in [states, actions, rewards]]
+        if not len(states) == len(actions) == len(rewards):
+            raise ValueError('Columns must all have the same length, got %d, %d and %d' % (
+                len(states), len(actions), len(rewards)))
+
+        starts = [0] if episode_starts is None else \
+            np.flatnonzero(np.asarray(episode_starts)[:len(states)]).tolist()
+        continues = starts[:1] != [0]
+        bounds = [0] + starts if continues else starts
+        for start, end in zip(bounds, bounds[1:] + [len(states)]):
+            if start == end:
+                continue
+            state, action, reward = [self._column_list(column[start:start + 1])[0] for column in
+                                     [states, actions, rewards]]
+            self._all_states.add(state)
+            self._all_actions.add(action)
+            if start > 0 or not continues or self._last_state is None:
+                self.init_episode()
+            if self._last_state is not None:
+                self._learn_incr(self._last_state, action, reward, state)
+            self._learn_columns(states[start:end - 1], actions[start + 1:end],
+                                rewards[start + 1:end], states[start + 1:end])
+            self._last_state = self._column_list(states[end - 1:end])[0]
+
+
+    @staticmethod
+    def _column_list(column):
+        ''' Column as a list of Python objects, with vectors of features as tuples '''
+        if column.ndim > 1:
+            return [tuple(row) for row in column.tolist()]
+        return column.tolist()
+
+
+    def _learn_columns(self, prev_states, actions, rewards, curr_states):
         '''
+        Learn from consecutive transitions of an episode given as arrays, one at a time by default.
+        Learners can override it with a vectorized update that has the same results.
+        '''
+        for prev_state, action, reward, curr_state in zip(*[self._column_list(column) for column in
+                                                            [prev_states, actions, rewards,
+                                                             curr_states]]):
+            self._all_states.add(curr_state)
+            self._all_actions.add(action)
+            self._learn_incr(prev_state, action, reward, curr_state)
 
-        n_states = max(self.get_states()) + 1
-        n_actions = max(self.get_actions()) + 1
-        curr_values = np.zeros((n_actions, n_states))
 
-        # Iterate and increase state values by the discounted adjacent state values
-        stopwatch = time.time() + max_time
-        prev_values = curr_values.copy()
-        for i in range(max_iter):  # pylint: disable=unused-variable
-            for action in range(n_actions):
-                for state1 in range(n_states):
-                    curr_values[action, state1] = (T[action, state1] * R[action, state1]).sum()
-                    for state2 in range(n_states):
-                        curr_values[action, state1] += T[action, state1, state2] * \
-                            self._discount_factor * prev_values[action, state2]
+    def _learn_incr(self, prev_state, action, reward, curr_state):  # pylint: disable=unused-argument
+        ''' Incrementally update the value estimates after observing a transition between states '''
+        self._update_value(prev_state, action, reward * self._learning_rate)
 
-            if ((prev_values - curr_values) ** 2).mean() < atol or \
-                (max_time > 0 and stopwatch < time.time()):
-                break
 
-            prev_values = curr_values.copy()
+    def _value_iteration(self, T, R, atol=1E-3, max_iter=1000, max_time=0, init_values=None,  # pylint: disable=too-many-arguments, invalid-name
+                         solver=None):
+        '''
+        Given transition matrix T and reward matrix R, compute value of <state, action> vectors
+        using `solver`, or the learner's own if not given. See `rltools.learners.planning.solve()`.
+        '''
+        return planning.solve(
+            T, R, self._discount_factor, solver or self.solver, atol=atol, max_iter=max_iter,
+            max_time=max_time, init_values=init_values, n_jobs=self.n_jobs)
 
-        return curr_values
 
     def converge(self, atol=1E-5, max_iter=1000, max_time=0):
         ''' Train over already fitted data over and over until convergence '''
         raise NotImplementedError(
             'Classes inhereting from Learner must override Learner.converge()')
+
+
+    def _iter_converge(self, atol=1E-3, max_iter=1000):
+        '''
+        Generator carrying out the same work as `converge()` in small steps, yielding after each of
+        them so that it can be suspended. If values are not updated as the work progresses, the
+        objects yielded are handed over to `_suspend_converge()` to make them available.
+        '''
+        raise NotImplementedError(
+            'Classes inhereting from Learner must override Learner._iter_converge()')
+
+
+    def _suspend_converge(self, progress):
+        ''' Make the progress yielded by `_iter_converge()` available before suspending it '''
+        pass
+
+
+    def converge_step(self, budget_seconds, atol=1E-3, max_iter=1000):
+        '''
+        Anytime alternative to `converge()`: work towards convergence for about `budget_seconds`
+        and return, resuming where the previous call left off. Values reflect all the progress made
+        so far in between calls. `atol` and `max_iter` only apply when a new convergence starts,
+        and data fitted in the meantime is taken into account by the next one.
+
+        Returns
+        -------
+        done : bool
+            True once values have converged or `max_iter` iterations have been carried out, after
+            which the following call starts a new convergence.
+
+        Examples
+        --------
+        >>> learner = MLMDP(normalize_count=0)
+        >>> learner.fit([(0, 0, 0), (1, 0, 0.1), (2, 0, 0.5), (3, 0, -1)])
+        >>>
+        >>> # Interleave slices of planning of at most 10ms with other work
+        >>> while not learner.converge_step(0.01):
+        ...     serve_requests(learner)
+        '''
+        converging = self._converging or self._iter_converge(atol, max_iter)
+        self._converging = None
+        deadline = time.time() + budget_seconds
+        for progress in converging:
+            if deadline <= time.time():
+                self._suspend_converge(progress)
+                self._converging = converging
+                return False
+        return True
             
\ No newline at end of file
@@ -1,107 +1,366 @@
+import time
+import threading
+import weakref
 import numpy as np
 
 from rltools.learners import Learner
+from rltools.learners.backgroundplanner import BackgroundPlanner
+from rltools.learners import planning
+from rltools.learners.planning import SparseMatrix
+from rltools.learners.transitionmodel import TransitionModel
+from rltools.learners.valuetable import Interner
 
 class MLMDP(Learner):
     '''
     Maximum likelihood markov decision process. Learner that builds a representation of an MDP
     based on the maximum likelihood estimate for the reward and transition functions from the data
     observed.
+
+    With `sparse=True`, the transition and reward matrices only hold the <state, action, state>
+    entries that have been observed, which keeps memory proportional to the number of distinct
+    transitions instead of the number of states squared.
+
+    With `async_planning=True`, reaching `normalize_count` hands a snapshot of the model over to a
+    worker thread instead of calling `converge()`, so `fit()` never waits for planning. The values
+    computed are written over the current ones as soon as they are ready; see `planning_stats` to
+    monitor how far behind the model they are. If planning fails, the error is raised by the next
+    `fit()`. The worker thread only runs while there are snapshots to plan, and only holds a weak
+    reference to the learner; `close()`, or leaving a `with` block over the learner, stops it right
+    away.
+
+    Planning uses value iteration by default, see `solver` for faster alternatives when the
+    discount factor is close to 1, and `n_jobs` to use several cores.
+
+    States and actions can be any hashable ids. The model and matrices refer to them by their
+    index in `state_ids` and `action_ids`, so they are as large as the number of distinct states
+    observed, whatever their ids.
     '''
 
-    def __init__(self, discount_factor=0.86, learning_rate=0.99, normalize_count=None):
-        Learner.__init__(self, discount_factor, learning_rate)
+    # Defaults for instances pickled before these attributes existed
+    sparse = False
+    async_planning = False
+    _planned_values = None
+    _n_transitions = 0
+    _planned_at = (0, None)
+    _columns = None
+
+    def __init__(self, discount_factor=0.86, learning_rate=0.99, normalize_count=None,  # pylint: disable=too-many-arguments
+                 dense=False, sparse=False, async_planning=False, solver='vi', n_jobs=1):
+        Learner.__init__(self, discount_factor, learning_rate, dense, solver, n_jobs)
+        self.sparse = sparse
+        self.async_planning = async_planning
+        self._planner = None
+        self._planner_lock = threading.Lock()
+        self._n_transitions = 0
+        self._planned_at = (0, None)
         self._transition_count = {}
-        self._transition_history = {}
-        self._reward_history = {}
+        self._model = TransitionModel()
+        self._columns = None
         self.normalize_count = 1 if normalize_count is None else normalize_count
         self.normalize_count_double = normalize_count is None
 
         self._max_history_len = 0
         self._transition_prior = {}
         self._reward_prior = {}
+        self._planned_values = None
+
+
+    def __getstate__(self):
+        # The worker thread and its lock cannot be pickled, they are recreated when needed
+        state = Learner.__getstate__(self)
+        state['_planner'] = None
+        state.pop('_planner_lock', None)
+        return state
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._planner = None
+        self._planner_lock = threading.Lock()
+
+        # Learners pickled before the model was kept as sufficient statistics carry every
+        # transition and reward observed instead
+        if '_model' not in state:
+            self._model = TransitionModel()
+            for (state1, action), s_list in self.__dict__.pop('_transition_history').items():
+                for state2 in s_list:
+                    self._model.add_transitions(state1, action, state2)
+            for (state1, action, state2), r_list in self.__dict__.pop('_reward_history').items():
+                self._model.add_rewards(state1, action, state2, sum(r_list), len(r_list))
+            for key in list(self._transition_prior) + list(self._reward_prior):
+                self._model.add(*key)
+
+        # Learners pickled before states and actions were interned used integer ids as indices
+        if self._state_ids is None:
+            self._state_ids = Interner(range(max(self._all_states) + 1 if self._all_states else 0))
+            self._action_ids = Interner(
+                range(max(self._all_actions) + 1 if self._all_actions else 0))
 
 
     def _learn_incr(self, prev_state, action, reward, curr_state):
         ''' Incrementally update value estimates after observing a transition between states '''
+        if self._planner is not None:
+            self._planner.raise_error()
 
         key1 = (prev_state, action, curr_state)
-        key2 = (prev_state, action)
         self._transition_count[key1] = self._transition_count.get(key1, 0) + 1
-        self._transition_history[key2] = self._transition_history.get(key2, []) + [curr_state]
-        self._reward_history[key1] = self._reward_history.get(key1, []) + [reward]
+        self._observe(prev_state, action, curr_state, reward)
+        self._n_transitions += 1
 
         if self.normalize_count > 0 and self._transition_count[key1] >= self.normalize_count:
-            self.converge()
+            if self.async_planning:
+                self._submit_planning()
+            else:
+                self.converge()
             self._transition_count = {}
             if self.normalize_count_double:
                 self.normalize_count *= 2
 
 
+    def fit_columns(self, states, actions, rewards, episode_starts=None):
+        if self.normalize_count > 0:
+            Learner.fit_columns(self, states, actions, rewards, episode_starts)
+            return
+
+        # Nothing triggers planning in between transitions, so the transitions of every episode
+        # are collected and recorded in the model all at once. States and actions are interned
+        # first, in the order fit() would, since the first state of every episode is known as soon
+        # as it is reached.
+        self._state_ids.intern_many(np.asarray(states))
+        self._action_ids.intern_many(np.asarray(actions))
+        self._columns = []
+        try:
+            Learner.fit_columns(self, states, actions, rewards, episode_starts)
+            if self._columns:
+                prev_states, actions, rewards, curr_states = [
+                    np.concatenate(columns) for columns in zip(*self._columns)]
+                if self._all_states is not self._state_ids:
+                    self._all_states.update(self._state_ids)
+                    self._all_actions.update(self._action_ids)
+                self._model.observe_columns(
+                    self._state_ids.intern_many(prev_states), self._action_ids.intern_many(actions),
+                    self._state_ids.intern_many(curr_states), rewards)
+                self._n_transitions += len(actions)
+        finally:
+            self._columns = None
+
+
+    def _learn_columns(self, prev_states, actions, rewards, curr_states):
+        if self._columns is None:
+            Learner._learn_columns(self, prev_states, actions, rewards, curr_states)
+        else:
+            self._columns.append((prev_states, actions, rewards, curr_states))
+
+
+    def _observe(self, prev_state, action, curr_state, reward):
+        ''' Record a transition in the model by the indices of its states and action '''
+        return self._model.observe(self._state_ids.intern(prev_state),
+                                   self._action_ids.intern(action),
+                                   self._state_ids.intern(curr_state), reward)
+
+
     def _calc_matrices(self):
-        n_states = max(self.get_states()) + 1
-        n_actions = max(self.get_actions()) + 1
-        T = np.zeros((n_actions, n_states, n_states))
-        R = np.zeros((n_actions, n_states, n_states))
-
-        # Compute the estimated transition probabilities
-        for (state1, action), s_list in self._transition_history.items():
-            s_count = float(len(s_list))
-            for state2 in s_list:
-                T[action, state1, state2] += 1 / s_count
-
-        # Compute the estimated reward value
-        for (state1, action, state2), r_list in self._reward_history.items():
-            r_count = len(r_list)
-            for reward in r_list:
-                R[action, state1, state2] += float(reward) / r_count
+        T, R = self._calc_sparse_matrices()
+        return T.toarray(), R.toarray()
+
+
+    def _calc_sparse_matrices(self):
+        '''
+        Estimate the transition and reward matrices from the transitions observed so far, as
+        `SparseMatrix` instances holding one entry per distinct <state, action, state>. States and
+        actions are given by their index in `state_ids` and `action_ids`.
+        '''
+        # States without transitions, like terminal ones, get a row of their own all the same,
+        # which they already have unless known states are kept apart from the interners
+        if self._all_states is not self._state_ids:
+            self._state_ids.update(self._all_states)
+            self._action_ids.update(self._all_actions)
+        n_states = len(self._state_ids)
+        n_actions = len(self._action_ids)
+        model = self._model
+        shape = (n_actions, n_states, n_states)
+
+        # Estimated transition probabilities and rewards, copied since priors are mixed in below
+        probabilities, rewards = model.estimates()
+        T = SparseMatrix(shape, model.actions, model.states1, model.states2, probabilities.copy())
+        R = SparseMatrix(shape, model.actions, model.states1, model.states2, rewards.copy())
 
         # Combine with the prior belief in accordance to the current learning rate
-        for action in range(n_actions):
-            for state1 in range(n_states):
-                for state2 in range(n_states):
-
-                    if (state1, action, state2) in self._transition_prior:
-                        T[action, state1, state2] = \
-                            T[action, state1, state2] * self._learning_rate + \
-                                self._transition_prior.get((state1, action, state2), 0) * \
-                                (1.0 - self._learning_rate)
-                    if self._max_history_len > 0 and \
-                        len(self._transition_history) > self._max_history_len:
-                        self._transition_history[(state1, action)] = []
-                        self._transition_prior[(state1, action, state2)] = \
-                            T[action, state1, state2]
-
-                    if (state1, action, state2) in self._reward_prior:
-                        R[action, state1, state2] = \
-                            R[action, state1, state2] * self._learning_rate + \
-                                self._reward_prior.get((state1, action, state2), 0) * \
-                                (1.0 - self._learning_rate)
-                    if self._max_history_len > 0 and \
-                        len(self._reward_history) > self._max_history_len:
-                        self._reward_history[(state1, action, state2)] = []
-                        self._reward_prior[(state1, action, state2)] = R[action, state1, state2]
+        for key, prior in self._transition_prior.items():
+            ix = model.index(key)
+            T.data[ix] = T.data[ix] * self._learning_rate + prior * (1.0 - self._learning_rate)
+        for key, prior in self._reward_prior.items():
+            ix = model.index(key)
+            R.data[ix] = R.data[ix] * self._learning_rate + prior * (1.0 - self._learning_rate)
 
+        # Once too many entries are tracked, fold the statistics into the prior belief
+        if self._max_history_len > 0 and model.n_rows > self._max_history_len:
+            model.reset_transitions()
+            self._transition_prior = dict(zip(model.keys(), T.data.tolist()))
+        if self._max_history_len > 0 and len(model) > self._max_history_len:
+            model.reset_rewards()
+            self._reward_prior = dict(zip(model.keys(), R.data.tolist()))
 
         # Make sure that the transition matrix is stochastic by providing uniform weight to unseen
         # transition rows
-        for action in range(n_actions):
-            for state in range(n_states):
-                diff = 1.0 - T[action, state].sum()
-                if abs(diff) > 1E-3:
-                    T[action, state] += diff / n_states
+        diff = 1.0 - T.row_sums()
+        T.fill = np.where(np.abs(diff) > 1E-3, diff, 0)
 
         return T, R
 
 
-    def converge(self, atol=1E-3, max_iter=1000, max_time=0):
-        ''' Train over already fitted data over and over until convergence '''
-        T, R = self._calc_matrices()
+    def _snapshot(self):
+        ''' Capture the current model as the matrices to plan with and the time they were taken '''
+        T, R = self._calc_sparse_matrices()
+
+        # Every state and action within the matrices will have a value once planning is done
+        self._all_states.update(self._state_ids.keys()[:T.shape[1]])
+        self._all_actions.update(self._action_ids.keys()[:T.shape[0]])
+        return T, R, (self._n_transitions, time.time())
+
+
+    def _init_values(self, shape):
+        ''' Warm start from the values computed last time, padded for any new state or action '''
+        init_values = np.zeros(shape)
+        prev_values = self._planned_values
+        if prev_values is not None:
+            n_actions, n_states = [min(n, m) for n, m in zip(init_values.shape, prev_values.shape)]
+            init_values[:n_actions, :n_states] = prev_values[:n_actions, :n_states]
+        return init_values
+
+
+    def _plan(self, T, R, atol=1E-3, max_iter=1000, max_time=0, solver=None):  # pylint: disable=too-many-arguments, invalid-name
+        ''' Compute the values of the model captured by `_snapshot()` '''
+        if not self.sparse:
+            T, R = T.toarray(), R.toarray()
+        return self._value_iteration(
+            T, R, atol, max_iter, max_time, self._init_values(T.shape[:2]), solver)
+
+
+    def _apply_plan(self, V, planned_at):  # pylint: disable=invalid-name
+        '''
+        Write the values computed from a snapshot over those of the states and actions within it,
+        unless newer values are already in use. Values of any other state or action are kept.
+        '''
+        with self._planner_lock:
+            if planned_at[0] < self._planned_at[0]:
+                return
+            self._set_values(V)
+            self._planned_values = V
+            self._planned_at = planned_at
+
+
+    def _set_value(self, state, action, val):
+        # Values may be written by the planning worker at the same time
+        with self._planner_lock:
+            Learner._set_value(self, state, action, val)
+
+
+    def _submit_planning(self):
+        if self._planner is None:
+            self._planner = BackgroundPlanner(_solve_job, _apply_job)
+        self._planner.submit(weakref.ref(self), *self._snapshot())
+
+
+    def close(self, timeout=None):
+        '''
+        Stop planning in the background: the snapshot queued is dropped, and the one being planned
+        is waited for up to `timeout` seconds. Reaching `normalize_count` plans in the background
+        again. Returns False if the timeout expired.
+        '''
+        return True if self._planner is None else self._planner.close(timeout)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def wait_for_planning(self, timeout=None):
+        '''
+        Block until the values planned in the background reflect every snapshot submitted so far,
+        or until `timeout` seconds have elapsed. Returns False if the timeout expired.
+        '''
+        return True if self._planner is None else self._planner.wait(timeout)
+
+
+    @property
+    def planning_stats(self):
+        '''
+        Monitoring information about background planning, as a `dict` with:
+
+        * `submitted`, `completed`: number of snapshots handed to and solved by the worker.
+        * `failed`: number of snapshots whose planning raised an error.
+        * `superseded`: number of snapshots dropped before the worker got to them, since a newer one
+          replaced them or planning was closed.
+        * `pending`: whether the worker has a snapshot queued or is solving one.
+        * `last_duration`: seconds spent solving the latest snapshot.
+        * `lag_transitions`, `lag_seconds`: how many transitions have been observed, and how much
+          time has passed, since the snapshot behind the values currently in use was taken.
+        '''
+        planner = self._planner
+        n_transitions, timestamp = self._planned_at
+        return {
+            'submitted': planner.submitted if planner else 0,
+            'completed': planner.completed if planner else 0,
+            'failed': planner.failed if planner else 0,
+            'superseded': planner.superseded if planner else 0,
+            'pending': planner.pending if planner else False,
+            'last_duration': planner.last_duration if planner else None,
+            'lag_transitions': self._n_transitions - n_transitions,
+            'lag_seconds': None if timestamp is None else time.time() - timestamp,
+        }
+
+
+    def _iter_converge(self, atol=1E-3, max_iter=1000, solver=None):
+        '''
+        Plan over a snapshot of the model one solver iteration at a time, yielding the values
+        computed so far along with the time of the snapshot.
+        '''
+        T, R, planned_at = self._snapshot()
+        if not self.sparse:
+            T, R = T.toarray(), R.toarray()
+        V = self._init_values(T.shape[:2])
+        steps = planning.iter_solve(
+            T, R, self._discount_factor, solver or self.solver, V, self.n_jobs)
+        try:
+            for _, (V, change) in zip(range(max_iter), steps):
+                if change < atol:
+                    break
+                yield V, planned_at
+        finally:
+            steps.close()
+        self._apply_plan(V, planned_at)
+
+
+    def _suspend_converge(self, progress):
+        self._apply_plan(*progress)
+
+
+    def converge(self, atol=1E-3, max_iter=1000, max_time=0, solver=None):  # pylint: disable=arguments-differ
+        '''
+        Train over already fitted data over and over until convergence, planning with `solver`
+        instead of the learner's own if given. See `rltools.learners.planning.solve()`.
+        '''
+        T, R, planned_at = self._snapshot()
+        V = self._plan(T, R, atol, max_iter, max_time, solver)
+        with self._planner_lock:
+            self._planned_values = V
+            self._planned_at = planned_at
+            self._set_values(V)
+
+
+def _solve_job(learner_ref, T, R, planned_at):  # pylint: disable=invalid-name, unused-argument
+    ''' Plan a snapshot in the background, unless its learner has been garbage collected '''
+    learner = learner_ref()
+    return None if learner is None else learner._plan(T, R)  # pylint: disable=protected-access
 
-        V = self._value_iteration(T, R, atol, max_iter, max_time)
 
-        n_states = max(self.get_states()) + 1
-        n_actions = max(self.get_actions()) + 1
-        for action in range(n_actions):
-            for state in range(n_states):
-                self._set_value(state, action, V[action, state])
+def _apply_job(V, learner_ref, T, R, planned_at):  # pylint: disable=invalid-name, unused-argument
+    ''' Write the values planned in the background, unless their learner is gone '''
+    learner = learner_ref()
+    if learner is not None and V is not None:
+        learner._apply_plan(V, planned_at)  # pylint: disable=protected-access
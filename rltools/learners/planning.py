@@ -0,0 +1,360 @@
+import time
+from multiprocessing.pool import ThreadPool
+import numpy as np
+
+
+class SparseMatrix(object):
+    '''
+    Sparse `(n_actions, n_states, n_states)` transition or reward matrix, stored as a list of
+    <action, state1, state2> entries so that memory scales with the number of observed transitions
+    rather than with the number of states squared. Transition matrices can also hold a `fill`
+    weight for each <action, state1> row, spread uniformly across all `n_states` successors.
+    Matrices built from the same observations share the same entries, in the same order.
+    '''
+
+    def __init__(self, shape, actions, states1, states2, data, fill=None):  # pylint: disable=too-many-arguments
+        self.shape = tuple(shape)
+        self.actions = np.asarray(actions, dtype=np.intp)
+        self.states1 = np.asarray(states1, dtype=np.intp)
+        self.states2 = np.asarray(states2, dtype=np.intp)
+        self.data = np.asarray(data, dtype=float)
+        self.fill = np.zeros(self.shape[:2]) if fill is None else fill
+
+        # Flat indices into `(n_actions, n_states)` arrays of the row and the successor of entries
+        self.rows = self.actions * self.shape[1] + self.states1
+        self.successors = self.actions * self.shape[1] + self.states2
+
+
+    @property
+    def nbytes(self):
+        return sum(arr.nbytes for arr in [
+            self.actions, self.states1, self.states2, self.data, self.fill, self.rows,
+            self.successors])
+
+
+    def row_sums(self, weights=None):
+        ''' Sum of entries (optionally times `weights`) of every <action, state1> row '''
+        data = self.data if weights is None else self.data * weights
+        return np.bincount(self.rows, data, minlength=self.shape[0] * self.shape[1]).reshape(
+            self.shape[:2])
+
+
+    def toarray(self):
+        arr = np.zeros(self.shape)
+        np.add.at(arr, (self.actions, self.states1, self.states2), self.data)
+        arr += self.fill[:, :, np.newaxis] / self.shape[2]
+        return arr
+
+
+def expected_rewards(T, R):  # pylint: disable=invalid-name
+    '''
+    Expected immediate reward of every <action, state> given the `(n_actions, n_states, n_states)`
+    transition matrix T and reward matrix R, either both dense arrays or both `SparseMatrix`.
+    '''
+    if isinstance(T, SparseMatrix):
+        return T.row_sums(R.data) + T.fill / T.shape[2] * R.row_sums()
+    return np.einsum('ast,ast->as', T, R)
+
+
+def bellman_backup(T, expected_reward, values, discount_factor):  # pylint: disable=invalid-name
+    '''
+    Single synchronous backup of the `(n_actions, n_states)` array of values: the expected reward
+    plus the discounted value of the successor states reached by repeating the same action.
+    '''
+    if isinstance(T, SparseMatrix):
+        future_values = T.row_sums(values.ravel()[T.successors]) + \
+            T.fill * values.mean(axis=1)[:, np.newaxis]
+    else:
+        # Batched matrix-vector product, one per action, dispatched to BLAS
+        future_values = np.matmul(T, values[:, :, np.newaxis])[:, :, 0]
+    return expected_reward + discount_factor * future_values
+
+
+class ParallelBackup(object):
+    '''
+    Synchronous Bellman backups like `bellman_backup()`, with the states split into `n_jobs`
+    contiguous blocks that a pool of threads backs up concurrently. Threads run in parallel as long
+    as the NumPy kernels release the GIL: matrix products for dense T, and gathers and segmented
+    sums over the entries of each block, sorted by row, for sparse T. With `n_jobs=1` backups run
+    in the calling thread. `close()` stops the threads.
+    '''
+
+    def __init__(self, T, n_jobs=1):  # pylint: disable=invalid-name
+        self.T = T
+        self.n_jobs = n_jobs
+        n_actions, n_states = T.shape[:2]
+        bounds = np.linspace(0, n_states, min(max(n_jobs, 1), n_states) + 1).astype(int)
+        self._bounds = list(zip(bounds[:-1], bounds[1:]))
+        self._pool = ThreadPool(len(self._bounds)) if len(self._bounds) > 1 else None
+
+        if self._pool is not None and isinstance(T, SparseMatrix):
+            # Entries sorted by block and by row within the block, where rows are numbered
+            blocks = np.searchsorted(bounds[1:], T.states1, side='right')
+            widths = np.diff(bounds)[blocks]
+            local_rows = T.actions * widths + T.states1 - bounds[blocks]
+            order = np.lexsort((local_rows, blocks))
+            splits = np.searchsorted(blocks[order], np.arange(1, len(self._bounds)))
+            self._blocks = []
+            for entries in np.split(order, splits):
+                rows = local_rows[entries]
+                starts = np.flatnonzero(np.diff(rows)) + 1 if len(rows) else rows
+                starts = np.concatenate([[0], starts]) if len(rows) else starts
+                self._blocks.append((rows[starts], starts, T.successors[entries], T.data[entries]))
+
+
+    def _backup_block(self, i, expected_reward, values, discount_factor, out):  # pylint: disable=too-many-arguments
+        start, end = self._bounds[i]
+        T = self.T  # pylint: disable=invalid-name
+        if isinstance(T, SparseMatrix):
+            rows, starts, successors, data = self._blocks[i]
+            future_values = np.zeros(T.shape[0] * (end - start))
+            if len(data):
+                future_values[rows] = np.add.reduceat(
+                    data * values.ravel().take(successors), starts)
+            future_values = future_values.reshape(T.shape[0], end - start) + \
+                T.fill[:, start:end] * values.mean(axis=1)[:, np.newaxis]
+        else:
+            future_values = np.matmul(T[:, start:end], values[:, :, np.newaxis])[:, :, 0]
+        out[:, start:end] = expected_reward[:, start:end] + discount_factor * future_values
+
+
+    def __call__(self, expected_reward, values, discount_factor):
+        if self._pool is None:
+            return bellman_backup(self.T, expected_reward, values, discount_factor)
+        out = np.empty(values.shape)
+        expected_reward = np.broadcast_to(expected_reward, values.shape)
+        self._pool.map(lambda i: self._backup_block(
+            i, expected_reward, values, discount_factor, out), range(len(self._bounds)))
+        return out
+
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+
+def iter_value_iteration(T, R, discount_factor, init_values, n_jobs=1):  # pylint: disable=invalid-name
+    '''
+    Generate the values after every synchronous sweep of value iteration, together with the mean
+    squared difference from the values before the sweep. Sweeps are split across `n_jobs` threads.
+    '''
+    expected_reward = expected_rewards(T, R)
+    backup = ParallelBackup(T, n_jobs)
+    values = init_values
+    try:
+        while True:
+            prev_values = values
+            values = backup(expected_reward, prev_values, discount_factor)
+            yield values, ((prev_values - values) ** 2).mean()
+    finally:
+        backup.close()
+
+
+def iter_gauss_seidel(T, R, discount_factor, init_values, n_jobs=1, n_blocks=8):  # pylint: disable=invalid-name, too-many-locals, too-many-arguments, unused-argument
+    '''
+    Generate the values after every Gauss-Seidel sweep, which splits the states into `n_blocks`
+    contiguous blocks and backs them up in place one block after another, so that each block
+    already sees the values just computed for the blocks before it. Self-transitions are solved for
+    exactly rather than backed up, unless a state loops back onto itself with certainty and no
+    discount, and sweeps alternate between ascending and descending order of blocks so that values
+    propagate quickly in both directions. Blocks depend on each other, so
+    sweeps always run in a single thread regardless of `n_jobs`.
+    '''
+    expected_reward = expected_rewards(T, R)
+    n_actions, n_states = expected_reward.shape
+    bounds = np.linspace(0, n_states, min(n_blocks, n_states) + 1).astype(int)
+    bounds = list(zip(bounds[:-1], bounds[1:]))
+
+    if isinstance(T, SparseMatrix):
+        loops = T.states1 == T.states2
+        self_transitions = np.bincount(
+            T.rows[loops], T.data[loops], minlength=n_actions * n_states).reshape(
+                n_actions, n_states) + T.fill / n_states
+
+        # Entries grouped by block, with their rows numbered within the block
+        order = np.argsort(T.states1, kind='mergesort')
+        splits = np.searchsorted(T.states1[order], [end for _, end in bounds[:-1]])
+        blocks = []
+        for (start, end), entries in zip(bounds, np.split(order, splits)):
+            local_rows = T.actions[entries] * (end - start) + T.states1[entries] - start
+            blocks.append((local_rows, T.successors[entries], T.data[entries]))
+    else:
+        self_transitions = np.diagonal(T, axis1=1, axis2=2)
+
+    # Solving for the self-transitions of undiscounted absorbing states would divide by zero
+    solvable = ~np.isclose(discount_factor * self_transitions, 1)
+    self_transitions = np.where(solvable, self_transitions, 0)
+    scale = 1. / (1. - discount_factor * self_transitions)
+
+    order = list(range(len(bounds)))
+    values = init_values
+    while True:
+        prev_values = values
+        values = values.copy()
+        flat_values = values.ravel()
+        for i in order:
+            start, end = bounds[i]
+            if isinstance(T, SparseMatrix):
+                local_rows, successors, data = blocks[i]
+                future_values = np.bincount(
+                    local_rows, data * flat_values[successors],
+                    minlength=n_actions * (end - start)).reshape(n_actions, end - start) + \
+                    T.fill[:, start:end] * values.mean(axis=1)[:, np.newaxis]
+            else:
+                future_values = np.matmul(T[:, start:end], values[:, :, np.newaxis])[:, :, 0]
+            future_values -= self_transitions[:, start:end] * values[:, start:end]
+            values[:, start:end] = scale[:, start:end] * (
+                expected_reward[:, start:end] + discount_factor * future_values)
+        order.reverse()
+        yield values, ((prev_values - values) ** 2).mean()
+
+
+def iter_policy_iteration(T, R, discount_factor, init_values, n_jobs=1):  # pylint: disable=invalid-name, too-many-locals
+    '''
+    Generate the values computed by policy iteration. The value of an <state, action> is that of
+    taking the same action from then on, so the policy never changes and a single policy evaluation
+    solves the model: the linear system `(I - discount_factor * T[a]) V[a] = E[R[a]]` of each
+    action. Dense matrices are solved directly; sparse ones, and dense ones whose system is
+    singular, like those of undiscounted absorbing states, with BiCGSTAB, which only needs products
+    with T and generates the values after each of its iterations along with the mean squared
+    residual, comparable to the difference between sweeps of value iteration. Products are split
+    across `n_jobs` threads.
+    '''
+    expected_reward = expected_rewards(T, R)
+    if not isinstance(T, SparseMatrix):
+        identity = np.eye(T.shape[1])
+        try:
+            values = np.linalg.solve(
+                identity - discount_factor * T, expected_reward[:, :, np.newaxis])
+        except np.linalg.LinAlgError:
+            pass
+        else:
+            yield values[:, :, 0], 0.
+            return
+
+    backup = ParallelBackup(T, n_jobs)
+
+    def product(values):
+        ''' (I - discount_factor * T) times the flattened `values` '''
+        values = values.reshape(expected_reward.shape)
+        return (values - backup(0, values, discount_factor)).ravel()
+
+    try:
+        for values, error in iter_bicgstab(product, expected_reward.ravel(), init_values.ravel()):
+            yield values.reshape(expected_reward.shape), error
+    finally:
+        backup.close()
+
+
+def iter_bicgstab(product, target, init_values):
+    '''
+    Generate the solutions of the linear system `A x = target` computed by unpreconditioned
+    BiCGSTAB, restarted whenever it breaks down, along with the mean squared residual. The matrix A
+    is only used through `product(x)`, which computes `A x`. When it breaks down right after a
+    restart, as it does on singular systems without a solution, it takes the Richardson step
+    `x + (target - A x)` instead, a value iteration backup when `A = I - discount_factor * T`.
+    '''
+    values = np.array(init_values, dtype=float)
+    residual = target - product(values)
+    yield values, (residual ** 2).mean()
+    while True:
+        shadow = residual.copy()
+        rho = alpha = omega = 1.
+        direction = product_direction = np.zeros_like(values)
+        n_steps = 0
+        while True:
+            rho_next = shadow.dot(residual)
+            if rho_next == 0:
+                break
+            direction = residual + rho_next / rho * alpha / omega * \
+                (direction - omega * product_direction)
+            product_direction = product(direction)
+            denominator = shadow.dot(product_direction)
+            if denominator == 0:
+                break
+            alpha = rho_next / denominator
+            rho = rho_next
+            residual_half = residual - alpha * product_direction
+            product_half = product(residual_half)
+            omega = product_half.dot(residual_half) / product_half.dot(product_half) if \
+                product_half.any() else 0
+            values = values + alpha * direction + omega * residual_half
+            residual = residual_half - omega * product_half
+            n_steps += 1
+            yield values, (residual ** 2).mean()
+            if omega == 0:
+                break
+        if not residual.any():
+            return
+        if not n_steps:
+            values = values + residual
+            residual = target - product(values)
+            yield values, (residual ** 2).mean()
+
+
+SOLVERS = {
+    'vi': iter_value_iteration,
+    'gauss_seidel': iter_gauss_seidel,
+    'pi': iter_policy_iteration,
+}
+
+
+def iter_solve(T, R, discount_factor, solver='vi', init_values=None, n_jobs=1):  # pylint: disable=too-many-arguments, invalid-name
+    '''
+    Generator of the values after every iteration of `solver`, each along with the mean squared
+    difference from the previous iteration. See `solve()` for the parameters.
+    '''
+    if solver not in SOLVERS:
+        raise ValueError('Unknown solver %r, expected one of %s' % (solver, sorted(SOLVERS)))
+    values = np.zeros(T.shape[:2]) if init_values is None else init_values
+    return SOLVERS[solver](T, R, discount_factor, values, n_jobs=n_jobs)
+
+
+def solve(T, R, discount_factor, solver='vi', atol=1E-3, max_iter=1000, max_time=0,  # pylint: disable=too-many-arguments, invalid-name
+          init_values=None, n_jobs=1):
+    '''
+    Given transition matrix T and reward matrix R, compute value of <state, action> vectors
+    using one of the `SOLVERS`. Iteration stops once the mean squared difference between
+    consecutive iterations drops below `atol`, after `max_iter` iterations, or once `max_time`
+    seconds have elapsed if it is greater than zero.
+
+    Parameters
+    ----------
+    solver : str
+        `'vi'` for value iteration, `'gauss_seidel'` for in-place Gauss-Seidel value iteration, or
+        `'pi'` for policy iteration.
+    init_values : array of shape `(n_actions, n_states)`, optional
+        Values to start iterating from, for example the solution of a slightly different model.
+        Defaults to zeros.
+    n_jobs : int
+        Number of threads to split the backups of each iteration across, see `ParallelBackup`.
+        Results match those of a single thread up to floating point rounding.
+
+    Returns
+    -------
+    values : array of shape `(n_actions, n_states)`
+    '''
+    steps = iter_solve(T, R, discount_factor, solver, init_values, n_jobs)
+    values = np.zeros(T.shape[:2]) if init_values is None else init_values
+
+    stopwatch = time.time() + max_time
+    try:
+        for _, (values, change) in zip(range(max_iter), steps):
+            if change < atol or (max_time > 0 and stopwatch < time.time()):
+                break
+    finally:
+        steps.close()
+
+    return values
+
+
+def value_iteration(T, R, discount_factor, atol=1E-3, max_iter=1000, max_time=0,  # pylint: disable=too-many-arguments, invalid-name
+                    init_values=None):
+    '''
+    Given transition matrix T and reward matrix R, compute value of <state, action> vectors
+    using value iteration algorithm. See `solve()`.
+    '''
+    return solve(T, R, discount_factor, 'vi', atol=atol, max_iter=max_iter, max_time=max_time,
+                 init_values=init_values)
@@ -0,0 +1,203 @@
+import time
+import heapq
+
+from rltools.learners import Learner, MLMDP
+
+class PrioritizedSweepingLearner(MLMDP):
+    '''
+    Prioritized sweeping on top of the maximum likelihood model learned by `MLMDP`. Instead of
+    sweeping over every state, each observed transition triggers up to `n_backups` Bellman backups
+    of the <state, action> with the largest Bellman error, taken from a priority queue. After a
+    backup changes the value of a state, the states known to transition into it are queued again,
+    found through a reverse index of the model's transitions.
+
+    Values follow the same definition as `MLMDP.converge()`, including the uniform transitions
+    assumed for <state, action> never observed. All of those share a single value per action,
+    which is solved for in closed form rather than backed up state by state. Prior beliefs are
+    not taken into account.
+    '''
+
+    # Backups change the value shared by all unobserved <state, action> at once
+    _cache_best = False
+
+    def __init__(self, discount_factor=0.86, learning_rate=0.99, n_backups=10,  # pylint: disable=too-many-arguments
+                 min_priority=1E-5, dense=False):
+        MLMDP.__init__(self, discount_factor, learning_rate, normalize_count=0, dense=dense)
+        self.n_backups = n_backups
+        self.min_priority = min_priority
+        self.backups = 0
+
+        self._queue = []
+        self._priorities = {}
+        self._predecessors = {}
+        self._observed_rows = set()
+        self._row_counts = {}
+        self._value_sums = {}
+        self._unobserved_deps = {}
+        self._unobserved_refs = {}
+
+
+    def _unobserved_value(self, action):
+        ''' Shared value of the `n_states - k` states from which `action` was never observed '''
+        n_states = len(self._state_ids)
+        unobserved = n_states - self._row_counts.get(action, 0)
+        if unobserved == 0:
+            return 0
+        discount = self._discount_factor
+        denominator = n_states - discount * unobserved
+        return discount * self._value_sums.get(action, 0) / denominator if denominator else 0
+
+
+    def val(self, state, action):
+        # Unobserved <state, action> share a value, unless one was set for them explicitly
+        if (state, action) not in self._observed_rows and action in self._all_actions and \
+            state in self._state_ids and (state, action) not in self._values:
+            return self._unobserved_value(action)
+        return MLMDP.val(self, state, action)
+
+
+    def _set_row_value(self, state, action, value):
+        prev_value = MLMDP.val(self, state, action)
+        self._set_value(state, action, value)
+        self._value_sums[action] = self._value_sums.get(action, 0) + value - prev_value
+
+
+    def _row_entries(self, state, action):
+        ''' Indices of the model entries that start at <state, action> '''
+        return self._model.row_entries(self._state_ids.index(state), self._action_ids.index(action))
+
+
+    def _next_states(self, ixs):
+        ''' States that the model entries at `ixs` transition into '''
+        return [self._state_ids.key(state2) for state2 in self._model.states2[ixs].tolist()]
+
+
+    def _backup_value(self, state, action):
+        ''' Right hand side of the Bellman equation of an observed <state, action> '''
+        probabilities, rewards = self._model.estimates()
+        ixs = self._row_entries(state, action)
+        value = 0
+        for ix, state2 in zip(ixs, self._next_states(ixs)):
+            value += probabilities[ix] * (rewards[ix] + self._discount_factor * \
+                self.val(state2, action))
+        return value
+
+
+    def _push(self, state, action):
+        ''' Queue <state, action> if its Bellman error is large enough '''
+        priority = abs(self._backup_value(state, action) - MLMDP.val(self, state, action))
+        key = (state, action)
+        if priority > self.min_priority and priority > self._priorities.get(key, 0):
+            self._priorities[key] = priority
+            heapq.heappush(self._queue, (-priority, key))
+
+
+    def _observe_row(self, state, action):
+        ''' First transition from <state, action>: it stops sharing the unobserved value '''
+        value = self._unobserved_value(action)
+        self._observed_rows.add((state, action))
+        self._row_counts[action] = self._row_counts.get(action, 0) + 1
+        self._set_row_value(state, action, value)
+
+        # Predecessors may no longer lead to any unobserved state
+        deps = self._unobserved_deps.get(action, set())
+        for state_ in self._predecessors.get((state, action), []):
+            if all((state2, action) in self._observed_rows for state2 in
+                   self._next_states(self._row_entries(state_, action))):
+                deps.discard(state_)
+
+
+    def _check_unobserved_drift(self, action):
+        '''
+        The shared unobserved value changes a little with every backup; once it has drifted far
+        enough, queue all the states that can transition into an unobserved one.
+        '''
+        value = self._unobserved_value(action)
+        if abs(value - self._unobserved_refs.get(action, 0)) * self._discount_factor > \
+            self.min_priority:
+            self._unobserved_refs[action] = value
+            for state in list(self._unobserved_deps.get(action, [])):
+                self._push(state, action)
+
+
+    def _sweep(self, n_backups, deadline=None):
+        ''' Perform up to `n_backups` backups in order of priority, or until the `deadline` '''
+        for _ in range(n_backups):
+            if deadline is not None and deadline < time.time():
+                return
+            key = None
+            while self._queue:
+                priority, key = heapq.heappop(self._queue)
+                if self._priorities.get(key) == -priority:
+                    del self._priorities[key]
+                    break
+                key = None
+            if key is None:
+                return
+
+            state, action = key
+            self._set_row_value(state, action, self._backup_value(state, action))
+            self.backups += 1
+
+            for state_ in self._predecessors.get(key, []):
+                self._push(state_, action)
+            self._check_unobserved_drift(action)
+
+
+    def fit_columns(self, states, actions, rewards, episode_starts=None):
+        # Every transition triggers backups, so they cannot be recorded all at once
+        Learner.fit_columns(self, states, actions, rewards, episode_starts)
+
+
+    def _learn_incr(self, prev_state, action, reward, curr_state):
+        ''' Update the model and sweep the <state, action> with the largest Bellman errors '''
+        n_entries = len(self._model)
+        self._observe(prev_state, action, curr_state, reward)
+        self._n_transitions += 1
+
+        # Keep track of who transitions into whom
+        if len(self._model) > n_entries:
+            self._predecessors.setdefault((curr_state, action), []).append(prev_state)
+            if (curr_state, action) not in self._observed_rows:
+                self._unobserved_deps.setdefault(action, set()).add(prev_state)
+        if (prev_state, action) not in self._observed_rows:
+            self._observe_row(prev_state, action)
+
+        self._push(prev_state, action)
+        self._check_unobserved_drift(action)
+        self._sweep(self.n_backups)
+
+
+    def _queue_all(self):
+        ''' Queue every observed <state, action> whose Bellman error is large enough '''
+        for state, action in self._observed_rows:
+            self._push(state, action)
+        for action in self._row_counts:
+            self._check_unobserved_drift(action)
+
+
+    def _iter_converge(self, atol=1E-3, max_iter=1000):
+        ''' Sweep `n_backups` at a time until no Bellman error is larger than `min_priority` '''
+        self._queue_all()
+        remaining = max_iter * max(1, len(self._observed_rows))
+        while remaining > 0 and self._priorities:
+            n_backups = min(remaining, max(1, self.n_backups))
+            self._sweep(n_backups)
+            remaining -= n_backups
+            yield
+
+
+    def _suspend_converge(self, progress):
+        ''' Nothing to do, values are backed up in place '''
+        pass
+
+
+    def converge(self, atol=1E-3, max_iter=1000, max_time=0):
+        '''
+        Sweep until no Bellman error is larger than `min_priority`, after `max_iter` times as many
+        backups as there are observed <state, action>, or once `max_time` seconds have elapsed if
+        it is greater than zero.
+        '''
+        deadline = time.time() + max_time if max_time > 0 else None
+        self._queue_all()
+        self._sweep(max_iter * max(1, len(self._observed_rows)), deadline)
@@ -1,18 +1,114 @@
+import numpy as np
+
 from rltools.learners import Learner
+from rltools.learners.valuetable import ValueTable
 
 class QLearner(Learner):
     '''
     Simple learner implementing Q-Learning. For each observation, update the estimated value of a
     state proportionally to the learning rate and taking into account the (discounted) estimated
     value of future states.
+
+    Batches of transitions, for example sampled from a `rltools.buffers.ReplayBuffer`, can be
+    learned at once with `fit_batch()`, which is vectorized for learners created with `dense=True`.
+
+    With `max_entries`, at most that many <state, action> values are kept, evicting them according
+    to `eviction`, see `Learner`.
     '''
 
-    def __init__(self, learning_rate=0.2, discount_factor=0.9):
-        Learner.__init__(self, discount_factor, learning_rate)
-                 
-            
+    def __init__(self, learning_rate=0.2, discount_factor=0.9, dense=False, max_entries=None,  # pylint: disable=too-many-arguments
+                 eviction='lru'):
+        Learner.__init__(self, discount_factor, learning_rate, dense, max_entries=max_entries,
+                         eviction=eviction)
+
+
     def _learn_incr(self, prev_state, action, reward, curr_state):  # pylint: disable=unused-argument
         ''' Incrementally update the value estimates after observing a transition between states '''
-        future_reward = max([self.val(curr_state, action_) for action_ in self.get_actions()])
+        future_reward = self.best_value(curr_state)
         self._update_value(
             prev_state, action, reward + self._discount_factor * future_reward)
+
+
+    def fit_batch(self, states, actions, rewards, next_states, synchronous=True, weights=None):  # pylint: disable=too-many-arguments
+        '''
+        Learn a batch of <state, action, reward, next_state> transitions given as arrays, using the
+        current learning rate. Unlike `fit()`, transitions are independent of each other and of
+        the current episode.
+
+        Parameters
+        ----------
+        synchronous : bool
+            If True, the targets of every transition are computed from the values prior to the
+            batch, as in minibatch Q-learning, and the updates of transitions that share the same
+            <state, action> add up. All the actions in the batch are taken into account for the
+            maximum future value. If False, transitions are learned one after the other, with the
+            same results as calling `_learn_incr()` for each of them.
+        weights : array, optional
+            Factor applied to the learning rate of each transition, for example the importance
+            weights of a `PrioritizedReplayBuffer`.
+
+        Returns
+        -------
+        errors : array
+            Temporal difference error of every transition with respect to the values prior to the
+            batch when `synchronous`, otherwise `None`.
+        '''
+        states, actions, rewards, next_states = [
+            np.asarray(column) for column in [states, actions, rewards, next_states]]
+        if not len(states) == len(actions) == len(rewards) == len(next_states):
+            raise ValueError('Columns must all have the same length, got %d, %d, %d and %d' % (
+                len(states), len(actions), len(rewards), len(next_states)))
+        learning_rates = self._learning_rate * (
+            np.ones(len(states)) if weights is None else np.asarray(weights, dtype=float))
+
+        if not synchronous:
+            learning_rate = self._learning_rate
+            try:
+                for state, action, reward, next_state, rate in zip(
+                        states.tolist(), actions.tolist(), rewards.tolist(), next_states.tolist(),
+                        learning_rates.tolist()):
+                    self._all_states.update((state, next_state))
+                    self._all_actions.add(action)
+                    if weights is not None:
+                        self._learning_rate = rate
+                    self._learn_incr(state, action, reward, next_state)
+            finally:
+                self._learning_rate = learning_rate
+            return None
+
+        self._all_states.update(np.unique(np.concatenate([states, next_states])).tolist())
+        self._all_actions.update(np.unique(actions).tolist())
+        if isinstance(self._values, ValueTable):
+            return self._fit_batch_table(states, actions, rewards, next_states, learning_rates)
+
+        errors = np.array([reward + self._discount_factor * self.best_value(next_state) - \
+            self.val(state, action) for state, action, reward, next_state in zip(
+                states.tolist(), actions.tolist(), rewards.tolist(), next_states.tolist())])
+        deltas = {}
+        for state, action, delta in zip(
+                states.tolist(), actions.tolist(), (learning_rates * errors).tolist()):
+            deltas[(state, action)] = deltas.get((state, action), 0) + delta
+        for (state, action), delta in deltas.items():
+            self._set_value(state, action, self.val(state, action) + delta)
+        return errors
+
+
+    def _fit_batch_table(self, states, actions, rewards, next_states, learning_rates):  # pylint: disable=too-many-arguments
+        ''' Synchronous `fit_batch()` with gather, max and scatter operations on the value table '''
+        table = self._values
+        next_rows = table.rows_of(next_states)
+        rows, cols = table.locate_many(states, actions)
+        values = table.array
+
+        # Missing entries read as zero, as do actions that have no column in the table yet
+        future_values = np.zeros(len(next_rows))
+        if values.shape[1] > 0:
+            known = next_rows >= 0
+            future_values[known] = values[next_rows[known]].max(axis=1)
+        if len(self._all_actions) > values.shape[1]:
+            future_values = np.maximum(future_values, 0)
+
+        errors = rewards + self._discount_factor * future_values - values[rows, cols]
+        self._best = None
+        table.add_at(rows, cols, learning_rates * errors)
+        return errors
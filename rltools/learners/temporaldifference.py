@@ -1,17 +1,156 @@
 import time
+import ctypes
+from multiprocessing import Pool, RawArray
+import numpy as np
 
 from rltools.learners import Learner
+from rltools.learners import planning
+from rltools.learners.episodestore import EpisodeStore
+from rltools.learners.valuetable import ValueTable, ValueSnapshot
+
+
+def max_lag(positions, decay, trace_cutoff):
+    '''
+    Number of past transitions whose traces are still above `trace_cutoff`, given the positions of
+    transitions within their episode and the factor `decay` by which traces decay at every step
+    '''
+    lag = positions.max() + 1 if len(positions) else 0
+    if decay == 0:
+        lag = min(lag, 1)
+    elif 0 < decay < 1 and trace_cutoff > 0:
+        lag = min(lag, int(np.floor(np.log(trace_cutoff) / np.log(decay))) + 1)
+    return lag
+
+
+def batch_sums(bounds, index, values, discount_factor, decay, trace_cutoff):  # pylint: disable=too-many-arguments, too-many-locals
+    '''
+    Sums over the transitions between `bounds`, which start and end whole episodes, of the TD
+    errors from `values` that every unknown is eligible for, and of its eligibilities. `index` holds
+    the `(key_ids, next_ids, rewards, positions)` columns of every transition, see
+    `TemporalDifferenceLearner._index_transitions()`.
+    '''
+    start, end = bounds
+    key_ids, next_ids, rewards, positions = [column[start:end] for column in index]
+    n_keys = len(values)
+    known = next_ids >= 0
+    future_values = np.zeros(end - start)
+    future_values[known] = values[next_ids[known]]
+    errors = rewards + discount_factor * future_values - values[key_ids]
+
+    errors_sum, eligibility_sum = np.zeros(n_keys), np.zeros(n_keys)
+    steps = np.arange(end - start)
+    for lag in range(max_lag(positions, decay, trace_cutoff)):
+        steps = steps[positions[steps] >= lag]
+        weight = decay ** lag
+        traces = key_ids[steps - lag]
+        errors_sum += np.bincount(traces, weight * errors[steps], minlength=n_keys)
+        eligibility_sum += weight * np.bincount(traces, minlength=n_keys)
+    return errors_sum, eligibility_sum
+
+
+# Shared memory that the worker processes of batch TD(lambda) read the transitions and the values
+# of every pass from, set once when each of them starts
+_WORKER = {}
+
+# Type of every shared column, in the order of `batch_sums()` followed by the values
+_SHARED_TYPES = [(ctypes.c_int64, np.int64)] * 2 + [(ctypes.c_double, np.float64),
+                                                    (ctypes.c_int64, np.int64),
+                                                    (ctypes.c_double, np.float64)]
+
+
+def _share(arrays):
+    ''' Copies of `arrays` in shared memory, as `(raw, size)` pairs '''
+    shared = []
+    for arr, (ctype, dtype) in zip(arrays, _SHARED_TYPES):
+        raw = RawArray(ctype, max(1, len(arr)))
+        np.frombuffer(raw, dtype=dtype)[:len(arr)] = arr
+        shared.append((raw, len(arr)))
+    return shared
+
+
+def _shared_views(shared):
+    ''' NumPy arrays over the shared memory returned by `_share()` '''
+    return [np.frombuffer(raw, dtype=dtype)[:size]
+            for (raw, size), (_, dtype) in zip(shared, _SHARED_TYPES)]
+
+
+def _init_worker(shared, params):
+    _WORKER['views'] = _shared_views(shared)
+    _WORKER['params'] = params
+
+
+def _worker_sums(bounds):
+    views = _WORKER['views']
+    return batch_sums(bounds, views[:4], views[4], *_WORKER['params'])
 
 class TemporalDifferenceLearner(Learner):
     '''
     Learner that uses the temporal difference methods described by Richard Sutton in
     `Learning to Predict by the Methods of Temporal Differences`.
+
+    Eligibility traces of the current episode are kept in arrays and updated all at once after
+    every transition. By default every transition of the episode keeps being updated; traces whose
+    eligibility decays below a positive `trace_cutoff` are dropped instead, which bounds the work
+    per transition regardless of the length of the episode at the cost of slightly different
+    values.
+
+    Values as of the start of the episode, which transitions bootstrap from, are kept as a
+    copy-on-write `ValueSnapshot`, so that starting an episode does not copy every value.
+
+    Episodes fitted are kept in an `EpisodeStore`, which can be given with a memory budget and
+    spill to disk, for `converge()` to learn from them again. Rather than replaying them over and
+    over, `converge(method='lstd')` solves for the values they lead to with least-squares
+    TD(lambda), in a single pass over them, and `converge(method='batch')` learns from all of them
+    at once with batch TD(lambda), splitting the episodes across `n_jobs` processes.
+
+    With `max_entries`, at most that many <state, action> values are kept, evicting them according
+    to `eviction`, see `Learner`, and unless `episodes` are given, about as many transitions are
+    kept in an `EpisodeStore` that releases the ids of evicted episodes, so that the memory of
+    long-lived learners stays capped.
     '''
 
-    def __init__(self, l=0.6, discount_factor=1, learning_rate=0.9):
-        Learner.__init__(self, discount_factor, learning_rate)
+    # Largest number of <state, action> for which the LSTD system is solved as a dense matrix
+    lstd_dense_limit = 1000
+
+    # Defaults for instances pickled before these attributes existed
+    trace_cutoff = 0
+    _traces = None
+
+    def __init__(self, l=0.6, discount_factor=1, learning_rate=0.9, dense=False,  # pylint: disable=too-many-arguments
+                 trace_cutoff=0, episodes=None, n_jobs=1, max_entries=None, eviction='lru'):
+        # Bounded learners keep about as many transitions as values by default, releasing the ids
+        # of the states and actions of the episodes evicted
+        if episodes is None and max_entries is not None:
+            episodes = EpisodeStore(max_bytes=max_entries * EpisodeStore.TRANSITION_BYTES,
+                                    release_ids=True)
+        if dense and episodes is not None and episodes.release_ids:
+            raise ValueError('Dense values cannot be indexed by ids that episodes release')
+
+        # States and actions have the ids the episodes are stored with
+        self._episodes = EpisodeStore() if episodes is None else episodes
+        self._state_ids = self._episodes.states
+        self._action_ids = self._episodes.actions
+        Learner.__init__(self, discount_factor, learning_rate, dense, n_jobs=n_jobs,
+                         max_entries=max_entries, eviction=eviction)
         self._lambda = l
-        self._episode_list = []
+        self.trace_cutoff = trace_cutoff
+        self._prev_values = ValueSnapshot(self._values)
+        self._reset_traces()
+
+
+    def __setstate__(self, state):
+        # Learners pickled before episodes were stored in columns kept them in lists of tuples
+        episode_list = state.pop('_episode_list', None)
+        self.__dict__.update(state)
+        if episode_list is not None:
+            self._episodes = EpisodeStore()
+            for episode in episode_list:
+                self._episodes.start_episode()
+                for vec in episode:
+                    self._episodes.append(*vec[:4])
+        if self._state_ids is None:
+            self._state_ids = self._episodes.states
+            self._action_ids = self._episodes.actions
 
 
     def init_episode(self):
@@ -19,10 +158,91 @@ class TemporalDifferenceLearner(Learner):
         Called after a terminal state is reached and a new episode is started. See `Learner.fit()`
         for more details.
         '''
-        if len(self._episode_list) == 0 or len(self._episode_list[-1]) > 0:
-            Learner.init_episode(self)
-            self._episode_list.append([])
-            self._prev_values = self._copy_values()
+        if len(self._episodes) == 0 or self._episodes.episode_length(-1) > 0:
+            self._episodes.start_episode()
+            self._start_episode()
+
+
+    def _start_episode(self):
+        Learner.init_episode(self)
+        self._snapshot_values()
+        self._reset_traces()
+
+
+    def _snapshot_values(self):
+        ''' Values from now on are written to the snapshot before changing '''
+        if isinstance(self._prev_values, ValueSnapshot) and \
+            self._prev_values.values is self._values:
+            self._prev_values.reset()
+        else:
+            self._prev_values = ValueSnapshot(self._values)
+
+
+    def _set_value(self, state, action, val):
+        if isinstance(self._prev_values, ValueSnapshot):
+            self._prev_values.save((state, action))
+        Learner._set_value(self, state, action, val)
+
+
+    def _update_value(self, state, action, val):
+        if isinstance(self._prev_values, ValueSnapshot):
+            self._prev_values.save((state, action))
+        Learner._update_value(self, state, action, val)
+
+
+    def _reset_traces(self):
+        '''
+        Traces are `[keys, cells, eligibilities, start, end]`, where the ones in use are those
+        between `start` and `end`, in order of decreasing age and thus increasing eligibility.
+        `keys` holds <state, action> for learners backed by a `dict`, `cells` the rows and
+        columns of those backed by a `ValueTable`.
+        '''
+        self._traces = [[], np.zeros((2, 16), dtype=np.intp), np.zeros(16), 0, 0]
+
+
+    def _add_trace(self, state, action):
+        ''' Start the trace of <state, action> with an eligibility of 1 '''
+        keys, cells, eligibilities, start, end = self._traces
+        if end == len(eligibilities):
+            # Move the traces in use to the front, making room for more if they take over half
+            n_traces = end - start
+            size = len(eligibilities) * (2 if n_traces > len(eligibilities) // 2 else 1)
+            keys = keys[start:end]
+            cells = np.concatenate([cells[:, start:end], np.zeros((2, size - n_traces),
+                                                                  dtype=np.intp)], axis=1)
+            eligibilities = np.concatenate([eligibilities[start:end], np.zeros(size - n_traces)])
+            start, end = 0, n_traces
+
+        if isinstance(self._values, ValueTable):
+            cells[:, end] = self._values.locate(state, action)
+        else:
+            keys.append((state, action))
+        eligibilities[end] = 1
+        self._traces = [keys, cells, eligibilities, start, end + 1]
+
+
+    def _update_traces(self, value):
+        '''
+        Add `value` to every <state, action> in proportion to its eligibility, then decay them
+        and drop those that fall below `trace_cutoff`
+        '''
+        keys, cells, eligibilities, start, end = self._traces
+        active = eligibilities[start:end]
+        deltas = value * active
+        if isinstance(self._values, ValueTable):
+            self._best = None
+            if isinstance(self._prev_values, ValueSnapshot):
+                self._prev_values.save_cells(cells[0, start:end], cells[1, start:end])
+            self._values.add_at(cells[0, start:end], cells[1, start:end], deltas)
+        else:
+            for key, delta in zip(keys[start:end], deltas.tolist()):
+                state_, action_ = key
+                self._set_value(state_, action_, delta + self.val(state_, action_))
+
+        active *= self._discount_factor
+        active *= self._lambda
+        if self.trace_cutoff > 0:
+            self._traces[3] = start + int(np.searchsorted(active, self.trace_cutoff))
 
 
     def _learn_incr(self, prev_state, action, reward, curr_state):
@@ -31,39 +251,36 @@ class TemporalDifferenceLearner(Learner):
         # Call init_episode() if this is the first item
         if len(self._values) == 0:
             self.init_episode()
-        self._episode_list[-1].append((prev_state, action, reward, curr_state, 1))
+        self._episodes.append(prev_state, action, reward, curr_state)
+        self._learn_transition(prev_state, action, reward, curr_state)
+
+
+    def _learn_transition(self, prev_state, action, reward, curr_state):
+        ''' Update the values of the current episode's traces after a transition '''
+        if self._traces is None:
+            self._reset_traces()
+        self._add_trace(prev_state, action)
 
         # For this state, compute value as the max of values for all possible actions
-        estimated_value = max([self.val(prev_state, a) for a in self._all_actions])
+        estimated_value = self.best_value(prev_state)
 
         # Keep track of the value estimate based on prior iterations
         previous_value = self._prev_values.get((curr_state, action), 0)
 
         # Compute the value added to each of the states
         delta = reward + self._discount_factor * previous_value - estimated_value
-        value = self._learning_rate * delta
-
-        for ix, vec in enumerate(self._episode_list[-1]):
-            state_, action_, _, _, eligibility = vec
-            self._set_value(state_, action_, value * eligibility \
-                + self.val(state_, action_))  # update value in additive way
-            self._episode_list[-1][ix] = vec[:-1] + (vec[-1] * self._discount_factor * \
-                self._lambda,)  # decay eligibility
+        self._update_traces(self._learning_rate * delta)
 
 
     def _learn_episode(self, ix):
         ''' Helper method to re-learn a specific episode given its index '''
 
-        # Insert new episode
-        self.init_episode()
-
-        # Copy the old one and re-learn it
-        for vec in self._episode_list[ix]:
-            state1, action, reward, state2, _ = tuple(vec)
-            self._learn_incr(state1, action, reward, state2)
-
-        # Remove inserted episode
-        self._episode_list.pop()
+        # Start over as in a new episode, the traces of the current one are restored afterwards
+        traces = self._traces
+        self._start_episode()
+        for state1, action, reward, state2 in self._episodes.transitions(ix):
+            self._learn_transition(state1, action, reward, state2)
+        self._traces = traces
 
 
     @staticmethod
@@ -72,31 +289,237 @@ class TemporalDifferenceLearner(Learner):
             list(vec_a.keys()) + list(vec_b.keys())])
 
 
-    def converge(self, atol=1E-3, max_iter=1000, max_time=0):
-        ''' Train over already fitted data over and over until convergence '''
-
-        stopwatch = time.time() + max_time
-        def give_up():
-            raise RuntimeError('Convergence not achieved after %d iterations and %.03f seconds,'
-                               'current squared diff: %f'
-                               % (max_iter, time.time() - stopwatch + max_time, curr_diff))
-
-        curr_diff = atol
+    def _iter_converge(self, atol=1E-3, max_iter=1000):
+        '''
+        Re-learn every episode fitted over and over, yielding after each of them. Yields the squared
+        difference of the values before and after every full pass, and `None` otherwise.
+        '''
         prev_vals = {key: 0 for key in self._values.keys()}
         for _ in range(max_iter):
 
-            for j in range(len(self._episode_list)):
+            for j in range(len(self._episodes)):
                 self._learn_episode(j)
+                if j < len(self._episodes) - 1:
+                    yield None
 
             try:
                 curr_diff = self._vec_diff(prev_vals, self._values)
             except OverflowError:
-                pass
+                curr_diff = None
             prev_vals = self._copy_values()
-            if curr_diff < atol:
-                return self._values
-            elif max_time > 0 and stopwatch < time.time():
-                give_up()
+            yield curr_diff
+            if curr_diff is not None and curr_diff < atol:
+                return
+
+
+    def _index_transitions(self):
+        '''
+        Columns of every transition stored, where the <state, action> that transitions start from
+        are numbered as unknowns. Returns `(keys, states1, key_ids, next_ids, rewards, positions)`:
+        the <state, action> of every unknown, then for every transition the id of its state in the
+        episode store, the unknowns it starts from and leads to, its reward and its position within
+        its episode. Successors that are never started from keep their current value, which is
+        added to the reward, and have a `next_ids` of -1.
+        '''
+        states1, actions, rewards, states2, starts = self._episodes.columns()
+        positions = np.arange(len(rewards)) - np.repeat(starts, np.diff(
+            np.append(starts, len(rewards))))
+
+        # Unknowns are numbered by their <state, action> ids combined into a single one
+        n_actions = max(1, len(self._episodes.actions))
+        codes, key_ids = np.unique(states1 * n_actions + actions, return_inverse=True)
+        key_ids = key_ids.ravel()
+        next_codes = states2 * n_actions + actions
+        next_ids = np.searchsorted(codes, next_codes)
+        known = next_ids < len(codes)
+        known[known] = codes[next_ids[known]] == next_codes[known]
+        next_ids[~known] = -1
+
+        state_key, action_key = self._episodes.states.key, self._episodes.actions.key
+        unknown_codes, inverse = np.unique(next_codes[~known], return_inverse=True)
+        fixed_values = np.zeros(len(rewards))
+        fixed_values[~known] = np.array([self.val(state_key(code // n_actions), action_key(
+            code % n_actions)) for code in unknown_codes.tolist()], dtype=float)[inverse.ravel()]
+        rewards = rewards + self._discount_factor * fixed_values
+
+        keys = [(state_key(code // n_actions), action_key(code % n_actions))
+                for code in codes.tolist()]
+        return keys, states1, key_ids, next_ids, rewards, positions
+
+
+    def _max_lag(self, positions):
+        ''' Number of past transitions whose traces are still above `trace_cutoff` '''
+        return max_lag(positions, self._discount_factor * self._lambda, self.trace_cutoff)
+
+
+    def _lstd_system(self):
+        '''
+        Accumulate the sufficient statistics of LSTD(lambda) over every episode fitted: the sparse
+        matrix `A = sum_t z_t (x_t - discount_factor * x'_t)^T` as `(rows, cols, data)` and the
+        vector `b = sum_t z_t r_t`. Unknowns `x_t` are the <state, action> that transitions start
+        from, and `z_t` their eligibility traces, truncated at `trace_cutoff`. Successors that are
+        never started from keep their current value, which goes into `b`.
+        '''
+        keys, _, key_ids, next_ids, rewards, positions = self._index_transitions()
+        n_keys = len(keys)
+        known = next_ids >= 0
+
+        # Traces decay by the same factor at every step, so the contribution of the transition
+        # `lag` steps back within the same episode can be added for all transitions at once
+        decay = self._discount_factor * self._lambda
+        rows, cols, data = [], [], []
+        target = np.zeros(n_keys)
+        steps = np.arange(len(key_ids))
+        for lag in range(self._max_lag(positions)):
+            steps = steps[positions[steps] >= lag]
+            weight = decay ** lag
+            traces = key_ids[steps - lag]
+            rows.extend([traces, traces[known[steps]]])
+            cols.extend([key_ids[steps], next_ids[steps][known[steps]]])
+            data.extend([np.full(len(steps), weight),
+                         np.full(np.count_nonzero(known[steps]), -self._discount_factor * weight)])
+            target += np.bincount(traces, weight * rewards[steps], minlength=n_keys)
+
+        # Merge the entries of the same row and column
+        cells, inverse = np.unique(
+            np.concatenate(rows) * n_keys + np.concatenate(cols), return_inverse=True) if rows \
+            else (np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp))
+        data = np.bincount(inverse.ravel(), np.concatenate(data) if data else None,
+                           minlength=len(cells))
+        return keys, (cells // max(1, n_keys), cells % max(1, n_keys), data), target
+
+
+    def _iter_converge_batch(self, atol=1E-3, max_iter=1000, deterministic=False):
+        '''
+        Batch TD(lambda): every pass computes the TD errors of all the transitions stored from the
+        values as of the start of the pass, and moves the value of every <state, action> by the
+        learning rate given to the constructor, which does not decay from pass to pass, times the
+        average of the errors it was eligible for, weighted by its eligibility. Like LSTD(lambda),
+        errors are those of the actions taken, so once passes converge the values solve the same
+        system. Episodes are split into `n_jobs` blocks of about as many transitions, whose sums are
+        computed by a pool of as many processes and added as they complete, or in order of the
+        blocks with `deterministic=True` so that values are the same from run to run. Transitions
+        are copied to shared memory once, where the values are written at the start of every pass
+        for the processes to read. Yields the squared difference of the values before and after
+        every pass.
+        '''
+        index = self._index_transitions()
+        keys, states1 = index[:2]
+        columns = index[2:]
+        edges = np.append(self._episodes.columns()[4], len(states1))
+        bounds = np.unique(edges[np.searchsorted(
+            edges, np.linspace(0, len(states1), max(self.n_jobs, 1) + 1))]).tolist()
+        blocks = list(zip(bounds[:-1], bounds[1:]))
+        params = (self._discount_factor, self._discount_factor * self._lambda, self.trace_cutoff)
+
+        pool = None
+        if len(blocks) > 1:
+            shared = _share(list(columns) + [np.zeros(len(keys))])
+            shared_values = _shared_views(shared)[4]
+            pool = Pool(len(blocks), initializer=_init_worker, initargs=(shared, params))
+        try:
+            for _ in range(max_iter):
+                values = np.array([self.val(*key) for key in keys], dtype=float)
+                if pool is None:
+                    sums = [batch_sums(bounds, columns, values, *params) for bounds in blocks]
+                else:
+                    shared_values[:] = values
+                    sums = (pool.imap if deterministic else pool.imap_unordered)(
+                        _worker_sums, blocks)
+
+                errors_sum, eligibility_sum = np.zeros(len(keys)), np.zeros(len(keys))
+                for errors, eligibilities in sums:
+                    errors_sum += errors
+                    eligibility_sum += eligibilities
+                steps = self._learning_discount * errors_sum / np.maximum(eligibility_sum, 1E-12)
+                for (state, action), val in zip(keys, (values + steps).tolist()):
+                    self._set_value(state, action, val)
+
+                curr_diff = float(np.dot(steps, steps))
+                yield curr_diff
+                if curr_diff < atol:
+                    return
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+
+    def _converge_lstd(self, atol=1E-3, max_iter=1000, max_time=0):
+        ''' Solve the LSTD(lambda) system and set the values of every <state, action> in it '''
+        stopwatch = time.time()
+        keys, (rows, cols, data), target = self._lstd_system()
+        n_keys = len(keys)
+        error = 0
+        if n_keys <= self.lstd_dense_limit:
+            matrix = np.zeros((n_keys, n_keys))
+            matrix[rows, cols] = data
+            try:
+                solution = np.linalg.solve(matrix, target)
+            except np.linalg.LinAlgError:
+                solution = np.linalg.lstsq(matrix, target, rcond=None)[0]
+        else:
+            product = lambda values: np.bincount(rows, data * values[cols], minlength=n_keys)
+            init_values = np.array([self.val(*key) for key in keys], dtype=float)
+            steps = planning.iter_bicgstab(product, target, init_values)
+            for _, (solution, error) in zip(range(max_iter + 1), steps):
+                if error < atol or (max_time > 0 and stopwatch + max_time < time.time()):
+                    break
+            steps.close()
+
+        for (state, action), val in zip(keys, solution.tolist()):
+            self._set_value(state, action, val)
+        if error >= atol:
+            raise RuntimeError('Convergence not achieved after %d iterations and %.03f seconds, '
+                               'current mean squared residual: %f, values so far were kept'
+                               % (max_iter, time.time() - stopwatch, error))
+        return self._values
+
+
+    def converge(self, atol=1E-3, max_iter=1000, max_time=0, method='replay',  # pylint: disable=arguments-differ, too-many-arguments
+                 deterministic=False):
+        '''
+        Train over already fitted data until convergence.
+
+        Parameters
+        ----------
+        method : str
+            With `'replay'`, every episode is learned again over and over until the squared
+            difference of the values between passes is below `atol`. With `'lstd'`, the values
+            that TD(lambda) converges to over the episodes fitted are solved for directly, by
+            least-squares TD: a dense linear solve up to `lstd_dense_limit` <state, action>, and
+            BiCGSTAB over the sparse system until its mean squared residual is below `atol`
+            otherwise. With `'batch'`, passes of batch TD(lambda) over all the episodes at once are
+            split across `n_jobs` processes, until the squared difference of the values between
+            passes is below `atol`, and converge to the same values as LSTD. Unlike replay, LSTD
+            and batch TD evaluate the actions taken rather than the best ones, which only makes a
+            difference when there is more than one action.
+        deterministic : bool
+            With `method='batch'`, add up the work of the processes in the same order every time
+            rather than as it completes, so that values are the same from run to run.
+        '''
+        if method == 'lstd':
+            return self._converge_lstd(atol, max_iter, max_time)
+        elif method not in ('replay', 'batch'):
+            raise ValueError('Unknown method %r, expected "replay", "batch" or "lstd"' % method)
+
+        stopwatch = time.time() + max_time
+        def give_up():
+            raise RuntimeError('Convergence not achieved after %d iterations and %.03f seconds,'
+                               'current squared diff: %f'
+                               % (max_iter, time.time() - stopwatch + max_time, curr_diff))
+
+        curr_diff = atol
+        steps = self._iter_converge(atol, max_iter) if method == 'replay' else \
+            self._iter_converge_batch(atol, max_iter, deterministic)
+        try:
+            for diff in steps:
+                curr_diff = curr_diff if diff is None else diff
+                if diff is not None and diff < atol:
+                    return self._values
+                elif max_time > 0 and stopwatch < time.time():
+                    give_up()
+        finally:
+            steps.close()
 
         give_up()
-            
\ No newline at end of file
@@ -0,0 +1,256 @@
+import numpy as np
+
+
+class TransitionModel(object):
+    '''
+    Sufficient statistics of the observed <state1, action, state2, reward> transitions. Every
+    distinct <state1, action, state2> is an entry with a transition count, a reward count and a
+    running sum of rewards, all kept in growable arrays, so that recording an observation is an
+    O(1) update and memory is constant per entry regardless of how often it is visited.
+
+    The maximum likelihood estimates derived from the statistics are cached too, and only the
+    <state1, action> rows that received new observations are recomputed by `estimates()`.
+    '''
+
+    def __init__(self, capacity=64):
+        self._index = {}
+        self._row_index = {}
+        self._row_entries = []
+        self._size = 0
+        self._row_ids = np.zeros(capacity, dtype=np.int64)
+        self._states1 = np.zeros(capacity, dtype=np.int64)
+        self._actions = np.zeros(capacity, dtype=np.int64)
+        self._states2 = np.zeros(capacity, dtype=np.int64)
+        self._transition_counts = np.zeros(capacity)
+        self._reward_counts = np.zeros(capacity)
+        self._reward_sums = np.zeros(capacity)
+        self._probabilities = np.zeros(capacity)
+        self._mean_rewards = np.zeros(capacity)
+        self._dirty_rows = set()
+
+
+    def _grow(self):
+        for name in ['_row_ids', '_states1', '_actions', '_states2', '_transition_counts',
+                     '_reward_counts', '_reward_sums', '_probabilities', '_mean_rewards']:
+            arr = getattr(self, name)
+            grown = np.zeros(2 * len(arr), dtype=arr.dtype)
+            grown[:len(arr)] = arr
+            setattr(self, name, grown)
+
+
+    def add(self, state1, action, state2):
+        ''' Retrieve the index of entry <state1, action, state2>, creating it if necessary '''
+        key = (state1, action, state2)
+        ix = self._index.get(key)
+        if ix is None:
+            ix = self._index[key] = self._size
+            if self._size == len(self._states1):
+                self._grow()
+            self._states1[ix] = state1
+            self._actions[ix] = action
+            self._states2[ix] = state2
+            row = self._row_index.get((state1, action))
+            if row is None:
+                row = self._row_index[(state1, action)] = len(self._row_entries)
+                self._row_entries.append([])
+            self._row_entries[row].append(ix)
+            self._row_ids[ix] = row
+            self._size += 1
+        return ix
+
+
+    def observe(self, state1, action, state2, reward):
+        ''' Record a single transition '''
+        ix = self.add(state1, action, state2)
+        self._transition_counts[ix] += 1
+        self._reward_counts[ix] += 1
+        self._reward_sums[ix] += reward
+        self._dirty_rows.add((state1, action))
+        return ix
+
+
+    def add_columns(self, states1, actions, states2):
+        '''
+        Vectorized `add()` of arrays of distinct <state1, action, state2>, creating any new entries
+        in the order given
+        '''
+        keys = list(zip(states1.tolist(), actions.tolist(), states2.tolist()))
+        ixs = np.array([self._index.get(key, -1) for key in keys], dtype=np.int64)
+        new = np.flatnonzero(ixs < 0)
+        if len(new):
+            while self._size + len(new) > len(self._states1):
+                self._grow()
+            new_ixs = np.arange(self._size, self._size + len(new))
+            ixs[new] = new_ixs
+            entries = slice(self._size, self._size + len(new))
+            self._states1[entries] = states1[new]
+            self._actions[entries] = actions[new]
+            self._states2[entries] = states2[new]
+
+            self._index.update(zip([keys[i] for i in new.tolist()], new_ixs.tolist()))
+
+            # Group the new entries by <state1, action> row, rows also created in the order given
+            new_states1, new_actions = states1[new], actions[new]
+            order = np.lexsort((new_actions, new_states1))
+            breaks = np.flatnonzero((np.diff(new_states1[order]) != 0) |
+                                    (np.diff(new_actions[order]) != 0)) + 1
+            starts = np.concatenate([[0], breaks]).astype(np.int64)
+            ends = np.concatenate([breaks, [len(new)]]).astype(np.int64)
+            group_rows = np.zeros(len(starts), dtype=np.int64)
+            sorted_ixs = new_ixs[order].tolist()
+            for group in np.argsort(order[starts], kind='mergesort').tolist():
+                start, end = int(starts[group]), int(ends[group])
+                key = (int(new_states1[order[start]]), int(new_actions[order[start]]))
+                row = self._row_index.get(key)
+                if row is None:
+                    row = self._row_index[key] = len(self._row_entries)
+                    self._row_entries.append([])
+                self._row_entries[row].extend(sorted_ixs[start:end])
+                group_rows[group] = row
+            self._row_ids[new_ixs[order]] = np.repeat(group_rows, ends - starts)
+            self._size += len(new)
+        return ixs
+
+
+    def observe_columns(self, states1, actions, states2, rewards):
+        '''
+        Record a batch of transitions given as arrays of integers, with the same result as
+        observing them one at a time
+        '''
+        columns = [np.asarray(column, dtype=np.int64) for column in [states1, actions, states2]]
+        if not len(columns[0]):
+            return
+
+        # Distinct <state1, action, state2> in order of first appearance, encoded as a single
+        # integer whenever they fit in one
+        dims = [int(column.max()) + 1 for column in columns]
+        if min(column.min() for column in columns) >= 0 and dims[0] * dims[1] * dims[2] < 2 ** 62:
+            keys = np.ravel_multi_index(columns, dims)
+            _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        else:
+            _, first, inverse = np.unique(
+                np.stack(columns, axis=1), axis=0, return_index=True, return_inverse=True)
+        inverse = inverse.ravel()
+        order = np.argsort(first)
+        counts = np.bincount(inverse, minlength=len(first))[order]
+        sums = np.bincount(inverse, rewards, minlength=len(first))[order]
+
+        ixs = self.add_columns(*[column[first[order]] for column in columns])
+        self._transition_counts[ixs] += counts
+        self._reward_counts[ixs] += counts
+        self._reward_sums[ixs] += sums
+        self._dirty_rows.update(zip(self._states1[ixs].tolist(), self._actions[ixs].tolist()))
+
+
+    def add_transitions(self, state1, action, state2, count=1):
+        ''' Record `count` transitions without any reward information '''
+        ix = self.add(state1, action, state2)
+        self._transition_counts[ix] += count
+        self._dirty_rows.add((state1, action))
+        return ix
+
+
+    def add_rewards(self, state1, action, state2, total, count=1):
+        ''' Record `count` rewards adding up to `total` without counting transitions '''
+        ix = self.add(state1, action, state2)
+        self._reward_counts[ix] += count
+        self._reward_sums[ix] += total
+        self._dirty_rows.add((state1, action))
+        return ix
+
+
+    def index(self, key, default=None):
+        return self._index.get(key, default)
+
+
+    def row_entries(self, state1, action):
+        ''' Indices of the entries that start at `state1` after taking `action` '''
+        row = self._row_index.get((state1, action))
+        return [] if row is None else self._row_entries[row]
+
+
+    def reset_transitions(self):
+        ''' Forget all transition counts, but keep the entries '''
+        self._transition_counts[:] = 0
+        self._dirty_rows.update(self._row_index)
+
+
+    def reset_rewards(self):
+        ''' Forget all reward statistics, but keep the entries '''
+        self._reward_counts[:] = 0
+        self._reward_sums[:] = 0
+        self._dirty_rows.update(self._row_index)
+
+
+    def estimates(self):
+        '''
+        Retrieve the maximum likelihood transition probability and mean reward of every entry,
+        recomputing only the rows that changed since the last call. The arrays returned are owned
+        by the model and change on subsequent calls.
+        '''
+        if len(self._dirty_rows) * 8 > len(self._row_index):
+            # Past a handful of rows, one vectorized pass over all entries is cheaper
+            row_ids = self._row_ids[:self._size]
+            counts = self._transition_counts[:self._size]
+            totals = np.bincount(row_ids, counts)[row_ids]
+            self._probabilities[:self._size] = counts / np.where(totals > 0, totals, 1)
+            self._mean_rewards[:self._size] = self._reward_sums[:self._size] / np.maximum(
+                self._reward_counts[:self._size], 1)
+        else:
+            for row in self._dirty_rows:
+                ixs = self._row_entries[self._row_index[row]]
+                counts = self._transition_counts[ixs]
+                total = counts.sum()
+                self._probabilities[ixs] = counts / total if total > 0 else 0
+                self._mean_rewards[ixs] = self._reward_sums[ixs] / np.maximum(
+                    self._reward_counts[ixs], 1)
+        self._dirty_rows.clear()
+        return self._probabilities[:self._size], self._mean_rewards[:self._size]
+
+
+    @property
+    def n_rows(self):
+        ''' Number of distinct <state1, action> observed '''
+        return len(self._row_index)
+
+
+    @property
+    def states1(self):
+        return self._states1[:self._size]
+
+
+    @property
+    def actions(self):
+        return self._actions[:self._size]
+
+
+    @property
+    def states2(self):
+        return self._states2[:self._size]
+
+
+    @property
+    def transition_counts(self):
+        return self._transition_counts[:self._size]
+
+
+    @property
+    def reward_counts(self):
+        return self._reward_counts[:self._size]
+
+
+    @property
+    def reward_sums(self):
+        return self._reward_sums[:self._size]
+
+
+    def keys(self):
+        return list(zip(self.states1.tolist(), self.actions.tolist(), self.states2.tolist()))
+
+
+    def __contains__(self, key):
+        return key in self._index
+
+
+    def __len__(self):
+        return self._size
@@ -1,14 +1,32 @@
+import time
+import random
+import numpy as np
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+from rltools.buffers import ReplayBuffer
 from rltools.learners import Learner
 
 
 def norm(vec_a, vec_b):
     num = min(len(vec_a), len(vec_b))
-    return sum([(vec_a[i] - vec_b[i]) ** 2 for i in range(num)]) ** 0.5
+    return float(np.linalg.norm(np.asarray(vec_a[:num], dtype=float) -
+                                np.asarray(vec_b[:num], dtype=float)))
 
 
 def linear_combination(weights, values):
     num = min(len(weights), len(values))
-    return sum([weights[i] * values[i] for i in range(num)]) / float(num)
+    return float(np.dot(np.asarray(weights[:num], dtype=float),
+                        np.asarray(values[:num], dtype=float))) / num
+
+
+def sparse_combination(weights, features):
+    ''' Average of the `weights` at the active `(indices, values)` of sparse features '''
+    indices, values = features
+    return float(np.dot(np.asarray(weights)[indices], values)) / max(1, len(indices))
 
 
 class ValueFunctionApproximation(Learner):
@@ -16,36 +34,179 @@ class ValueFunctionApproximation(Learner):
     Value function approximation learner. Instead of a discrete state space, assume that each state
     is a vector of features and that the value of any state can be estimated by a parametrized
     function.
+
+    Parameters of every action are kept as the rows of the `weights` matrix, of `dof` columns, and
+    updated along the gradient of `value_fn` with respect to them. The gradient of the default
+    `linear_combination` is computed analytically, that of other value functions by `gradient_fn`
+    if given and by finite differences otherwise.
+
+    Batches of transitions, for example sampled from a `rltools.buffers.ReplayBuffer`, can be
+    learned at once with `fit_batch()`, which is vectorized for the default `linear_combination`.
+
+    States can instead be featurized by `features`, such as a `rltools.features.TileCoder` or
+    `RBF`, into the indices of the few features active and their values. Their value is then the
+    `sparse_combination` of the weights at those indices, which are the only ones updated, so
+    learning costs as much as there are active features rather than `dof`.
+
+    With `max_transitions`, up to that many of the transitions learned are kept in a `ReplayBuffer`
+    that grows as needed, for `converge()` to solve for the weights over all of them by fitted
+    Q-iteration.
+
+    Parameters
+    ----------
+    value_fn : callable, optional
+        Function of `(params, state)` giving the value of `state`, where `params` is the row of
+        `weights` of the action taken as a NumPy array, and `state` its features if `features` is
+        given.
+    gradient_fn : callable, optional
+        Function of `(params, state)` giving the gradient of `value_fn` with respect to `params`.
+    features : callable, optional
+        Function of a state giving the `(indices, values)` of its active features, all below
+        `dof`. Wrap it in a `rltools.features.FeatureCache` for states seen again to skip it.
+    max_transitions : int
+        Largest number of transitions kept for `converge()`, after which the oldest ones are
+        overwritten. Zero, the default, keeps none, so that online learning stores nothing. None
+        are kept with `features` either.
     '''
 
-    def __init__(self, dof, discount_factor=0.75, learning_rate=0.9, value_fn=None):
+    # Every update of the parameters changes the value of every state
+    _cache_best = False
+
+    # Step of the finite differences that approximate the gradient of `value_fn`
+    _gradient_step = 1E-6
+
+    # Defaults for instances pickled before these attributes existed
+    max_transitions = 0
+    features = None
+    _memory = None
+
+    def __init__(self, dof, discount_factor=0.75, learning_rate=0.9, value_fn=None,  # pylint: disable=too-many-arguments
+                 gradient_fn=None, max_transitions=0, features=None):
         Learner.__init__(self, discount_factor, learning_rate)
 
         self.dof = dof
-        self.params = {}
-        self.value_fn = linear_combination if value_fn is None else value_fn
+        self.weights = np.zeros((0, dof))
+        self._rows = {}
+        self.features = features
+        self.value_fn = value_fn if value_fn is not None else \
+            linear_combination if features is None else sparse_combination
+        self.gradient_fn = gradient_fn
+        self.max_transitions = max_transitions
+
+
+    def __setstate__(self, state):
+        # Learners pickled before parameters were kept in a matrix had a list of them by action
+        params = state.pop('params', None)
+        state.setdefault('gradient_fn', None)
+        self.__dict__.update(state)
+        if params is not None:
+            self.params = params
+
+
+    @property
+    def params(self):
+        ''' Parameters of every action, as views of the rows of `weights` '''
+        return {action: self.weights[row] for action, row in self._rows.items()}
+
+
+    @params.setter
+    def params(self, params):
+        actions = list(params.keys())
+        self._all_actions.update(actions)
+        self._rows = {action: row for row, action in enumerate(actions)}
+        self.weights = np.array([params[action] for action in actions], dtype=float).reshape(
+            len(actions), self.dof)
+
+
+    def _row(self, action):
+        ''' Row of `weights` of `action`, adding one with random parameters if there is none '''
+        row = self._rows.get(action)
+        if row is None:
+            # Make dimensionality of parameters equal to the provided degrees of freedom
+            row = self._rows[action] = len(self.weights)
+            self.weights = np.vstack([self.weights, [random.random() for _ in range(self.dof)]])
+        return row
+
+
+    def _remember(self, states, rows, rewards, next_states):
+        '''
+        Keep transitions for `converge()`, with the row of `weights` of their action. The buffer
+        doubles in capacity when full until it reaches `max_transitions`. Raw states featurized by
+        `features` need not be numeric, and `converge()` does not learn from them, so none are kept.
+        '''
+        if not self.max_transitions or self.features is not None:
+            return
+        states = np.atleast_2d(np.asarray(states, dtype=float))
+        memory = self._memory
+        size = len(states) + (len(memory) if memory is not None else 0)
+        if memory is None or (memory.capacity < size and memory.capacity < self.max_transitions):
+            capacity = memory.capacity if memory is not None else 1024
+            while capacity < size:
+                capacity *= 2
+            self._memory = ReplayBuffer(min(capacity, self.max_transitions),
+                                        state_shape=states.shape[1:], state_dtype=float)
+            if memory is not None:
+                self._memory.extend(*memory.take(slice(0, len(memory))))
+        self._memory.extend(states, rows, rewards, next_states)
+
+
+    def _featurize(self, state):
+        return state if self.features is None else self.features(state)
+
+
+    def _is_sparse(self):
+        ''' Whether only the weights of the active features need to be updated '''
+        return self.value_fn is sparse_combination and self.gradient_fn is None
 
 
     def val(self, state, action):
-        params = self.params.get(action, [0 for _ in range(self.dof)])
-        return self.value_fn(params, state)
+        row = self._rows.get(action)
+        params = self.weights[row] if row is not None else np.zeros(self.dof)
+        return self.value_fn(params, self._featurize(state))
+
+
+    def _action_values(self, state, actions):
+        '''
+        Values of `state` for each of `actions`, all at once for `linear_combination` and
+        `sparse_combination`
+        '''
+        state = self._featurize(state)
+        if self.value_fn is linear_combination and len(self.weights):
+            num = min(self.dof, len(state))
+            values = self.weights[:, :num].dot(np.asarray(state[:num], dtype=float)) / float(num)
+        elif self.value_fn is sparse_combination and len(self.weights):
+            indices, values = state
+            values = self.weights[:, indices].dot(values) / float(max(1, len(indices)))
+        else:
+            zeros = np.zeros(self.dof)
+            return np.array([self.value_fn(self.weights[self._rows[action]] if action in
+                                           self._rows else zeros, state) for action in actions],
+                            dtype=float)
+        return np.array([values[self._rows[action]] if action in self._rows else 0.
+                         for action in actions])
+
+
+    def _greedy(self, state):
+        actions = list(self._all_actions)
+        values = self._action_values(state, actions)
+        best = float(values.max()) if len(values) else 0
+        return best, [action for action, value in zip(actions, values.tolist())
+                      if best - value < self._tie_atol]
 
 
     def _learn_incr(self, prev_state, action, reward, curr_state):
         ''' Incrementally update value estimates after observing a transition between states '''
 
         # Keep a set of parameters for every action
-        if action not in self.params:
-            # Make dimensionality of parameters equal to the provided degrees of freedom
-            self.params[action] = [random.random() for _ in range(self.dof)]
+        row = self._row(action)
 
         # The estimated value is just the output from the value function approximation
-        estimated_value = self.value_fn(self.params[action], curr_state)
+        estimated_value = self.value_fn(self.weights[row], self._featurize(curr_state))
 
         # Future reward is estimated as the discounted largest value of future state over all
         # possible actions
         future_reward = self._discount_factor * \
-            max([self.val(curr_state, action_) for action_ in self.get_actions()])
+            self.best_value(curr_state)
 
         # The total error will be reward + discounted future value - estimated current value,
         # decayed by the learning rate
@@ -53,21 +214,282 @@ class ValueFunctionApproximation(Learner):
 
         # Update the weights (parameters) based on the amount of error by computing dv/dw for each
         # weight
-        weight_deltas = self.derivative_params(prev_state, action)
-        for i in range(self.dof):
-            self.params[action][i] += total_error * weight_deltas[i]
-            self.params[action][i] = max(-1, min(1, self.params[action][i]))
+        if self._is_sparse():
+            # Only the weights of the active features change
+            indices, values = self._featurize(prev_state)
+            weights = self.weights[row]
+            np.add.at(weights, indices, total_error * values / float(max(1, len(indices))))
+            weights[indices] = np.clip(weights[indices], -1, 1)
+        else:
+            weight_deltas = self.derivative_params(prev_state, action)
+            self.weights[row] = np.clip(self.weights[row] + total_error * weight_deltas, -1, 1)
+        self._remember([prev_state], [row], [reward], [curr_state])
+
+
+    def fit_batch(self, states, actions, rewards, next_states, synchronous=True, weights=None):  # pylint: disable=too-many-arguments, too-many-locals
+        '''
+        Learn a batch of <state, action, reward, next_state> transitions, where `states` and
+        `next_states` are 2-D arrays with one feature vector per row. Parameters are updated as in
+        `_learn_incr()`, using the current learning rate.
+
+        Parameters
+        ----------
+        synchronous : bool
+            If True, the errors of every transition are computed from the parameters prior to the
+            batch and the updates of transitions that share the same action add up, before being
+            clipped. If False, transitions are learned one after the other.
+        weights : array, optional
+            Factor applied to the learning rate of each transition, for example the importance
+            weights of a `PrioritizedReplayBuffer`.
+
+        Returns
+        -------
+        errors : array
+            Temporal difference error of every transition with respect to the parameters prior to
+            the batch when `synchronous`, otherwise `None`.
+        '''
+        states, next_states = np.atleast_2d(states), np.atleast_2d(next_states)
+        actions, rewards = np.asarray(actions), np.asarray(rewards, dtype=float)
+        if not len(states) == len(actions) == len(rewards) == len(next_states):
+            raise ValueError('Columns must all have the same length, got %d, %d, %d and %d' % (
+                len(states), len(actions), len(rewards), len(next_states)))
+        learning_rates = self._learning_rate * (
+            np.ones(len(states)) if weights is None else np.asarray(weights, dtype=float))
+
+        if not synchronous:
+            learning_rate = self._learning_rate
+            try:
+                for state, action, reward, next_state, rate in zip(
+                        states.tolist(), actions.tolist(), rewards.tolist(), next_states.tolist(),
+                        learning_rates.tolist()):
+                    self._all_actions.add(action)
+                    self._learning_rate = rate
+                    self._learn_incr(state, action, reward, next_state)
+            finally:
+                self._learning_rate = learning_rate
+            return None
+
+        rows = self._action_rows(actions)
+        errors = self._fit_rows(states, rows, rewards, next_states, learning_rates)
+        self._remember(states, rows, rewards, next_states)
+        return errors
+
+
+    def _action_rows(self, actions):
+        ''' Rows of `weights` of every one of `actions` '''
+        unique_actions, inverse = np.unique(actions, return_inverse=True)
+        for action in unique_actions.tolist():
+            self._all_actions.add(action)
+        return np.array([self._row(action) for action in unique_actions.tolist()],
+                        dtype=np.intp)[inverse.ravel()]
+
+
+    def _fit_rows(self, states, rows, rewards, next_states, learning_rates):  # pylint: disable=too-many-arguments, too-many-locals
+        ''' Synchronous update of `fit_batch()` given the rows of `weights` of every action '''
+        all_actions = sorted(self._rows, key=self._rows.get)
+
+        if self.value_fn is linear_combination and self.features is None:
+            # Values of every transition for every action, and their gradients, as matrix products
+            num = min(self.dof, states.shape[1])
+            next_values = next_states[:, :num].dot(self.weights[:, :num].T) / float(num)
+            derivatives = states[:, :num] / float(num)
+        else:
+            next_values = np.array([self._action_values(state, all_actions)
+                                    for state in next_states.tolist()])
+            derivatives = None if self._is_sparse() else np.array([
+                self.derivative_params(state, all_actions[row]) for state, row in
+                zip(states.tolist(), rows.tolist())])
+
+        # Same error as `_learn_incr()`, with the estimated value taken from the next state
+        estimated_values = next_values[np.arange(len(rows)), rows]
+        errors = rewards + self._discount_factor * next_values.max(axis=1) - estimated_values
+        if derivatives is None:
+            # Only the weights of the active features change
+            cells, deltas = [[], []], []
+            for state, row, error in zip(states.tolist(), rows.tolist(),
+                                         (learning_rates * errors).tolist()):
+                indices, values = self._featurize(state)
+                cells[0].append(np.full(len(indices), row, dtype=np.intp))
+                cells[1].append(indices)
+                deltas.append(error * values / float(max(1, len(indices))))
+            cells = tuple(np.concatenate(axis).astype(np.intp) for axis in cells)
+            np.add.at(self.weights, cells, np.concatenate(deltas))
+            self.weights[cells] = np.clip(self.weights[cells], -1, 1)
+        else:
+            # Gradient steps of every action add up as the product of the derivatives with a
+            # matrix of the learning rate times the error of each transition taken with it
+            scaled_errors = np.zeros((len(self.weights), len(rows)))
+            scaled_errors[rows, np.arange(len(rows))] = learning_rates * errors
+            deltas = np.dot(scaled_errors, derivatives)
+            touched = np.unique(rows)
+            width = derivatives.shape[1]
+            self.weights[touched, :width] = np.clip(
+                self.weights[touched, :width] + deltas[touched], -1, 1)
+        return errors
+
+
+    def fit_minibatches(self, states, actions, rewards, next_states, batch_size=256,  # pylint: disable=too-many-arguments
+                        n_epochs=1, shuffle=True, n_threads=None):
+        '''
+        Learn transitions given as columns, like `fit_batch()`, in synchronous minibatches of
+        `batch_size` transitions. Every minibatch computes the values of the next states for all
+        actions in one matrix product and applies the clipped gradient steps of all its
+        transitions at once, so larger batches make for fewer and larger BLAS calls.
+
+        Parameters
+        ----------
+        n_epochs : int
+            Number of passes over all the transitions.
+        shuffle : bool
+            Visit the transitions in a new random order, drawn from `numpy.random`, every epoch.
+        n_threads : int, optional
+            Number of threads that BLAS uses for the matrix products, which requires
+            `threadpoolctl`, installed along with the `threads` extra of this package:
+            `pip install rltools[threads]`. By default it is left as configured, usually one per
+            core.
+
+        Returns
+        -------
+        errors : array
+            Temporal difference error of every transition in its last epoch, in the order given.
+        '''
+        if n_threads is None:
+            return self._fit_minibatches(states, actions, rewards, next_states, batch_size,
+                                         n_epochs, shuffle)
+        if threadpool_limits is None:
+            raise ImportError('Setting the number of BLAS threads requires threadpoolctl, see '
+                              'the threads extra of rltools')
+        with threadpool_limits(limits=n_threads, user_api='blas'):
+            return self._fit_minibatches(states, actions, rewards, next_states, batch_size,
+                                         n_epochs, shuffle)
+
+
+    def _fit_minibatches(self, states, actions, rewards, next_states, batch_size, n_epochs,  # pylint: disable=too-many-arguments
+                         shuffle):
+        states, next_states = np.atleast_2d(states), np.atleast_2d(next_states)
+        rewards = np.asarray(rewards, dtype=float)
+        if not len(states) == len(actions) == len(rewards) == len(next_states):
+            raise ValueError('Columns must all have the same length, got %d, %d, %d and %d' % (
+                len(states), len(actions), len(rewards), len(next_states)))
+
+        # Transitions are kept for `converge()` once, rather than once per epoch
+        rows = self._action_rows(np.asarray(actions))
+        learning_rates = np.full(len(rewards), self._learning_rate)
+        errors = np.zeros(len(rewards))
+        batch_size = max(1, batch_size)
+        for _ in range(n_epochs):
+            order = np.random.permutation(len(rewards)) if shuffle else np.arange(len(rewards))
+            for start in range(0, len(order), batch_size):
+                batch = order[start:start + batch_size]
+                errors[batch] = self._fit_rows(states[batch], rows[batch], rewards[batch],
+                                               next_states[batch], learning_rates[batch])
+        self._remember(states, rows, rewards, next_states)
+        return errors
 
 
     def derivative_params(self, state, action):
-        deltas = []
-        params = self.params[action]
+        ''' Gradient of the value of `state` with respect to the parameters of `action` '''
+        row = self._rows.get(action)
+        params = self.weights[row] if row is not None else np.zeros(self.dof)
+        state = self._featurize(state)
+        if self.gradient_fn is not None:
+            return np.asarray(self.gradient_fn(params, state), dtype=float)
+
+        if self.value_fn is sparse_combination:
+            indices, values = state
+            gradient = np.zeros(self.dof)
+            np.add.at(gradient, indices, np.asarray(values, dtype=float) / max(1, len(indices)))
+            return gradient
+
+        if self.value_fn is linear_combination:
+            num = min(self.dof, len(state))
+            gradient = np.zeros(self.dof)
+            gradient[:num] = np.asarray(state[:num], dtype=float) / num
+            return gradient
+
+        gradient = np.zeros(self.dof)
+        value = self.value_fn(params, state)
+        shifted = params.copy()
         for i in range(self.dof):
-            only_one = [params[j] if j == i else 0 for j in range(self.dof)]
-            deltas.append(self.value_fn(only_one, state))
-        return deltas
+            shifted[i] += self._gradient_step
+            gradient[i] = (self.value_fn(shifted, state) - value) / self._gradient_step
+            shifted[i] = params[i]
+        return gradient
+
+
+    def _iter_converge(self, atol=1E-3, max_iter=1000):
+        '''
+        Fitted Q-iteration over the transitions kept, yielding the squared difference of the
+        weights before and after every iteration. See `converge()`.
+        '''
+        if self.value_fn is not linear_combination or self.features is not None:
+            raise NotImplementedError('Fitted Q-iteration is only implemented for the default '
+                                      'linear_combination of states without features')
+        if not self.max_transitions:
+            raise ValueError('No transitions are kept to converge over, create the learner with '
+                             'max_transitions > 0')
+        memory = self._memory
+        if memory is None or len(memory) == 0:
+            return
+        states, rows, rewards, next_states = memory.take(slice(0, len(memory)))
+        num = min(self.dof, states.shape[1])
+
+        # Transitions are sorted by action, so that the normal equations of each action are set
+        # up from a contiguous block of states. They only depend on the states, so their
+        # pseudo-inverses are computed once. Next states are transposed for faster products.
+        order = np.argsort(rows, kind='mergesort')
+        states, rewards = states[order, :num], rewards[order]
+        next_states = np.ascontiguousarray(next_states[order, :num].T)
+        solved, bounds = np.unique(rows[order], return_index=True)
+        blocks = list(zip(solved.tolist(), bounds.tolist(), np.append(bounds[1:], len(rows))))
+        inverses = [np.linalg.pinv(np.dot(states[start:end].T, states[start:end]))
+                    for _, start, end in blocks]
+        for _ in range(max_iter):
+            # Value of every transition as its reward plus the discounted best value of its next
+            # state, where actions that were never learned have a value of zero
+            next_values = np.dot(self.weights[:, :num], next_states) / float(num)
+            best_values = next_values.max(axis=0)
+            if len(self._all_actions) > len(self.weights):
+                best_values = np.maximum(best_values, 0)
+            targets = rewards + self._discount_factor * best_values
+
+            # Least-squares weights of every action given its targets, scaled as in the linear
+            # combination
+            weights = self.weights.copy()
+            for (row, start, end), inverse in zip(blocks, inverses):
+                weights[row, :num] = num * np.dot(inverse, np.dot(targets[start:end],
+                                                                  states[start:end]))
+            curr_diff = float(np.sum((weights - self.weights) ** 2))
+            self.weights = weights
+            yield curr_diff
+            if curr_diff < atol:
+                return
 
 
     def converge(self, atol=1E-3, max_iter=1000, max_time=0):
-        ''' Train over already fitted data over and over until convergence '''
-        # TODO
\ No newline at end of file
+        '''
+        Train over the transitions kept by fitted Q-iteration: the weights of every action are
+        solved for by least squares, so that the value of each transition it was taken in matches
+        its reward plus the discounted best value of its next state under the previous weights,
+        until the squared difference of the weights between iterations is below `atol`. Each
+        iteration takes a few matrix products. Weights are solved for exactly, without the
+        clipping of online updates. Only implemented for the default `linear_combination` of
+        states without `features`, and for learners created with `max_transitions > 0`, since no
+        transitions are kept otherwise.
+        '''
+        stopwatch = time.time()
+        curr_diff = None
+        steps = self._iter_converge(atol, max_iter)
+        try:
+            for curr_diff in steps:
+                if curr_diff < atol:
+                    return self.weights
+                elif max_time > 0 and stopwatch + max_time < time.time():
+                    break
+        finally:
+            steps.close()
+        if curr_diff is None:
+            return self.weights
+        raise RuntimeError('Convergence not achieved after %d iterations and %.03f seconds, '
+                           'current squared diff: %f' % (max_iter, time.time() - stopwatch,
+                                                         curr_diff))
@@ -0,0 +1,417 @@
+import numpy as np
+
+try:
+    from collections.abc import MutableMapping
+except ImportError:  # Python 2
+    from collections import MutableMapping
+
+
+class Interner(object):
+    '''
+    Maps arbitrary hashable ids to dense, contiguous integer indices assigned in order of first
+    appearance, and back.
+    '''
+
+    def __init__(self, keys=None):
+        self._indices = {}
+        self._keys = []
+        for key in keys or []:
+            self.intern(key)
+
+
+    def intern(self, key):
+        ''' Retrieve the index of `key`, assigning the next free one if it has never been seen '''
+        ix = self._indices.get(key)
+        if ix is None:
+            ix = self._indices[key] = len(self._keys)
+            self._keys.append(key)
+        return ix
+
+
+    def intern_many(self, keys):
+        '''
+        Vectorized `intern()` of an array of keys, returning an array of their indices. New keys are
+        assigned indices in order of first appearance within the array, and the rows of a 2D array
+        are interned as tuples.
+        '''
+        keys = np.asarray(keys)
+        if keys.ndim > 1:
+            return np.array([self.intern(tuple(row)) for row in keys.tolist()], dtype=np.intp)
+        if keys.dtype == object:
+            return np.array([self.intern(key) for key in keys.tolist()], dtype=np.intp)
+        unique_keys, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        ixs = np.zeros(len(unique_keys), dtype=np.intp)
+        order = np.argsort(first)
+        ixs[order] = [self.intern(key) for key in unique_keys[order].tolist()]
+        return ixs[inverse.ravel()]
+
+
+    def add(self, key):
+        ''' Set-like alias of `intern()`, so that an interner can keep track of the ids seen '''
+        self.intern(key)
+
+
+    def update(self, keys):
+        for key in keys:
+            self.intern(key)
+
+
+    def index(self, key, default=None):
+        ''' Retrieve the index of `key` without interning it '''
+        return self._indices.get(key, default)
+
+
+    def key(self, ix):
+        ''' Reverse lookup of the id that was assigned index `ix` '''
+        return self._keys[ix]
+
+
+    def keys(self):
+        return list(self._keys)
+
+
+    def retain(self, keep):
+        '''
+        Release the index of every key but those marked in the boolean array `keep`, and renumber
+        the ones kept in the same order. Returns an array mapping every former index to its new
+        one, or to -1 if released.
+        '''
+        keep = np.asarray(keep, dtype=bool)
+        mapping = np.where(keep, np.cumsum(keep) - 1, -1)
+        self._keys = [key for key, kept in zip(self._keys, keep.tolist()) if kept]
+        self._indices = {key: ix for ix, key in enumerate(self._keys)}
+        return mapping
+
+
+    def copy(self):
+        other = Interner()
+        other._indices = dict(self._indices)  # pylint: disable=protected-access
+        other._keys = list(self._keys)  # pylint: disable=protected-access
+        return other
+
+
+    def __len__(self):
+        return len(self._keys)
+
+
+    def __contains__(self, key):
+        return key in self._indices
+
+
+    def __iter__(self):
+        return iter(self._keys)
+
+
+class ValueTable(MutableMapping):
+    '''
+    Dense storage for <state, action> value estimates. Values live in a growable 2-D float array
+    with one row per state and one column per action, plus an index from state and action ids to
+    rows and columns. Behaves like the `dict` keyed by `(state, action)` tuples that `Learner`
+    uses by default, at 9 bytes per entry plus an index entry of about 120 bytes per distinct state
+    and action, against roughly 120 bytes per entry for the `dict`. With 8 actions per state that
+    is about a fifth of the memory, and the ratio grows with the number of actions. Reading and
+    writing single entries costs about as much as with the `dict`; the speedups come from
+    vectorized code working on `array` directly.
+
+    Parameters
+    ----------
+    values : mapping of <(state, action), value>, optional
+        Initial values, for example the `dict` of a learner created without a value table.
+    n_states, n_actions : int
+        Number of rows and columns preallocated. Either dimension doubles whenever it runs out.
+    states, actions : Interner, optional
+        Index of the state and action ids to rows and columns, for example one that a learner
+        also keeps its known states in. Ids can be interned in it without a value, their row or
+        column is only allocated once needed.
+    '''
+
+    def __init__(self, values=None, n_states=16, n_actions=1, states=None, actions=None):  # pylint: disable=too-many-arguments
+        self._states = Interner() if states is None else states
+        self._actions = Interner() if actions is None else actions
+        self._array = np.zeros((n_states, n_actions))
+        self._mask = np.zeros((n_states, n_actions), dtype=bool)
+        self._count = 0
+        for key, val in (values or {}).items():
+            self[key] = val
+
+
+    @property
+    def states(self):
+        ''' Index of state ids to rows of `array` '''
+        return self._states
+
+
+    @property
+    def actions(self):
+        ''' Index of action ids to columns of `array` '''
+        return self._actions
+
+
+    @property
+    def array(self):
+        ''' View of the `(n_states, n_actions)` values, where missing entries read as zero '''
+        self._grow(len(self._states), len(self._actions))
+        return self._array[:len(self._states), :len(self._actions)]
+
+
+    @property
+    def nbytes(self):
+        return self._array.nbytes + self._mask.nbytes
+
+
+    def _grow(self, n_rows, n_cols):
+        rows, cols = self._array.shape
+        if n_rows <= rows and n_cols <= cols:
+            return
+        while rows < n_rows:
+            rows *= 2
+        while cols < n_cols:
+            cols *= 2
+        array = np.zeros((rows, cols))
+        mask = np.zeros((rows, cols), dtype=bool)
+        array[:self._array.shape[0], :self._array.shape[1]] = self._array
+        mask[:self._mask.shape[0], :self._mask.shape[1]] = self._mask
+        self._array, self._mask = array, mask
+
+
+    def locate(self, state, action):
+        ''' Retrieve the `(row, col)` of <state, action>, allocating space for it if necessary '''
+        row = self._states.intern(state)
+        col = self._actions.intern(action)
+        self._grow(row + 1, col + 1)
+        return row, col
+
+
+    def blend(self, state, action, val, weight):
+        '''
+        Set the value of <state, action> to `val * weight + (1 - weight) * value`, where `value` is
+        its current value or zero if missing, with a single lookup. Returns the value set.
+        '''
+        row, col = self.locate(state, action)
+        if self._mask[row, col]:
+            val = val * weight + (1.0 - weight) * self._array.item(row, col)
+        else:
+            val = val * weight
+            self._mask[row, col] = True
+            self._count += 1
+        self._array[row, col] = val
+        return val
+
+
+    def locate_many(self, states, actions):
+        '''
+        Vectorized `locate()` of every <states[i], actions[i]> given as arrays, returning arrays of
+        rows and columns
+        '''
+        rows = self._states.intern_many(states)
+        cols = self._actions.intern_many(actions)
+        self._grow(len(self._states), len(self._actions))
+        return rows, cols
+
+
+    def rows_of(self, states):
+        ''' Rows of the array of `states`, or -1 for those without one '''
+        unique_states, inverse = np.unique(states, return_inverse=True)
+        rows = np.array([self._states.index(state, -1) for state in unique_states.tolist()],
+                        dtype=np.intp)
+        return rows[inverse.ravel()]
+
+
+    def add_at(self, rows, cols, values):
+        ''' Add `values` to the entries at `rows` and `cols`, where repeated entries add up '''
+        np.add.at(self._array, (rows, cols), values)
+        new = ~self._mask[rows, cols]
+        if new.any():
+            self._count += len(np.unique(rows[new] * self._array.shape[1] + cols[new]))
+            self._mask[rows[new], cols[new]] = True
+
+
+    def assign(self, states, actions, values):
+        ''' Set the values of every <state, action> in `states` x `actions` at once '''
+        rows = np.array([self._states.intern(state) for state in states], dtype=np.intp)
+        cols = np.array([self._actions.intern(action) for action in actions], dtype=np.intp)
+        self._grow(len(self._states), len(self._actions))
+        block = np.ix_(rows, cols)
+        self._count += np.count_nonzero(~self._mask[block])
+        self._mask[block] = True
+        self._array[block] = values
+
+
+    def _cell(self, key):
+        ''' Retrieve the `(row, col)` of `key`, or `None` if it has no space allocated '''
+        state, action = key
+        row = self._states.index(state)
+        col = self._actions.index(action)
+        if row is None or col is None or row >= self._mask.shape[0] or \
+            col >= self._mask.shape[1]:
+            return None
+        return row, col
+
+
+    def get(self, key, default=None):
+        # Hot path of `Learner.val()`: reads the index dicts and the arrays directly, leaves the
+        # bounds check to the arrays, and only reads the mask for values of zero, since entries
+        # without a value always hold zero
+        state, action = key
+        row = self._states._indices.get(state)  # pylint: disable=protected-access
+        col = self._actions._indices.get(action)  # pylint: disable=protected-access
+        if row is None or col is None:
+            return default
+        try:
+            val = self._array.item(row, col)
+        except IndexError:
+            return default
+        return val if val or self._mask.item(row, col) else default
+
+
+    def copy(self):
+        other = ValueTable(n_states=1)
+        other._states = self._states.copy()  # pylint: disable=protected-access
+        other._actions = self._actions.copy()  # pylint: disable=protected-access
+        other._array = self._array.copy()  # pylint: disable=protected-access
+        other._mask = self._mask.copy()  # pylint: disable=protected-access
+        other._count = self._count  # pylint: disable=protected-access
+        return other
+
+
+    def __getitem__(self, key):
+        val = self.get(key)
+        if val is None:
+            raise KeyError(key)
+        return val
+
+
+    def __setitem__(self, key, val):
+        state, action = key
+        row = self._states._indices.get(state)  # pylint: disable=protected-access
+        col = self._actions._indices.get(action)  # pylint: disable=protected-access
+        if row is None or col is None:
+            row, col = self.locate(state, action)
+        try:
+            known = self._mask.item(row, col)
+        except IndexError:
+            row, col = self.locate(state, action)
+            known = False
+        if not known:
+            self._mask[row, col] = True
+            self._count += 1
+        self._array[row, col] = val
+
+
+    def __delitem__(self, key):
+        cell = self._cell(key)
+        if cell is None or not self._mask[cell]:
+            raise KeyError(key)
+        row, col = cell
+        self._mask[row, col] = False
+        self._array[row, col] = 0
+        self._count -= 1
+
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+
+    def __iter__(self):
+        rows, cols = np.nonzero(self._mask)
+        for row, col in zip(rows.tolist(), cols.tolist()):
+            yield (self._states.key(row), self._actions.key(col))
+
+
+    def __len__(self):
+        return self._count
+
+
+class ValueSnapshot(object):
+    '''
+    Copy-on-write snapshot of the values in a `dict` or `ValueTable`, which costs nothing to take.
+    Only the entries written after the snapshot are copied, by calling `save()` or `save_cells()`
+    right before writing them; every other entry is read from the values themselves.
+
+    For a `ValueTable`, saved entries are kept in arrays of the same shape as the table along with
+    the epoch in which each was saved, so that `reset()` starts a new snapshot just by moving on
+    to the next epoch.
+    '''
+
+    def __init__(self, values):
+        self._values = values
+        self._saved = {}
+        self._created = set()
+        self._epoch = 1
+        self._epochs = np.zeros((0, 0), dtype=np.int64)
+        self._saved_array = np.zeros((0, 0))
+        self._saved_mask = np.zeros((0, 0), dtype=bool)
+
+
+    @property
+    def values(self):
+        ''' Values this is a snapshot of '''
+        return self._values
+
+
+    def reset(self):
+        ''' Take a new snapshot of the current values '''
+        self._saved = {}
+        self._created = set()
+        self._epoch += 1
+
+
+    def _grow(self):
+        shape = self._values._array.shape  # pylint: disable=protected-access
+        if self._epochs.shape == shape:
+            return
+        rows, cols = self._epochs.shape
+        epochs = np.zeros(shape, dtype=np.int64)
+        saved_array = np.zeros(shape)
+        saved_mask = np.zeros(shape, dtype=bool)
+        epochs[:rows, :cols] = self._epochs
+        saved_array[:rows, :cols] = self._saved_array
+        saved_mask[:rows, :cols] = self._saved_mask
+        self._epochs, self._saved_array, self._saved_mask = epochs, saved_array, saved_mask
+
+
+    def _peek(self, key, default=None):
+        ''' Value of `key` in a `dict` or `BoundedValues`, which is not counted as a use of it '''
+        peek = getattr(self._values, 'peek', None)
+        return self._values.get(key, default) if peek is None else peek(key, default)
+
+
+    def save(self, key):
+        ''' Keep the value of `key` as of the snapshot, before it is written '''
+        if isinstance(self._values, ValueTable):
+            row, col = self._values.locate(*key)
+            self.save_cells(np.array([row]), np.array([col]))
+        elif key not in self._saved and key not in self._created:
+            val = self._peek(key)
+            if val is None:
+                self._created.add(key)
+            else:
+                self._saved[key] = val
+
+
+    def save_cells(self, rows, cols):
+        ''' Vectorized `save()` of the `ValueTable` entries at `rows` and `cols` '''
+        self._grow()
+        new = self._epochs[rows, cols] != self._epoch
+        rows, cols = rows[new], cols[new]
+        self._saved_array[rows, cols] = self._values._array[rows, cols]  # pylint: disable=protected-access
+        self._saved_mask[rows, cols] = self._values._mask[rows, cols]  # pylint: disable=protected-access
+        self._epochs[rows, cols] = self._epoch
+
+
+    def get(self, key, default=None):
+        ''' Value of `key` as of the snapshot '''
+        if not isinstance(self._values, ValueTable):
+            if key in self._created:
+                return default
+            return self._saved[key] if key in self._saved else self._peek(key, default)
+
+        state, action = key
+        row = self._values.states.index(state)
+        col = self._values.actions.index(action)
+        if row is None or col is None:
+            return default
+        if row < self._epochs.shape[0] and col < self._epochs.shape[1] and \
+            self._epochs[row, col] == self._epoch:
+            return float(self._saved_array[row, col]) if self._saved_mask[row, col] else default
+        return self._values.get(key, default)
@@ -18,12 +18,11 @@ class EpsilonGreedyStrategy(Strategy):
 
 
     def policy(self, state, valid_actions=None):
-        valid_actions = self._parse_valid_actions(valid_actions)
-
         # Every 1/e times, pick random action
         roll = random.random()
         if roll < self._epsilon(self.learner._curr_episode):  # pylint: disable=protected-access
-            return valid_actions[random.randint(0, len(valid_actions) - 1)]
+            actions = self._parse_valid_actions(valid_actions)
+            return actions[random.randint(0, len(actions) - 1)]
 
         # Otherwise, pick the action with highest value
         return self._greedy_policy(state, valid_actions)
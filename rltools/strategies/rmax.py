@@ -47,10 +47,9 @@ class RMaxStrategy(Strategy):
         # optimistic expectation of unseen transitions
         num_updates = 0
         confidence_atol = 1E-3
-        n_states = max(self.optimistic_learner.get_states()) + 1
-        n_actions = max(self.optimistic_learner.get_actions()) + 1
-        for action in range(n_actions):
-            for state_ in range(n_states):
+        states = self.optimistic_learner.get_states()
+        for action in self.optimistic_learner.get_actions():
+            for state_ in states:
                 confidence = self._confidence(
                     self._transition_count.get((state_, action), 0))
                 if confidence < 1.0 - confidence_atol:
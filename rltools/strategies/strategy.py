@@ -32,6 +32,12 @@ class Strategy(object):
 
 
     def _greedy_policy(self, state, valid_actions=None, value_fn=None):
+        # Over all the actions known to the learner, it keeps track of the best ones already
+        if not valid_actions and not self.valid_actions and value_fn is None:
+            best_actions = self.learner.best_actions(state)
+            if best_actions:
+                return best_actions[random.randint(0, len(best_actions) - 1)]
+
         valid_actions = self._parse_valid_actions(valid_actions)
         value_fn = value_fn or self.learner.val
 
@@ -41,12 +47,12 @@ class Strategy(object):
 
         # Pick the action with highest value
         action_values = [(value_fn(state, action), action) for action in valid_actions]
-        sorted_values = sorted(action_values, key=lambda x: -x[0])
+        best_value = max([value for value, _ in action_values])
 
         # In case of a tie, choose randomly
         atol = 1E-5
-        equal_values = [v for v in sorted_values if abs(v[0] - sorted_values[0][0]) < atol]
-        return equal_values[random.randint(0, len(equal_values) - 1)][1]
+        equal_values = [action for value, action in action_values if best_value - value < atol]
+        return equal_values[random.randint(0, len(equal_values) - 1)]
 
 
     def policy(self, state, valid_actions=None):
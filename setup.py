@@ -17,6 +17,10 @@ with open('HISTORY.rst') as history_file:
 requirements = [
 ]
 
+extra_requirements = {
+    'threads': ['threadpoolctl'],
+}
+
 test_requirements = [
     'unittest2'
 ]
@@ -31,6 +35,8 @@ setup(
     url='https://github.com/omtinez/rltools',
     packages=[
         'rltools',
+        'rltools.buffers',
+        'rltools.features',
         'rltools.domains',
         'rltools.learners',
         'rltools.strategies',
@@ -39,6 +45,7 @@ setup(
                  'rltools'},
     include_package_data=True,
     install_requires=requirements,
+    extras_require=extra_requirements,
     license="MIT",
     zip_safe=False,
     keywords='rltools',
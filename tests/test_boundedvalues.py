@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_boundedvalues
+----------------------------------
+
+Tests for `boundedvalues` module.
+"""
+
+import pickle
+import functools
+import unittest2
+
+from tests.test_learner import TestLearner
+from rltools.learners import Learner, QLearner, TemporalDifferenceLearner
+from rltools.learners.boundedvalues import BoundedValues
+from rltools.learners.episodestore import EpisodeStore
+from rltools.learners.valuetable import ValueSnapshot
+
+
+class TestBoundedValues(unittest2.TestCase):
+    # pylint: disable=protected-access, invalid-name
+
+
+    def test_000_lru(self):
+        values = BoundedValues(3)
+        for state in range(3):
+            self.assertEqual(values.put((state, 0), state), [])
+        self.assertEqual(values.get((0, 0)), 0)
+        self.assertEqual(values.put((3, 0), 3), [(1, 0)])
+        values[(2, 0)] = 20
+        self.assertEqual(values.put((4, 0), 4), [(0, 0)])
+        self.assertEqual(sorted(values.items()), [((2, 0), 20), ((3, 0), 3), ((4, 0), 4)])
+        self.assertIsNone(values.get((1, 0)))
+        self.assertEqual((values.hits, values.misses, values.evictions), (1, 1, 2))
+        self.assertEqual(values.hit_rate, 0.5)
+        self.assertRaises(ValueError, BoundedValues, 3, eviction='fifo')
+
+
+    def test_001_lfu(self):
+        values = BoundedValues(3, eviction='lfu')
+        for state in range(3):
+            values[(state, 0)] = state
+        for _ in range(2):
+            values.get((0, 0))
+        values.get((1, 0))
+        values.get((2, 0))
+
+        # Ties between the least used go to the least recently used
+        self.assertEqual(values.put((3, 0), 3), [(1, 0)])
+        self.assertEqual(values.put((4, 0), 4), [(3, 0)])
+        values.get((4, 0))
+        values.get((4, 0))
+        self.assertEqual(values.put((5, 0), 5), [(2, 0)])
+
+        # Deleting the least used entries leaves others as the least used
+        del values[(5, 0)]
+        values[(6, 0)] = 6
+        self.assertEqual(values.put((7, 0), 7), [(6, 0)])
+        self.assertEqual(sorted(values.keys()), [(0, 0), (4, 0), (7, 0)])
+        self.assertEqual(values.evictions, 4)
+
+
+    def test_002_states(self):
+        values = BoundedValues(2, eviction='lfu')
+        values[('a', 0)] = 1
+        values[('a', 1)] = 1
+        self.assertTrue(values.has_state('a'))
+        values[('b', 0)] = 1
+        self.assertTrue(values.has_state('a'))
+        values[('c', 0)] = 1
+        self.assertFalse(values.has_state('a'))
+        self.assertTrue(values.has_state('c'))
+
+        # Iterating does not count as using the entries
+        list(values.items())
+        self.assertEqual(values.hit_rate, None)
+        up_values = pickle.loads(pickle.dumps(values))
+        self.assertEqual(up_values.put(('d', 0), 1), [('b', 0)])
+
+
+    def test_003_bounded_learner(self):
+        for eviction in ['lru', 'lfu']:
+            learner = QLearner(max_entries=50, eviction=eviction)
+            for _ in range(20):
+                learner.fit([(state, state % 2, 1) for state in range(100)])
+            self.assertEqual(len(learner._values), 50)
+            self.assertLessEqual(len(learner.get_states()), 50)
+            stats = learner.eviction_stats
+            self.assertEqual(stats['entries'], 50)
+            self.assertGreater(stats['evictions'], 0)
+            self.assertEqual(stats['hit_rate'],
+                             float(stats['hits']) / (stats['hits'] + stats['misses']))
+            for state, action in learner._values:
+                self.assertIn(state, learner.get_states())
+                self.assertEqual(learner.best_value(state), max(
+                    learner.val(state, action_) for action_ in learner.get_actions()))
+        self.assertIsNone(QLearner().eviction_stats)
+        self.assertRaises(ValueError, QLearner, dense=True, max_entries=50)
+
+        # With room for every value and episode, the learner is the same as an unbounded one
+        episodes = [[(state, 0, state == 4) for state in range(5)] for _ in range(10)]
+        td1 = TemporalDifferenceLearner(discount_factor=0.9)
+        td2 = TemporalDifferenceLearner(discount_factor=0.9, max_entries=5, eviction='lfu',
+                                        episodes=EpisodeStore())
+        for td in [td1, td2]:
+            for episode in episodes:
+                td.fit(episode)
+            td.converge()
+        self.assertEqual(td2.eviction_stats['evictions'], 0)
+        for state in range(5):
+            self.assertEqual(td1.val(state, 0), td2.val(state, 0))
+
+
+    def test_004_bounded_memory(self):
+        # Every state and id kept stays within the bounds when states are never seen again
+        for eviction in ['lru', 'lfu']:
+            learners = [QLearner(max_entries=100, eviction=eviction),
+                        TemporalDifferenceLearner(max_entries=100, eviction=eviction)]
+            for learner in learners:
+                for episode in range(1000):
+                    learner.fit([((episode, step), step % 3, 1) for step in range(5)])
+                    for step in range(5):
+                        learner.best_value((episode, step))
+                self.assertLessEqual(len(learner._all_states), 100)
+                self.assertLessEqual(len(learner._best), 100)
+                self.assertEqual(learner.get_states(), set(state for state, _ in learner._values))
+            td = learners[1]
+            self.assertLessEqual(td._episodes.n_transitions, 100)
+            self.assertLessEqual(len(td.state_ids), 2 * 100)
+            self.assertEqual(set(td.state_ids), set(
+                state for ep in td._episodes for tup in ep for state in [tup[0], tup[3]]))
+        self.assertRaises(ValueError, TemporalDifferenceLearner, dense=True,
+                          episodes=EpisodeStore(release_ids=True))
+
+
+    def test_005_peek(self):
+        # Peeking neither uses entries nor counts as a lookup
+        values = BoundedValues(2)
+        values[('a', 0)] = 1
+        values[('b', 0)] = 2
+        self.assertEqual(values.peek(('a', 0)), 1)
+        self.assertEqual(values.peek(('c', 0), 0), 0)
+        self.assertEqual(values.put(('c', 0), 3), [('a', 0)])
+        self.assertIsNone(values.hit_rate)
+
+        # Nor do snapshots of the values
+        snapshot = ValueSnapshot(values)
+        snapshot.save(('b', 0))
+        snapshot.save(('d', 0))
+        values[('b', 0)] = 20
+        values[('d', 0)] = 4
+        self.assertEqual(snapshot.get(('b', 0)), 2)
+        self.assertIsNone(snapshot.get(('d', 0)))
+        self.assertIsNone(values.hit_rate)
+
+        # Nor actions without a value when looking for the best ones of a state
+        learner = QLearner(max_entries=10)
+        learner._set_value(0, 0, 1)
+        learner._set_value(1, 2, 1)
+        self.assertEqual(learner.best_actions(0), [0])
+        stats = learner.eviction_stats
+        self.assertEqual((stats['hits'], stats['misses']), (1, 0))
+
+
+class TestBoundedLearner(TestLearner):
+    # pylint: disable=protected-access, invalid-name
+
+
+    def setUp(self):
+        self.cls = functools.partial(Learner, max_entries=1000)
+
+
+    def tearDown(self):
+        pass
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest2.main())
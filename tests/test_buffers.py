@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_buffers
+----------------------------------
+
+Tests for `buffers` module.
+"""
+
+import random
+import numpy as np
+import unittest2
+
+from rltools.buffers import SumTree, ReplayBuffer, PrioritizedReplayBuffer
+from rltools.learners import QLearner, ValueFunctionApproximation
+from rltools.learners.valuefunctionapprox import linear_combination
+
+
+class TestBuffers(unittest2.TestCase):
+    # pylint: disable=protected-access, invalid-name
+
+
+    def setUp(self):
+        pass
+
+
+    def tearDown(self):
+        pass
+
+
+    def test_000_sum_tree(self):
+        tree = SumTree(5)
+        tree.update([0, 1, 2, 3, 4], [1, 0, 2, 3, 4])
+        self.assertEqual(tree.total, 10)
+        self.assertEqual(tree.find([0, 0.5, 1, 2.9, 3, 5.9, 6, 9.9, 10]).tolist(),
+                         [0, 0, 2, 2, 3, 3, 4, 4, 4])
+        tree.update(4, 0)
+        tree.update([0, 0], [5, 2])
+        self.assertEqual(tree.total, 7)
+        self.assertEqual(tree[[0, 4]].tolist(), [2, 0])
+        self.assertEqual(tree.find([6.9, 7, 100]).tolist(), [3, 3, 3])
+        self.assertRaises(ValueError, tree.update, [1], [-1])
+
+
+    def test_001_ring_buffer(self):
+        buffer = ReplayBuffer(4, seed=0)
+        self.assertRaises(ValueError, buffer.sample, 1)
+        nbytes = buffer.nbytes
+        for i in range(3):
+            self.assertEqual(buffer.add(i, i % 2, -i, i + 1), i)
+        self.assertEqual(buffer.extend([3, 4, 5], [1, 0, 1], [-3, -4, -5], [4, 5, 6]).tolist(),
+                         [3, 0, 1])
+        self.assertEqual(len(buffer), 4)
+        self.assertEqual(buffer.nbytes, nbytes)
+        self.assertEqual([column.tolist() for column in buffer.take([0, 1, 2, 3])],
+                         [[4, 5, 2, 3], [0, 1, 0, 1], [-4, -5, -2, -3], [5, 6, 3, 4]])
+
+        # More transitions than capacity keep the last ones only
+        buffer.extend(range(10), range(10), range(10), range(10))
+        self.assertEqual(sorted(buffer.take(np.arange(4))[0].tolist()), [6, 7, 8, 9])
+
+        states, actions, rewards, next_states = buffer.sample(1000)
+        self.assertEqual(set(states.tolist()), set([6, 7, 8, 9]))
+        self.assertEqual(states.tolist(), actions.tolist())
+        self.assertEqual(rewards.tolist(), next_states.tolist())
+
+        features = ReplayBuffer(10, state_shape=(3,), state_dtype=float)
+        features.add([1, 2, 3], 0, 1, [4, 5, 6])
+        self.assertEqual(features.sample(2)[3].tolist(), [[4, 5, 6], [4, 5, 6]])
+
+
+    def test_002_prioritized_sampling(self):
+        buffer = PrioritizedReplayBuffer(8, alpha=1, epsilon=0, seed=0)
+        buffer.extend(range(8), [0] * 8, [0] * 8, range(8))
+        buffer.update_priorities(range(8), [0, 0, 0, 0, 0, 0, 1, 3])
+        counts = np.bincount(buffer.sample_indices(4000), minlength=8)
+        self.assertEqual(counts[:6].sum(), 0)
+        self.assertAlmostEqual(counts[7] / 4000., 0.75, delta=0.05)
+
+        weights = buffer.importance_weights([6, 7], beta=1)
+        self.assertEqual(weights.tolist(), [1, 1 / 3.])
+
+        # New transitions get the largest priority so far
+        buffer.add(8, 0, 0, 8)
+        self.assertEqual(buffer._tree[0], 3)
+
+
+    def test_003_prioritized_qlearning(self):
+        # Deterministic chain where only the last transition is rewarded
+        buffer = PrioritizedReplayBuffer(100, epsilon=0.1, seed=0)
+        buffer.extend(range(10), [0] * 10, [0] * 9 + [1], range(1, 11))
+        learner = QLearner(learning_rate=0.5, discount_factor=0.9, dense=True)
+        for _ in range(300):
+            indices = buffer.sample_indices(8)
+            errors = learner.fit_batch(*buffer.take(indices),
+                                       weights=buffer.importance_weights(indices))
+            buffer.update_priorities(indices, errors)
+        for state in range(10):
+            self.assertAlmostEqual(learner.val(state, 0), 0.9 ** (9 - state), places=3)
+
+
+    def test_004_value_function_approximation(self):
+        rnd = np.random.RandomState(0)
+        buffer = ReplayBuffer(100, state_shape=(4,), state_dtype=float, seed=0)
+        buffer.extend(rnd.rand(50, 4), rnd.randint(0, 3, 50), rnd.randn(50), rnd.rand(50, 4))
+        batch = buffer.sample(32)
+
+        # The vectorized linear combination matches any other value function
+        learner1 = ValueFunctionApproximation(4, learning_rate=0.5)
+        learner2 = ValueFunctionApproximation(
+            4, learning_rate=0.5, value_fn=lambda weights, values: linear_combination(
+                weights, values))
+        random.seed(0)
+        errors1 = learner1.fit_batch(*batch)
+        random.seed(0)
+        errors2 = learner2.fit_batch(*batch)
+        np.testing.assert_allclose(errors1, errors2)
+        for action in range(3):
+            np.testing.assert_allclose(learner1.params[action], learner2.params[action])
+
+        # A single transition learns the same either way
+        transition = [column[:1] for column in batch]
+        learner2.params = {key: list(val) for key, val in learner1.params.items()}
+        learner1.fit_batch(*transition)
+        learner2.fit_batch(*transition, synchronous=False)
+        for action in range(3):
+            np.testing.assert_allclose(learner1.params[action], learner2.params[action])
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest2.main())
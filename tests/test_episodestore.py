@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_episodestore
+----------------------------------
+
+Tests for `episodestore` module.
+"""
+
+import shutil
+import pickle
+import tempfile
+import unittest2
+
+from rltools.learners.episodestore import EpisodeStore
+
+
+def fill(store, n_episodes, length=10):
+    for episode in range(n_episodes):
+        store.start_episode()
+        for step in range(length):
+            store.append((episode, step), 'a%d' % (step % 2), float(episode), (episode, step + 1))
+
+
+class TestEpisodeStore(unittest2.TestCase):
+    # pylint: disable=protected-access, invalid-name
+
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+
+    def test_000_episodes(self):
+        store = EpisodeStore()
+        fill(store, 20, 7)
+        self.assertEqual(len(store), 20)
+        self.assertEqual(store.n_transitions, 140)
+        self.assertEqual(store.episode_length(-1), 7)
+        self.assertEqual(store.transitions(3)[1], ((3, 1), 'a1', 3., (3, 2)))
+        self.assertEqual([len(episode) for episode in store], [7] * 20)
+
+        states1, actions, rewards, states2, starts = store.columns()
+        self.assertEqual(starts.tolist(), list(range(0, 140, 7)))
+        self.assertEqual(store.states.key(states1[8]), (1, 1))
+        self.assertEqual(store.actions.key(actions[8]), 'a1')
+        self.assertEqual(store.states.key(states2[8]), (1, 2))
+        self.assertEqual(rewards[8], 1)
+        self.assertRaises(ValueError, EpisodeStore, eviction='random')
+
+
+    def test_001_eviction(self):
+        for eviction in ['oldest', 'reservoir']:
+            for path, release_ids in [(None, False), (self.path, False), (self.path, True)]:
+                store = EpisodeStore(max_bytes=EpisodeStore.TRANSITION_BYTES * 100,
+                                     eviction=eviction, path=path, seed=0, release_ids=release_ids)
+                fill(store, 200)
+                self.assertLessEqual(store.nbytes, EpisodeStore.TRANSITION_BYTES * 100)
+                self.assertLessEqual(store.n_transitions, 100)
+                self.assertEqual(store.evicted + len(store), 200)
+                if release_ids:
+                    self.assertEqual(len(store.actions), 2)
+                    self.assertEqual(set(store.states), set(
+                        state for ep in store for tup in ep for state in [tup[0], tup[3]]))
+                else:
+                    self.assertEqual(len(store.states), 200 * 11)
+
+                # The last episode is never evicted, and episodes stay in order
+                episodes = [episode[0][0][0] for episode in store]
+                self.assertEqual(episodes[-1], 199)
+                self.assertEqual(episodes, sorted(episodes))
+                for episode in store:
+                    self.assertEqual(episode, [((episode[0][0][0], step), 'a%d' % (step % 2),
+                                                episode[0][2], (episode[0][0][0], step + 1))
+                                               for step in range(10)])
+                if eviction == 'oldest':
+                    self.assertEqual(episodes, list(range(200 - len(episodes), 200)))
+                else:
+                    self.assertLess(episodes[0], 200 - len(episodes))
+
+        # A single episode can go over budget
+        store = EpisodeStore(max_bytes=EpisodeStore.TRANSITION_BYTES * 10)
+        fill(store, 1, 50)
+        self.assertEqual(store.n_transitions, 50)
+
+
+    def test_002_pickle(self):
+        for path in [None, self.path]:
+            store = EpisodeStore(path=path)
+            fill(store, 5)
+            up_store = pickle.loads(pickle.dumps(store))
+            fill(up_store, 3)
+            fill(store, 3)
+            self.assertEqual(list(up_store), list(store))
+
+        # Copies of stores kept on disk do not share their files
+        store = EpisodeStore(path=self.path)
+        fill(store, 5)
+        up_store = pickle.loads(pickle.dumps(store))
+        expected = list(up_store)
+        store._columns['rewards'][:] = -1
+        store._columns['rewards'].flush()
+        self.assertIsNone(up_store.path)
+        self.assertEqual(list(up_store), expected)
+        fill(up_store, 3)
+        self.assertEqual(set(store.columns()[2]), set([-1]))
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest2.main())
@@ -10,7 +10,7 @@ Tests for `epsilongreedy` module.
 
 import unittest2
 
-from rltools.learners import TemporalDifferenceLearner
+from rltools.learners import QLearner, TemporalDifferenceLearner
 from rltools.strategies import EpsilonGreedyStrategy
 
 
@@ -34,6 +34,18 @@ class TestEpsilonGreedyStrategy(unittest2.TestCase):
         strategy.fit([tup for i in range(10)])
         strategy.policy(0)
 
+
+    def test_001_greedy_ties(self):
+        learner = QLearner()
+        strategy = EpsilonGreedyStrategy(learner)
+        for action in range(4):
+            learner._set_value(0, action, 1 if action % 2 else 0)
+        self.assertEqual(set(strategy._greedy_policy(0) for _ in range(100)), set([1, 3]))
+        self.assertEqual(set(strategy._greedy_policy(0, [0, 2]) for _ in range(100)), set([0, 2]))
+        learner._set_value(0, 2, 2)
+        self.assertEqual(strategy._greedy_policy(0), 2)
+        self.assertEqual(strategy._greedy_policy(0, [0, 1]), 1)
+
     # TODO: Epsilon greedy strategy tests
 
 
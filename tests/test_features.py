@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_features
+----------------------------------
+
+Tests for `features` module.
+"""
+
+import numpy as np
+import unittest2
+
+from rltools.features import TileCoder, RBF, FeatureCache
+
+
+class TestFeatures(unittest2.TestCase):
+    # pylint: disable=protected-access, invalid-name
+
+
+    def setUp(self):
+        pass
+
+
+    def tearDown(self):
+        pass
+
+
+    def test_000_tile_coder(self):
+        coder = TileCoder(1024, n_tilings=4, tile_width=0.5)
+        indices, values = coder([0.1, 0.2])
+        self.assertEqual(len(indices), 4)
+        self.assertEqual(values.tolist(), [1] * 4)
+        self.assertTrue(((indices >= 0) & (indices < 1024)).all())
+
+        # Nearby states share most tiles, distant ones none, and the same state always the same
+        self.assertEqual(coder([0.1, 0.2])[0].tolist(), indices.tolist())
+        self.assertGreaterEqual(len(set(coder([0.15, 0.2])[0]) & set(indices)), 2)
+        self.assertEqual(len(set(coder([5.1, -3.2])[0]) & set(indices)), 0)
+        self.assertEqual(TileCoder(1024, n_tilings=4, tile_width=0.5)([0.1, 0.2])[0].tolist(),
+                         indices.tolist())
+
+        # Tiles are spread over every index
+        states = np.random.RandomState(0).uniform(-50, 50, (2000, 2))
+        counts = np.bincount(np.concatenate([coder(state)[0] for state in states]),
+                             minlength=1024)
+        self.assertGreater(np.count_nonzero(counts), 1000)
+
+
+    def test_001_rbf(self):
+        rbf = RBF([[0, 0], [1, 0], [10, 10]], width=1)
+        self.assertEqual(rbf.size, 3)
+        indices, values = rbf([0, 0])
+        self.assertEqual(indices.tolist(), [0, 1])
+        np.testing.assert_allclose(values, [1, np.exp(-0.5)])
+
+
+    def test_002_feature_cache(self):
+        calls = []
+        def features(state):
+            calls.append(state)
+            return np.array([int(state[0])]), np.ones(1)
+
+        cache = FeatureCache(features, maxsize=2)
+        cache([0, 1])
+        cache(np.array([0, 1]))
+        cache((1, 1))
+        cache([0, 1])
+        self.assertEqual(len(calls), 2)
+        cache((2, 1))
+        cache((1, 1))
+        self.assertEqual(len(calls), 4)
+        self.assertEqual((cache.hits, cache.misses, len(cache)), (2, 4, 2))
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest2.main())
@@ -10,6 +10,7 @@ Tests for `Learner` interface.
 
 import random
 import pickle
+import numpy as np
 import unittest2
 
 from rltools.learners import Learner
@@ -110,6 +111,77 @@ class TestLearner(unittest2.TestCase):
                          [up_learner2.val(i, 0) for i in range(4)])
 
 
+    def test_007_fit_lazy(self):
+        episodes = [[(random.randint(0, 5), random.randint(0, 2), random.random())
+                     for _ in range(random.randint(1, 6))] for _ in range(20)]
+        learner1 = self.cls(discount_factor=0.5, learning_rate=0.5)
+        learner2 = self.cls(discount_factor=0.5, learning_rate=0.5)
+        for episode in episodes:
+            learner1.fit(episode)
+            learner2.fit(tup for tup in episode)
+
+        self.assertEqual([learner1.val(i, j) for i in range(6) for j in range(3)],
+                         [learner2.val(i, j) for i in range(6) for j in range(3)])
+
+
+    def test_008_fit_columns(self):
+        episodes = [[(random.randint(0, 5), random.randint(0, 2), random.random())
+                     for _ in range(random.randint(1, 6))] for _ in range(20)]
+        transitions = [tup for episode in episodes for tup in episode]
+        episode_starts = np.array([i == 0 for episode in episodes for i in range(len(episode))])
+        states, actions, rewards = [np.array(column) for column in zip(*transitions)]
+
+        learner1 = self.cls(discount_factor=0.5, learning_rate=0.5)
+        learner2 = self.cls(discount_factor=0.5, learning_rate=0.5)
+        learner3 = self.cls(discount_factor=0.5, learning_rate=0.5)
+        for episode in episodes:
+            learner1.fit(episode)
+        learner2.fit_columns(states, actions, rewards, episode_starts)
+
+        # Batches that do not start with an episode continue the current one
+        learner3.fit_columns(states[:25], actions[:25], rewards[:25], episode_starts[:25])
+        learner3.fit_columns(states[25:], actions[25:], rewards[25:], episode_starts[25:])
+
+        expected = [learner1.val(i, j) for i in range(6) for j in range(3)]
+        for learner in [learner2, learner3]:
+            self.assertEqual(learner.get_states(), learner1.get_states())
+            self.assertEqual(learner.get_actions(), learner1.get_actions())
+            self.assertEqual([learner.val(i, j) for i in range(6) for j in range(3)], expected)
+        self.assertRaises(ValueError, learner2.fit_columns, states, actions[1:], rewards)
+
+
+    def test_009_best_actions(self):
+        learner = self.cls(discount_factor=0.5, learning_rate=0.5)
+        self.assertEqual(learner.best_actions(0), [])
+        for i in range(500):
+            state, action = random.randint(0, 4), random.randint(0, 3)
+            val = random.choice([-1, 0, 0.5, 1, 1 + 1E-6, 2])
+            if i % 2:
+                learner._set_value(state, action, val)
+            else:
+                learner._update_value(state, action, val)
+
+            # Cached results must match the ones computed from scratch
+            state = random.randint(0, 5)
+            action_values = [(learner.val(state, action_), action_)
+                             for action_ in learner.get_actions()]
+            best = max([value for value, _ in action_values])
+            self.assertEqual(learner.best_value(state), best)
+            self.assertEqual(sorted(learner.best_actions(state)), sorted(
+                [action_ for value, action_ in action_values if best - value < 1E-5]))
+
+
+    def test_010_state_ids(self):
+        # States and actions of any hashable type are indexed in the order they were first seen
+        learner = self.cls()
+        learner.fit([('a', 'x', 0), ((1, 2), 'y', 1), ('a', 0, 0.5), (3, 'x', 1)])
+        if learner.eviction_stats is None:
+            self.assertEqual(learner.state_ids.keys(), ['a', (1, 2), 3])
+            self.assertEqual(learner.action_ids.keys(), ['x', 'y', 0])
+            self.assertEqual(learner.get_states(), set(learner.state_ids))
+            self.assertEqual(learner.get_actions(), set(learner.action_ids))
+
+
 if __name__ == '__main__':
     import sys
     sys.exit(unittest2.main())
@@ -8,7 +8,13 @@ test_mldmp
 Tests for `maximum likelihood MDP` module.
 """
 
+import gc
+import time
 import random
+import pickle
+import weakref
+import threading
+import numpy as np
 import unittest2
 
 from tests.test_learner import TestLearner
@@ -78,6 +84,334 @@ class TestMLMDP(TestLearner):
         self.assertLess(rmse, 0.1)
 
 
+    def test_005_sparse_matrices(self):
+        learner = MLMDP(discount_factor=0.75, learning_rate=1, normalize_count=0)
+        learner.fit([(random.randint(0, 9), random.randint(0, 2), random.random())
+                     for _ in range(200)])
+        T, R = learner._calc_matrices()
+        T_sparse, R_sparse = learner._calc_sparse_matrices()
+        np.testing.assert_allclose(T_sparse.toarray(), T)
+        np.testing.assert_allclose(R_sparse.toarray(), R)
+
+        sparse_learner = MLMDP(discount_factor=0.75, learning_rate=1, normalize_count=0,
+                               sparse=True)
+        sparse_learner.__dict__.update(learner.__dict__)
+        sparse_learner.sparse = True
+        learner.converge(atol=1E-9)
+        sparse_learner.converge(atol=1E-9)
+        for state in range(10):
+            for action in range(3):
+                self.assertAlmostEqual(learner.val(state, action),
+                                       sparse_learner.val(state, action))
+
+
+    def test_006_sufficient_statistics(self):
+        n_states, n_actions = 8, 3
+        transitions = [(random.randint(0, n_states - 1), random.randint(0, n_actions - 1),
+                        random.random()) for _ in range(500)]
+        learner = MLMDP(normalize_count=0)
+        learner.fit(transitions)
+
+        # Maximum likelihood estimates computed from the full history of transitions
+        T = np.zeros((n_actions, n_states, n_states))
+        R = np.zeros((n_actions, n_states, n_states))
+        visits = np.zeros((n_actions, n_states, n_states))
+        for (state1, _, _), (state2, action, reward) in zip(transitions, transitions[1:]):
+            T[action, state1, state2] += 1
+            R[action, state1, state2] += reward
+            visits[action, state1, state2] += 1
+        R = np.where(visits > 0, R / np.maximum(visits, 1), 0)
+        T_sum = T.sum(axis=2, keepdims=True)
+        T = np.where(T_sum > 0, T / np.maximum(T_sum, 1), 1. / n_states)
+
+        # Matrices are indexed by the order in which states and actions were first seen
+        states = learner.state_ids.keys()
+        actions = learner.action_ids.keys()
+        T_learner, R_learner = learner._calc_matrices()
+        np.testing.assert_allclose(T_learner, T[np.ix_(actions, states, states)])
+        np.testing.assert_allclose(R_learner, R[np.ix_(actions, states, states)])
+
+
+    def test_007_load_history_pickle(self):
+        learner1 = MLMDP(normalize_count=0)
+        learner1.fit([(0, 0, 0), (1, 0, 0.1), (2, 1, 0.5), (1, 0, -1), (2, 1, 0.25)])
+
+        # Learners pickled before the switch to sufficient statistics kept the full history
+        learner2 = MLMDP(normalize_count=0)
+        learner2.__dict__.update(learner1.__dict__)
+        del learner2._model
+        learner2._transition_history = {(0, 0): [1], (1, 1): [2, 2], (2, 0): [1]}
+        learner2._reward_history = {(0, 0, 1): [0.1], (1, 1, 2): [0.5, 0.25], (2, 0, 1): [-1]}
+        learner2 = pickle.loads(pickle.dumps(learner2))
+
+        for M1, M2 in zip(learner1._calc_matrices(), learner2._calc_matrices()):
+            np.testing.assert_allclose(M1, M2)
+
+
+    def test_008_incremental_replanning(self):
+        transitions = [(random.randint(0, 9), random.randint(0, 2), random.random())
+                       for _ in range(400)]
+        learner1 = MLMDP(normalize_count=0)
+        learner2 = MLMDP(normalize_count=0)
+        learner1.fit(transitions)
+
+        # Replan in between batches of transitions so the second converge() is warm started
+        learner2.fit(transitions[:200])
+        learner2.converge(atol=1E-12)
+        learner2.fit(transitions[199:])
+        self.assertIsNotNone(learner2._planned_values)
+
+        for M1, M2 in zip(learner1._calc_matrices(), learner2._calc_matrices()):
+            np.testing.assert_allclose(M1, M2)
+
+        learner1.converge(atol=1E-12)
+        learner2.converge(atol=1E-12)
+        for state in range(10):
+            for action in range(3):
+                self.assertAlmostEqual(
+                    learner1.val(state, action), learner2.val(state, action), places=4)
+
+
+    def test_009_async_planning(self):
+        transitions = [(random.randint(0, 9), random.randint(0, 2), random.random())
+                       for _ in range(2000)]
+        learner = MLMDP(normalize_count=2, async_planning=True)
+        learner.fit(transitions)
+        learner._submit_planning()
+        self.assertTrue(learner.wait_for_planning(timeout=60))
+
+        stats = learner.planning_stats
+        self.assertGreater(stats['submitted'], 1)
+        self.assertEqual(stats['submitted'], stats['completed'] + stats['superseded'])
+        self.assertFalse(stats['pending'])
+        self.assertEqual(stats['lag_transitions'], 0)
+
+        V = learner._planned_values
+        self.assertEqual(V.shape, (3, 10))
+        for state in range(10):
+            for action in range(3):
+                self.assertEqual(learner.val(state, action), V[
+                    learner.action_ids.index(action), learner.state_ids.index(state)])
+
+        # The worker thread is not pickled along with the learner
+        up_learner = pickle.loads(pickle.dumps(learner))
+        self.assertIsNone(up_learner._planner)
+        self.assertEqual(up_learner.val(0, 0), learner.val(0, 0))
+
+
+    def test_010_solvers(self):
+        transitions = [(random.randint(0, 9), random.randint(0, 2), random.random())
+                       for _ in range(400)]
+        expected = MLMDP(discount_factor=0.99, normalize_count=0)
+        expected.fit(transitions)
+        expected.converge(atol=1E-14, max_iter=10000)
+
+        for solver in ['pi', 'gauss_seidel']:
+            for sparse in [False, True]:
+                learner = MLMDP(discount_factor=0.99, normalize_count=0, sparse=sparse,
+                                solver=solver)
+                learner.fit(transitions)
+                learner.converge(atol=1E-14, max_iter=10000)
+                for state in range(10):
+                    for action in range(3):
+                        self.assertAlmostEqual(
+                            learner.val(state, action), expected.val(state, action), places=4)
+
+        # The solver can also be chosen for a single call
+        learner.converge(atol=1E-14, max_iter=10000, solver='vi')
+        self.assertAlmostEqual(learner.val(0, 0), expected.val(0, 0), places=4)
+        self.assertRaises(ValueError, MLMDP, solver='newton')
+
+
+    def test_011_parallel_planning(self):
+        transitions = [(random.randint(0, 19), random.randint(0, 2), random.random())
+                       for _ in range(400)]
+        for sparse in [False, True]:
+            learner1 = MLMDP(normalize_count=0, sparse=sparse)
+            learner2 = MLMDP(normalize_count=0, sparse=sparse, n_jobs=4)
+            for learner in [learner1, learner2]:
+                learner.fit(transitions)
+                learner.converge(atol=1E-12)
+            for state in range(20):
+                for action in range(3):
+                    self.assertAlmostEqual(
+                        learner1.val(state, action), learner2.val(state, action), places=6)
+
+
+    def test_012_converge_step(self):
+        transitions = [(random.randint(0, 9), random.randint(0, 2), random.random())
+                       for _ in range(400)]
+        expected = MLMDP(discount_factor=0.95, normalize_count=0)
+        expected.fit(transitions)
+        expected.converge(atol=1E-12)
+
+        # A budget of zero carries out a single iteration per call
+        learner = MLMDP(discount_factor=0.95, normalize_count=0)
+        learner.fit(transitions)
+        self.assertFalse(learner.converge_step(0, atol=1E-12))
+        first_step = learner.val(0, 0)
+        self.assertNotEqual(first_step, 0)
+        self.assertFalse(learner.converge_step(0))
+        self.assertNotEqual(learner.val(0, 0), first_step)
+
+        # Suspended convergence is not pickled, but the values computed so far are
+        up_learner = pickle.loads(pickle.dumps(learner))
+        self.assertIsNone(up_learner._converging)
+        self.assertEqual(up_learner.val(0, 0), learner.val(0, 0))
+
+        steps = 2
+        while not learner.converge_step(0):
+            steps += 1
+        self.assertGreater(steps, 10)
+        for state in range(10):
+            for action in range(3):
+                self.assertAlmostEqual(
+                    learner.val(state, action), expected.val(state, action), places=6)
+
+        # Once done, the next call starts over, warm started from the converged values
+        self.assertTrue(learner.converge_step(10, atol=1E-12))
+
+
+    def test_013_fit_columns(self):
+        # Without normalize_count, transitions are recorded in the model all at once
+        transitions = [(random.randint(0, 9), random.randint(0, 2), random.random())
+                       for _ in range(2000)]
+        states, actions, rewards = [np.array(column) for column in zip(*transitions)]
+        learner1 = MLMDP(normalize_count=0)
+        learner2 = MLMDP(normalize_count=0)
+        learner1.fit(transitions[:1000])
+        learner1.fit(transitions[1000:])
+        learner2.fit_columns(states[:1000], actions[:1000], rewards[:1000])
+        learner2.fit_columns(states[1000:], actions[1000:], rewards[1000:], np.arange(1000) == 0)
+
+        model1, model2 = learner1._model, learner2._model
+        self.assertEqual(model1.keys(), model2.keys())
+        self.assertEqual(model1._row_entries, model2._row_entries)
+        np.testing.assert_array_equal(model1.transition_counts, model2.transition_counts)
+        np.testing.assert_allclose(model1.reward_sums, model2.reward_sums)
+        self.assertEqual(learner1._n_transitions, learner2._n_transitions)
+
+        learner1.converge()
+        learner2.converge()
+        for state in range(10):
+            for action in range(3):
+                self.assertAlmostEqual(learner1.val(state, action), learner2.val(state, action))
+
+
+    def test_014_failed_planning(self):
+        # Failures are counted apart from completed plans and raised by wait() or the next fit()
+        learner = MLMDP(normalize_count=0, async_planning=True)
+        learner.fit([(0, 0, 0), (1, 0, 1), (2, 0, 0)])
+        def fail(*args):
+            raise ZeroDivisionError()
+        learner._plan = fail
+        learner._submit_planning()
+        self.assertRaises(ZeroDivisionError, learner.wait_for_planning, 60)
+        self.assertTrue(learner.wait_for_planning(60))
+
+        learner._submit_planning()
+        while learner.planning_stats['pending']:
+            time.sleep(0.01)
+        stats = learner.planning_stats
+        self.assertEqual((stats['completed'], stats['failed']), (0, 2))
+        self.assertRaises(ZeroDivisionError, learner.fit, (3, 0, 0))
+        learner.fit((3, 0, 0))
+
+
+    def test_015_state_ids(self):
+        # States and actions of any hashable type, sized by the number of distinct ones seen
+        transitions = [(random.randint(0, 9), random.randint(0, 2), random.random())
+                       for _ in range(500)]
+        relabel = {state: [10 ** 7 + state, 'state %d' % state, (state, 'x')][state % 3]
+                   for state in range(10)}
+        learner1 = MLMDP(normalize_count=0)
+        learner2 = MLMDP(normalize_count=0, dense=True)
+        learner3 = MLMDP(normalize_count=0, sparse=True)
+        learner1.fit(transitions)
+        for learner in [learner2, learner3]:
+            learner.fit([(relabel[state], 'abc'[action], reward)
+                         for state, action, reward in transitions])
+        self.assertEqual(learner2._calc_matrices()[0].shape, (3, 10, 10))
+        for learner in [learner1, learner2, learner3]:
+            learner.converge(atol=1E-9)
+        for state in range(10):
+            for action in range(3):
+                for learner in [learner2, learner3]:
+                    self.assertAlmostEqual(learner1.val(state, action),
+                                           learner.val(relabel[state], 'abc'[action]))
+
+        # Same model whether fitted one transition at a time or by columns
+        learner4 = MLMDP(normalize_count=0)
+        states = np.array([str(relabel[state]) for state, _, _ in transitions])
+        learner4.fit_columns(states, np.array([action for _, action, _ in transitions]),
+                             np.array([reward for _, _, reward in transitions]))
+        self.assertEqual(learner4.state_ids.keys(), [str(state) for state in
+                                                     learner2.state_ids.keys()])
+        self.assertEqual(learner4._model.keys(), learner1._model.keys())
+
+        # Learners pickled before states were interned used them as indices
+        state = learner1.__getstate__()
+        del state['_state_ids'], state['_action_ids']
+        learner5 = MLMDP.__new__(MLMDP)
+        learner5.__setstate__(state)
+        self.assertEqual(learner5.state_ids.keys(), list(range(10)))
+
+
+    def test_016_learn_while_planning(self):
+        # Values planned are written over those of the snapshot only, not over values of states or
+        # actions learned while the snapshot was being planned
+        for dense in [False, True]:
+            started, release = threading.Event(), threading.Event()
+            learner = MLMDP(normalize_count=0, async_planning=True, dense=dense)
+            plan = learner._plan
+            def slow_plan(T, R, plan=plan, started=started, release=release):
+                started.set()
+                release.wait(60)
+                return plan(T, R)
+            learner._plan = slow_plan
+            learner.fit([(0, 0, 0), (1, 0, 1), (2, 0, 0)])
+            learner._submit_planning()
+            self.assertTrue(started.wait(60))
+            learner.fit([(3, 1, 0.5), (4, 1, 1)])
+            learner._set_value(4, 1, 7.0)
+            release.set()
+            self.assertTrue(learner.wait_for_planning(60))
+
+            V = learner._planned_values
+            self.assertEqual(V.shape, (1, 3))
+            self.assertEqual(learner.val(4, 1), 7.0)
+            for state in range(3):
+                self.assertEqual(learner.val(state, 0), V[0, state])
+            self.assertEqual(learner.get_states(), set(range(5)))
+
+
+    def test_017_close_planning(self):
+        transitions = [(random.randint(0, 9), random.randint(0, 2), random.random())
+                       for _ in range(200)]
+        learner = MLMDP(normalize_count=2, async_planning=True)
+
+        # The worker stops once out of snapshots to plan, and is started again by the next one
+        learner.fit(transitions)
+        self.assertTrue(learner.wait_for_planning(60))
+        learner._planner._thread.join(60)
+        self.assertFalse(learner._planner._thread.is_alive())
+        learner._submit_planning()
+
+        # Closing drops the snapshot queued and waits for the worker to stop
+        with learner:
+            learner._submit_planning()
+        self.assertFalse(learner._planner._thread.is_alive())
+        stats = learner.planning_stats
+        self.assertFalse(stats['pending'])
+        self.assertEqual(stats['submitted'], stats['completed'] + stats['superseded'])
+
+        # The worker does not keep the learner alive
+        learner_ref = weakref.ref(learner)
+        del learner
+        gc.collect()
+        self.assertIsNone(learner_ref())
+
+
 if __name__ == '__main__':
     import sys
     sys.exit(unittest2.main())
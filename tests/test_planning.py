@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_planning
+----------------------------------
+
+Tests for `planning` module.
+"""
+
+import numpy as np
+import unittest2
+
+from rltools.learners import planning
+
+
+def random_model(n_actions, n_states, seed=0):
+    rnd = np.random.RandomState(seed)
+    T = rnd.rand(n_actions, n_states, n_states)
+    T /= T.sum(axis=2, keepdims=True)
+    R = rnd.randn(n_actions, n_states, n_states)
+    return T, R
+
+
+def loop_value_iteration(T, R, discount_factor, atol=1E-3, max_iter=1000):
+    ''' Reference implementation, one Python operation per <action, state, state> '''
+    n_actions, n_states, _ = T.shape
+    curr_values = np.zeros((n_actions, n_states))
+    prev_values = curr_values.copy()
+    for _ in range(max_iter):
+        for action in range(n_actions):
+            for state1 in range(n_states):
+                curr_values[action, state1] = (T[action, state1] * R[action, state1]).sum()
+                for state2 in range(n_states):
+                    curr_values[action, state1] += T[action, state1, state2] * \
+                        discount_factor * prev_values[action, state2]
+        if ((prev_values - curr_values) ** 2).mean() < atol:
+            break
+        prev_values = curr_values.copy()
+    return curr_values
+
+
+class TestPlanning(unittest2.TestCase):
+    # pylint: disable=protected-access, invalid-name
+
+
+    def test_000_value_iteration(self):
+        T, R = random_model(3, 12)
+        for atol, max_iter in [(1E-3, 1000), (1E-12, 1000), (1E-12, 3)]:
+            expected = loop_value_iteration(T, R, 0.9, atol, max_iter)
+            values = planning.value_iteration(T, R, 0.9, atol=atol, max_iter=max_iter)
+            np.testing.assert_allclose(values, expected)
+
+
+    def test_001_solvers(self):
+        T, R = random_model(3, 40)
+        expected = np.linalg.solve(np.eye(40) - 0.95 * T, np.einsum('ast,ast->as', T, R)[
+            :, :, np.newaxis])[:, :, 0]
+
+        # Drop every transition out of a few states, which the sparse model assigns uniformly
+        actions, states1, states2 = [ix.ravel() for ix in np.indices(T.shape)]
+        keep = states1 % 7 != 0
+        T_sparse = planning.SparseMatrix(
+            T.shape, actions[keep], states1[keep], states2[keep], T.ravel()[keep])
+        R_sparse = planning.SparseMatrix(
+            T.shape, actions[keep], states1[keep], states2[keep], R.ravel()[keep])
+        T_sparse.fill = 1 - T_sparse.row_sums()
+        T_dense, R_dense = T_sparse.toarray(), R_sparse.toarray()
+        expected_sparse = np.linalg.solve(np.eye(40) - 0.95 * T_dense, np.einsum(
+            'ast,ast->as', T_dense, R_dense)[:, :, np.newaxis])[:, :, 0]
+
+        for solver in planning.SOLVERS:
+            values = planning.solve(T, R, 0.95, solver, atol=1E-20, max_iter=10000)
+            np.testing.assert_allclose(values, expected, atol=1E-8)
+            values = planning.solve(
+                T_sparse, R_sparse, 0.95, solver, atol=1E-20, max_iter=10000)
+            np.testing.assert_allclose(values, expected_sparse, atol=1E-8)
+
+        self.assertRaises(ValueError, planning.solve, T, R, 0.95, 'newton')
+
+
+    def test_002_parallel_backups(self):
+        T, R = random_model(3, 40)
+        actions, states1, states2 = [ix.ravel() for ix in np.indices(T.shape)]
+        keep = (states1 % 7 != 0) & (T.ravel() > 0.02)
+        T_sparse = planning.SparseMatrix(
+            T.shape, actions[keep], states1[keep], states2[keep], T.ravel()[keep])
+        R_sparse = planning.SparseMatrix(
+            T.shape, actions[keep], states1[keep], states2[keep], R.ravel()[keep])
+        T_sparse.fill = 1 - T_sparse.row_sums()
+
+        for T_, R_ in [(T, R), (T_sparse, R_sparse)]:
+            values = np.random.RandomState(0).randn(3, 40)
+            expected_reward = planning.expected_rewards(T_, R_)
+            expected = planning.bellman_backup(T_, expected_reward, values, 0.95)
+            for n_jobs in [1, 2, 7, 100]:
+                backup = planning.ParallelBackup(T_, n_jobs)
+                np.testing.assert_allclose(backup(expected_reward, values, 0.95), expected)
+                backup.close()
+
+            for solver in planning.SOLVERS:
+                expected = planning.solve(T_, R_, 0.95, solver, atol=1E-12)
+                values = planning.solve(T_, R_, 0.95, solver, atol=1E-12, n_jobs=4)
+                np.testing.assert_allclose(values, expected, atol=1E-6)
+
+
+    def test_003_undiscounted_absorbing(self):
+        # Chains of states that end in a state looping back onto itself with certainty
+        n_actions, n_states = 2, 20
+        rnd = np.random.RandomState(0)
+        actions, states1 = [ix.ravel() for ix in np.indices((n_actions, n_states))]
+        states2 = np.minimum(states1 + 1 + actions, n_states - 1)
+        rewards = np.where(states1 == n_states - 1, 0, rnd.rand(len(states1)))
+        models = []
+        for loop_reward in [0, 1]:
+            data = np.where(states1 == n_states - 1, loop_reward, rewards)
+            T_sparse = planning.SparseMatrix(
+                (n_actions, n_states, n_states), actions, states1, states2, np.ones(len(data)))
+            R_sparse = planning.SparseMatrix(
+                (n_actions, n_states, n_states), actions, states1, states2, data)
+            models.append([(T_sparse.toarray(), R_sparse.toarray()), (T_sparse, R_sparse)])
+        expected = planning.solve(models[0][0][0], models[0][0][1], 1, 'vi', atol=1E-20)
+
+        with np.errstate(all='raise'):
+            for solver in planning.SOLVERS:
+                for T_, R_ in models[0]:
+                    values = planning.solve(T_, R_, 1, solver, atol=1E-20, max_iter=1000)
+                    np.testing.assert_allclose(values, expected, atol=1E-8)
+
+                # Without a solution values grow with every iteration, but stay finite
+                for T_, R_ in models[1]:
+                    values = planning.solve(T_, R_, 1, solver, max_iter=10)
+                    self.assertTrue(np.isfinite(values).all())
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest2.main())
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_prioritizedsweeping
+----------------------------------
+
+Tests for `prioritizedsweeping` module.
+"""
+
+import random
+import unittest2
+
+from tests.test_learner import TestLearner
+from rltools.learners import MLMDP, PrioritizedSweepingLearner
+
+
+class TestPrioritizedSweepingLearner(TestLearner):
+    # pylint: disable=protected-access, invalid-name
+
+
+    def setUp(self):
+        self.cls = PrioritizedSweepingLearner
+
+
+    def tearDown(self):
+        pass
+
+
+    def assertMatchesMLMDP(self, learner, transitions, n_states, n_actions, places=3):
+        mlmdp = MLMDP(discount_factor=learner._discount_factor, normalize_count=0)
+        mlmdp.fit(transitions)
+        mlmdp.converge(atol=1E-14)
+        for state in range(n_states):
+            for action in range(n_actions):
+                self.assertAlmostEqual(
+                    learner.val(state, action), mlmdp.val(state, action), places=places)
+
+
+    def test_000_converge(self):
+        n_states, n_actions = 12, 3
+        transitions = [(random.randint(0, n_states - 1), random.randint(0, n_actions - 1),
+                        random.random()) for _ in range(500)]
+        learner = PrioritizedSweepingLearner(min_priority=1E-9)
+        learner.fit(transitions)
+        learner.converge()
+        self.assertMatchesMLMDP(learner, transitions, n_states, n_actions, places=5)
+
+
+    def test_001_online(self):
+        # Chain in which state `i` moves to `i + 1` and the last state pays off
+        n_states = 50
+        learner = PrioritizedSweepingLearner(discount_factor=0.9, n_backups=5)
+        transitions = []
+        for _ in range(20):
+            transitions.extend([(i, 0, 0) for i in range(n_states - 1)] + [(n_states - 1, 0, 1)])
+        learner.fit(transitions)
+        self.assertMatchesMLMDP(learner, transitions, n_states, 1)
+        self.assertLess(learner.backups, 10 * len(transitions))
+
+
+    def test_002_converge_step(self):
+        n_states, n_actions = 12, 3
+        transitions = [(random.randint(0, n_states - 1), random.randint(0, n_actions - 1),
+                        random.random()) for _ in range(500)]
+        learner = PrioritizedSweepingLearner(n_backups=1, min_priority=1E-9)
+        learner.fit(transitions)
+        backups = learner.backups
+        self.assertFalse(learner.converge_step(0))
+        self.assertEqual(learner.backups, backups + 1)
+        while not learner.converge_step(0):
+            pass
+        self.assertMatchesMLMDP(learner, transitions, n_states, n_actions, places=5)
+
+
+    def test_003_state_ids(self):
+        # Sparse, non-integer state ids share the unobserved value of the states actually seen
+        n_states, n_actions = 12, 3
+        transitions = [(random.randint(0, n_states - 1), random.randint(0, n_actions - 1),
+                        random.random()) for _ in range(300)]
+        learner1 = PrioritizedSweepingLearner(min_priority=1E-9)
+        learner2 = PrioritizedSweepingLearner(min_priority=1E-9)
+        learner1.fit(transitions)
+        learner2.fit([('s%d' % (state * 1000), action, reward)
+                      for state, action, reward in transitions])
+        for learner in [learner1, learner2]:
+            learner.converge()
+        for state in range(n_states):
+            for action in range(n_actions):
+                self.assertAlmostEqual(learner1.val(state, action),
+                                       learner2.val('s%d' % (state * 1000), action), places=6)
+        self.assertEqual(learner2.val('unseen', 0), 0)
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest2.main())
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_qlearner
+----------------------------------
+
+Tests for `qlearner` module.
+"""
+
+import numpy as np
+import unittest2
+
+from tests.test_learner import TestLearner
+from rltools.learners import QLearner
+
+
+def random_batch(n, n_states=20, n_actions=3, seed=0):
+    rnd = np.random.RandomState(seed)
+    return (rnd.randint(0, n_states, n), rnd.randint(0, n_actions, n), rnd.randn(n),
+            rnd.randint(0, n_states + 5, n))
+
+
+class TestQLearner(TestLearner):
+    # pylint: disable=protected-access, invalid-name
+
+
+    def setUp(self):
+        self.cls = QLearner
+
+
+    def tearDown(self):
+        pass
+
+
+    def test_000_fit_batch_sequential(self):
+        batch = random_batch(200)
+        for dense in [False, True]:
+            learner1 = QLearner(dense=dense)
+            learner2 = QLearner(dense=dense)
+            learner1.fit_batch(*batch, synchronous=False)
+            for state, action, reward, next_state in zip(*[column.tolist() for column in batch]):
+                learner2._all_states.update((state, next_state))
+                learner2._all_actions.add(action)
+                learner2._learn_incr(state, action, reward, next_state)
+            self.assertEqual(learner1._copy_values(), learner2._copy_values())
+
+
+    def test_001_fit_batch_synchronous(self):
+        states, actions, rewards, next_states = random_batch(200)
+        learner = QLearner(learning_rate=0.1, discount_factor=0.9)
+        dense_learner = QLearner(learning_rate=0.1, discount_factor=0.9, dense=True)
+        values = np.zeros((25, 3))
+        for _ in range(3):
+            learner.fit_batch(states, actions, rewards, next_states)
+            dense_learner.fit_batch(states, actions, rewards, next_states)
+
+            # Reference: targets from the values prior to the batch, updates added up
+            targets = rewards + 0.9 * values[next_states].max(axis=1)
+            deltas = 0.1 * (targets - values[states, actions])
+            np.add.at(values, (states, actions), deltas)
+
+        for state in range(25):
+            for action in range(3):
+                self.assertAlmostEqual(learner.val(state, action), values[state, action])
+                self.assertAlmostEqual(dense_learner.val(state, action), values[state, action])
+        self.assertEqual(len(dense_learner._values), len(learner._values))
+        self.assertEqual(dense_learner.get_states(), learner.get_states())
+
+
+    def test_002_fit_batch_unseen_actions(self):
+        # Actions without any value yet count as zero when taking the maximum future value
+        learner = QLearner(learning_rate=1, discount_factor=1, dense=True)
+        learner.fit_batch([0, 1], [0, 0], [-1, -2], [1, 2])
+        learner._all_actions.add(1)
+        learner.fit_batch([0], [0], [0], [1])
+        self.assertEqual(learner.val(0, 0), 0)
+        self.assertRaises(ValueError, learner.fit_batch, [0], [0], [0, 1], [1])
+
+
+    def test_003_fit_batch_weights(self):
+        # Weights scale the learning rate of each transition, errors come from prior values
+        batch = random_batch(100)
+        for dense in [False, True]:
+            for synchronous in [False, True]:
+                learner1 = QLearner(learning_rate=0.2, dense=dense)
+                learner2 = QLearner(learning_rate=0.1, dense=dense)
+                errors1 = learner1.fit_batch(*batch, synchronous=synchronous)
+                errors2 = learner2.fit_batch(*batch, synchronous=synchronous,
+                                             weights=np.ones(100) * 2)
+                self.assertEqual(learner2._learning_rate, 0.1)
+                for key, val in learner1._copy_values().items():
+                    self.assertAlmostEqual(learner2._copy_values()[key], val)
+                if synchronous:
+                    np.testing.assert_allclose(errors1, errors2)
+                    np.testing.assert_allclose(errors1, batch[2])
+
+
+    def test_004_state_ids(self):
+        # Values of dense learners are indexed by the same ids as everything else
+        batch = random_batch(100)
+        learner = QLearner(dense=True)
+        learner.fit_batch(*batch)
+        learner.fit([(100, 4, 0), (101, 4, 1)])
+        self.assertIs(learner._values.states, learner.state_ids)
+        self.assertIs(learner._values.actions, learner.action_ids)
+        self.assertEqual(set(learner.state_ids), set(batch[0]) | set(batch[3]) | set([100, 101]))
+        self.assertEqual(set(learner.action_ids), set(batch[1]) | set([4]))
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest2.main())
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_rmax
+----------------------------------
+
+Tests for `rmax` module.
+"""
+
+import unittest2
+
+from rltools.learners import QLearner
+from rltools.strategies import RMaxStrategy
+
+
+class TestRMaxStrategy(unittest2.TestCase):
+    # pylint: disable=protected-access, invalid-name
+
+
+    def setUp(self):
+        pass
+
+
+    def tearDown(self):
+        pass
+
+
+    def test_000_interface(self):
+        # States and actions of any hashable type
+        strategy = RMaxStrategy(QLearner())
+        episode = [('start', 'left', 0), ('middle', 'right', 1), ('end', 'left', 2)]
+        strategy.fit(episode)
+        strategy.fit(episode)
+        self.assertIn(strategy.policy('middle'), ['left', 'right'])
+        self.assertEqual(set(strategy._all_states), set(['start', 'middle', 'end']))
+        self.assertEqual(strategy._transition_count[('start', 'right')], 2)
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest2.main())
@@ -10,10 +10,12 @@ Tests for `temporaldifference` module.
 
 import os
 import random
+import pickle
 import unittest2
 
 from tests.test_learner import TestLearner
 from rltools.learners import TemporalDifferenceLearner
+from rltools.learners.episodestore import EpisodeStore
 from rltools.strategies import Strategy
 from rltools.domains import randomwalk
 
@@ -122,6 +124,202 @@ class TestTemporalDifferenceLearner(TestLearner):
         self.assertLess(rmse, 0.1)
 
 
+    def test_004_converge_step(self):
+        episodes = [[(state, 0, random.random()) for state in range(5)] for _ in range(10)]
+        td1 = TemporalDifferenceLearner(discount_factor=0.9, learning_rate=0.5)
+        td2 = TemporalDifferenceLearner(discount_factor=0.9, learning_rate=0.5)
+        for td in [td1, td2]:
+            for episode in episodes:
+                td.fit(episode)
+        td1.converge(atol=1E-6)
+
+        # A budget of zero re-learns a single episode per call
+        steps = 1
+        while not td2.converge_step(0, atol=1E-6):
+            steps += 1
+        self.assertGreater(steps, len(episodes))
+        for state in range(5):
+            self.assertAlmostEqual(td1.val(state, 0), td2.val(state, 0))
+
+
+    def test_005_trace_cutoff(self):
+        episode = [(random.randint(0, 9), random.randint(0, 2), random.random())
+                   for _ in range(300)]
+
+        # Reference: update every transition of the episode after each one
+        values, prev_values, traces = {}, {}, []
+        for (state1, _, _), (state2, action, reward) in zip(episode[:-1], episode[1:]):
+            traces.append([state1, action, 1])
+            estimated_value = max([values.get((state1, a), 0) for a in range(3)])
+            delta = reward + 0.9 * prev_values.get((state2, action), 0) - estimated_value
+            for trace in traces:
+                values[(trace[0], trace[1])] = values.get((trace[0], trace[1]), 0) + \
+                    0.5 * delta * trace[2]
+                trace[2] *= 0.9 * 0.8
+
+        for dense in [False, True]:
+            td1 = TemporalDifferenceLearner(l=0.8, discount_factor=0.9, learning_rate=0.5,
+                                            dense=dense)
+            td2 = TemporalDifferenceLearner(l=0.8, discount_factor=0.9, learning_rate=0.5,
+                                            dense=dense, trace_cutoff=1E-6)
+            for td in [td1, td2]:
+                td._all_actions.update(range(3))
+                td.fit(episode)
+            _, _, _, start, end = td1._traces
+            self.assertEqual(end - start, len(episode) - 1)
+            _, _, eligibilities, start, end = td2._traces
+            self.assertLess(end - start, 50)
+            self.assertGreaterEqual(eligibilities[start:end].min(), 1E-6)
+            for key, val in values.items():
+                self.assertAlmostEqual(td1.val(*key), val)
+                self.assertAlmostEqual(td2.val(*key), val, places=3)
+
+
+    def test_006_converge_lstd(self):
+        td = TemporalDifferenceLearner(l=0.5, discount_factor=0.9)
+        td.fit([(0, 0, 0), (1, 0, 1), (2, 0, 2), (3, 0, 3)])
+        td.converge(method='lstd')
+        for state, expected in enumerate([1 + 0.9 * 2 + 0.81 * 3, 2 + 0.9 * 3, 3, 0]):
+            self.assertAlmostEqual(td.val(state, 0), expected)
+        self.assertRaises(ValueError, td.converge, method='unknown')
+
+        # With lambda = 1, values are the average discounted return after each visit
+        episodes = []
+        for _ in range(50):
+            state, episode = 0, [(0, 0, 0)]
+            while state < 4:
+                state = max(0, state + random.choice([-1, 1, 1]))
+                episode.append((state, 0, random.random()))
+            episodes.append(episode)
+        returns = {}
+        for episode in episodes:
+            for t in range(len(episode) - 1):
+                returns.setdefault(episode[t][0], []).append(sum(
+                    [0.8 ** k * tup[2] for k, tup in enumerate(episode[t + 1:])]))
+
+        for dense_limit in [1000, 0]:
+            td = TemporalDifferenceLearner(l=1, discount_factor=0.8, trace_cutoff=0)
+            td.lstd_dense_limit = dense_limit
+            for episode in episodes:
+                td.fit(episode)
+            td.converge(atol=1E-14, method='lstd')
+            for state in range(4):
+                self.assertAlmostEqual(
+                    td.val(state, 0), sum(returns[state]) / len(returns[state]))
+
+
+    def test_007_previous_values(self):
+        # Same results as taking a full copy of the values at the start of every episode
+        class CopyingLearner(TemporalDifferenceLearner):
+            def _snapshot_values(self):
+                self._prev_values = self._copy_values()
+
+        episodes = [[(random.randint(0, 9), random.randint(0, 2), random.random())
+                     for _ in range(random.randint(2, 20))] for _ in range(30)]
+        for dense in [False, True]:
+            td1 = TemporalDifferenceLearner(discount_factor=0.9, learning_rate=0.8, dense=dense)
+            td2 = CopyingLearner(discount_factor=0.9, learning_rate=0.8, dense=dense)
+            for td in [td1, td2]:
+                for episode in episodes:
+                    td.fit(episode)
+                list(td._iter_converge(atol=0, max_iter=2))
+            for state in range(10):
+                for action in range(3):
+                    self.assertEqual(td1.val(state, action), td2.val(state, action))
+
+
+    def test_008_episode_store(self):
+        episodes = [[(state, 0, random.random()) for state in range(5)] for _ in range(40)]
+        td1 = TemporalDifferenceLearner(discount_factor=0.9)
+        td2 = TemporalDifferenceLearner(discount_factor=0.9, episodes=EpisodeStore(
+            max_bytes=EpisodeStore.TRANSITION_BYTES * 40))
+        for td in [td1, td2]:
+            for episode in episodes:
+                td.fit(episode)
+        self.assertEqual(len(td1._episodes), 40)
+        self.assertLessEqual(len(td2._episodes), 10)
+        self.assertEqual(list(td2._episodes)[-1], list(td1._episodes)[-1])
+        for method in ['replay', 'lstd']:
+            td2.converge(method=method)
+
+        # Learners pickled with episodes in lists of tuples
+        state = td1.__getstate__()
+        state['_episode_list'] = [[vec + (1,) for vec in episode] for episode in td1._episodes]
+        del state['_episodes']
+        td3 = TemporalDifferenceLearner.__new__(TemporalDifferenceLearner)
+        td3.__setstate__(state)
+        self.assertEqual(list(td3._episodes), list(td1._episodes))
+
+
+    def test_009_converge_batch(self):
+        # Batch TD converges to the same values as LSTD, regardless of the number of threads
+        episodes = [[(state, 0, random.random()) for state in range(random.randint(2, 8))]
+                    for _ in range(60)]
+        for episode in episodes[::2]:
+            episode.append((random.randint(0, 7), 0, random.random()))
+        learners = {}
+        for method, n_jobs in [('lstd', 1), ('batch', 1), ('batch', 3), ('batch', 100)]:
+            td = TemporalDifferenceLearner(l=0.5, discount_factor=0.9, n_jobs=n_jobs)
+            for episode in episodes:
+                td.fit(episode)
+            td.converge(atol=1E-14, method=method, deterministic=True)
+            learners[method, n_jobs] = td
+        for state in range(8):
+            expected = learners['lstd', 1].val(state, 0)
+            for key in [('batch', 1), ('batch', 3), ('batch', 100)]:
+                self.assertAlmostEqual(learners[key].val(state, 0), expected, places=5)
+
+        # With several actions, values are those of the actions taken, as with LSTD
+        episodes = [[(random.randint(0, 7), random.randint(0, 2), random.random())
+                     for _ in range(random.randint(2, 8))] for _ in range(60)]
+        learners = {}
+        for method, n_jobs in [('lstd', 1), ('batch', 1), ('batch', 3)]:
+            td = TemporalDifferenceLearner(l=0.5, discount_factor=0.9, n_jobs=n_jobs)
+            for episode in episodes:
+                td.fit(episode)
+            td.converge(atol=1E-14, max_iter=10000, method=method, deterministic=True)
+            learners[method, n_jobs] = td
+        keys = set((prev[0], curr[1]) for episode in episodes
+                   for prev, curr in zip(episode[:-1], episode[1:]))
+        for state, action in keys:
+            expected = learners['lstd', 1].val(state, action)
+            for key in [('batch', 1), ('batch', 3)]:
+                self.assertAlmostEqual(learners[key].val(state, action), expected, places=5)
+
+        # Deterministic passes give the same values every time
+        copies = []
+        for _ in range(2):
+            td = TemporalDifferenceLearner(l=0.5, discount_factor=0.9, n_jobs=3)
+            for episode in episodes:
+                td.fit(episode)
+            list(td._iter_converge_batch(atol=0, max_iter=3, deterministic=True))
+            copies.append(td._copy_values())
+        self.assertEqual(copies[0], copies[1])
+
+        # No episodes fitted
+        TemporalDifferenceLearner(n_jobs=2).converge(method='batch')
+
+
+    def test_010_shared_ids(self):
+        # States and actions have the ids they are stored with, given a store or not
+        episodes = [[('s%d' % random.randint(0, 9), random.randint(0, 2), random.random())
+                     for _ in range(10)] for _ in range(5)]
+        for dense in [False, True]:
+            for store in [None, EpisodeStore(max_bytes=EpisodeStore.TRANSITION_BYTES * 20)]:
+                td = TemporalDifferenceLearner(dense=dense, episodes=store)
+                for episode in episodes:
+                    td.fit(episode)
+                self.assertIs(td.state_ids, td._episodes.states)
+                self.assertIs(td.action_ids, td._episodes.actions)
+                self.assertEqual(set(td.state_ids), set(tup[0] for ep in episodes for tup in ep))
+                self.assertEqual(td.get_states(), set(td.state_ids))
+                if dense:
+                    self.assertIs(td._values.states, td.state_ids)
+                up_td = pickle.loads(pickle.dumps(td))
+                self.assertIs(up_td.state_ids, up_td._episodes.states)
+                self.assertEqual(up_td.state_ids.keys(), td.state_ids.keys())
+
+
 if __name__ == '__main__':
     import sys
     sys.exit(unittest2.main())
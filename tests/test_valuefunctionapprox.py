@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_valuefunctionapprox
+----------------------------------
+
+Tests for `valuefunctionapprox` module.
+"""
+
+import random
+import numpy as np
+import unittest2
+
+from rltools.learners import ValueFunctionApproximation
+from rltools.learners import valuefunctionapprox
+from rltools.learners.valuefunctionapprox import linear_combination, sparse_combination
+from rltools.features import TileCoder, FeatureCache
+
+
+class TestValueFunctionApproximation(unittest2.TestCase):
+    # pylint: disable=protected-access, invalid-name
+
+
+    def setUp(self):
+        pass
+
+
+    def tearDown(self):
+        pass
+
+
+    def test_000_gradients(self):
+        rnd = np.random.RandomState(0)
+        state = rnd.rand(6).tolist()
+        learners = [
+            ValueFunctionApproximation(8),
+            ValueFunctionApproximation(8, value_fn=lambda params, state: linear_combination(
+                params, state)),
+            ValueFunctionApproximation(8, value_fn=lambda params, state: linear_combination(
+                params, state), gradient_fn=lambda params, state: list(state) + [0, 0])]
+        random.seed(0)
+        learners[0].fit_batch([state, state], [0, 1], [0, 1], [state, state])
+        for learner in learners[1:]:
+            learner.params = learners[0].params
+
+        # Analytic, finite differences and user provided gradients of a linear combination
+        expected = np.append(np.array(state) / 6, [0, 0])
+        np.testing.assert_allclose(learners[0].derivative_params(state, 0), expected)
+        np.testing.assert_allclose(learners[1].derivative_params(state, 0), expected, atol=1E-6)
+        np.testing.assert_allclose(learners[2].derivative_params(state, 1), expected * 6)
+        self.assertAlmostEqual(learners[0].best_value(state), max(
+            learners[0].val(state, action) for action in [0, 1]))
+        self.assertAlmostEqual(learners[0].best_value(state), learners[1].best_value(state))
+
+
+    def test_001_learn_linear(self):
+        # Rewards that are a linear function of the features are learned by a single action
+        rnd = np.random.RandomState(0)
+        target = rnd.uniform(-1, 1, 16)
+        random.seed(0)
+        learner = ValueFunctionApproximation(16, discount_factor=0, learning_rate=1)
+        for _ in range(1000):
+            states = rnd.rand(32, 16)
+            learner.fit_batch(states, np.zeros(32), states.dot(target) / 16, states)
+        self.assertEqual(learner.weights.shape, (1, 16))
+        np.testing.assert_allclose(learner.weights[0], target, atol=0.05)
+
+        # Learners pickled with parameters in lists
+        state = learner.__getstate__()
+        del state['weights'], state['_rows'], state['gradient_fn']
+        state['params'] = {0: learner.weights[0].tolist()}
+        other = ValueFunctionApproximation.__new__(ValueFunctionApproximation)
+        other.__setstate__(state)
+        self.assertEqual(other.val(states[0], 0), learner.val(states[0], 0))
+
+
+    def test_002_converge(self):
+        # With one-hot features, fitted Q-iteration finds the Q-values of the chain exactly
+        def one_hot(state):
+            return np.eye(5)[state]
+        transitions = [(state, action, float(state == 3 and action == 0),
+                        min(4, state + 1) if action == 0 else 0)
+                       for state in range(5) for action in range(2)]
+        q_values = {}
+        for _ in range(500):
+            q_values = {(state, action): reward + 0.9 * max(
+                q_values.get((next_state, other), 0) for other in range(2))
+                        for state, action, reward, next_state in transitions}
+
+        learner = ValueFunctionApproximation(5, discount_factor=0.9, max_transitions=16)
+        for _ in range(3):
+            learner.fit_batch([one_hot(tup[0]) for tup in transitions],
+                              [tup[1] for tup in transitions], [tup[2] for tup in transitions],
+                              [one_hot(tup[3]) for tup in transitions])
+        self.assertEqual(len(learner._memory), 16)
+        self.assertRaises(RuntimeError, learner.converge, atol=0, max_iter=2)
+        learner.converge(atol=1E-12)
+        for (state, action), expected in q_values.items():
+            self.assertAlmostEqual(learner.val(one_hot(state), action), expected, places=5)
+
+        # Nothing kept by default, or no fitted Q-iteration for other value functions
+        default = ValueFunctionApproximation(5)
+        default.fit_batch([one_hot(tup[0]) for tup in transitions], [tup[1] for tup in transitions],
+                          [tup[2] for tup in transitions], [one_hot(tup[3]) for tup in transitions])
+        self.assertIsNone(default._memory)
+        self.assertRaises(ValueError, default.converge)
+        empty = ValueFunctionApproximation(5, max_transitions=16)
+        self.assertIs(empty.converge(), empty.weights)
+        learner.value_fn = lambda params, state: linear_combination(params, state)
+        self.assertRaises(NotImplementedError, learner.converge)
+
+
+    def test_003_sparse_features(self):
+        rnd = np.random.RandomState(0)
+        coder = FeatureCache(TileCoder(64, n_tilings=4, tile_width=0.5))
+        batch = [rnd.rand(16, 2), rnd.randint(0, 2, 16), rnd.randn(16), rnd.rand(16, 2)]
+
+        # Same updates as the gradient of any other value function of the features
+        learner1 = ValueFunctionApproximation(64, features=coder)
+        learner2 = ValueFunctionApproximation(64, features=coder, value_fn=lambda params, state:
+                                              sparse_combination(params, state))
+        for synchronous in [True, False]:
+            for learner in [learner1, learner2]:
+                random.seed(0)
+                learner.fit_batch(*batch, synchronous=synchronous)
+            np.testing.assert_allclose(learner1.weights, learner2.weights, atol=1E-6)
+        self.assertGreater(coder.hits, 0)
+
+        # Only the weights of the active features are updated
+        state = [0.3, 0.7]
+        weights = learner1.weights.copy()
+        learner1.fit_batch([state], [1], [1], [state])
+        changed = np.flatnonzero(learner1.weights[learner1._rows[1]] != weights[learner1._rows[1]])
+        self.assertTrue(set(changed.tolist()) <= set(coder(state)[0].tolist()))
+        self.assertEqual(learner1.weights[learner1._rows[0]].tolist(),
+                         weights[learner1._rows[0]].tolist())
+        self.assertRaises(NotImplementedError, learner1.converge)
+
+        # Raw states only go through the features, so they need not be numeric
+        words = {'low': (np.array([0, 1]), np.array([1., 1.])),
+                 'high': (np.array([2, 3, 4]), np.array([1., 0.5, 0.5]))}
+        learner = ValueFunctionApproximation(8, features=words.get, max_transitions=100)
+        learner.fit([('low', 0, 0), ('high', 1, 1), ('low', 0, 0), ('high', 1, 1)])
+        self.assertIsNone(learner._memory)
+        self.assertNotEqual(learner.val('high', 1), learner.val('low', 1))
+
+
+    def test_004_minibatches(self):
+        rnd = np.random.RandomState(0)
+        batch = [rnd.rand(40, 8), rnd.randint(0, 3, 40), rnd.randn(40), rnd.rand(40, 8)]
+        params = {action: rnd.uniform(-1, 1, 8) for action in range(3)}
+        learner1 = ValueFunctionApproximation(8, learning_rate=0.5, max_transitions=1000)
+        learner2 = ValueFunctionApproximation(8, learning_rate=0.5)
+        for learner in [learner1, learner2]:
+            learner.params = params
+
+        # Same as fitting one batch after the other
+        errors1 = learner1.fit_minibatches(*batch, batch_size=16, n_epochs=2, shuffle=False)
+        for _ in range(2):
+            errors2 = np.concatenate([learner2.fit_batch(*[column[start:start + 16]
+                                                           for column in batch])
+                                      for start in range(0, 40, 16)])
+        np.testing.assert_allclose(errors1, errors2)
+        np.testing.assert_allclose(learner1.weights, learner2.weights)
+        self.assertEqual(len(learner1._memory), 40)
+
+        errors = learner1.fit_minibatches(*batch, batch_size=8, n_epochs=50)
+        self.assertLess(np.abs(errors).mean(), np.abs(errors1).mean())
+
+
+    @unittest2.skipIf(valuefunctionapprox.threadpool_limits is None,
+                      "Setting the number of BLAS threads requires threadpoolctl.")
+    def test_005_minibatch_threads(self):
+        rnd = np.random.RandomState(0)
+        batch = [rnd.rand(40, 8), rnd.randint(0, 3, 40), rnd.randn(40), rnd.rand(40, 8)]
+        learner1 = ValueFunctionApproximation(8, learning_rate=0.5)
+        learner2 = ValueFunctionApproximation(8, learning_rate=0.5)
+        errors1 = learner1.fit_minibatches(*batch, batch_size=16, shuffle=False, n_threads=1)
+        errors2 = learner2.fit_minibatches(*batch, batch_size=16, shuffle=False)
+        np.testing.assert_allclose(errors1, errors2)
+        np.testing.assert_allclose(learner1.weights, learner2.weights)
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest2.main())
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_valuetable
+----------------------------------
+
+Tests for `valuetable` module.
+"""
+
+import random
+import pickle
+import functools
+import numpy as np
+import unittest2
+
+from tests.test_learner import TestLearner
+from rltools.learners import Learner, QLearner
+from rltools.learners.valuetable import Interner, ValueTable, ValueSnapshot
+
+
+class TestInterner(unittest2.TestCase):
+    # pylint: disable=protected-access, invalid-name
+
+
+    def test_000_intern(self):
+        interner = Interner()
+        self.assertEqual(interner.intern('a'), 0)
+        self.assertEqual(interner.intern((1, 2)), 1)
+        self.assertEqual(interner.intern('a'), 0)
+        self.assertEqual(len(interner), 2)
+        self.assertEqual(interner.key(1), (1, 2))
+        self.assertIsNone(interner.index('b'))
+
+
+    def test_001_intern_many(self):
+        # New keys are assigned indices in order of first appearance, like interning one at a time
+        interner = Interner([7])
+        ixs = interner.intern_many(np.array([10 ** 7, 3, 7, 10 ** 7, 5]))
+        self.assertEqual(ixs.tolist(), [1, 2, 0, 1, 3])
+        self.assertEqual(interner.keys(), [7, 10 ** 7, 3, 5])
+        self.assertEqual(interner.intern_many(np.array([[1, 2], [3, 4], [1, 2]])).tolist(),
+                         [4, 5, 4])
+        self.assertEqual(interner.key(5), (3, 4))
+        self.assertEqual(interner.intern_many(np.array(['a', (1, 2)], dtype=object)).tolist(),
+                         [6, 4])
+
+
+class TestValueTable(unittest2.TestCase):
+    # pylint: disable=protected-access, invalid-name
+
+
+    def test_000_mapping(self):
+        table = ValueTable()
+        table[(0, 0)] = 1
+        table[(100, 'up')] = -2.5
+        self.assertEqual(table[(0, 0)], 1)
+        self.assertEqual(table.get((100, 'up')), -2.5)
+        self.assertEqual(table.get((0, 'up'), 0), 0)
+        self.assertNotIn((0, 'up'), table)
+        self.assertEqual(len(table), 2)
+        self.assertEqual(dict(table), {(0, 0): 1, (100, 'up'): -2.5})
+
+        del table[(0, 0)]
+        self.assertEqual(dict(table), {(100, 'up'): -2.5})
+        self.assertRaises(KeyError, lambda: table[(0, 0)])
+
+        # Values of zero are told apart from missing entries, which also read as zero
+        table[(0, 'up')] = 0
+        self.assertEqual(table.get((0, 'up')), 0)
+        self.assertIsNone(table.get((0, 0)))
+        self.assertEqual(len(table), 2)
+
+
+    def test_001_grow(self):
+        values = {(random.randint(0, 1000), random.randint(0, 10)): random.random()
+                  for _ in range(1000)}
+        table = ValueTable(values)
+        self.assertEqual(dict(table), values)
+        self.assertEqual(table.array.shape, (len(table.states), len(table.actions)))
+
+
+    def test_002_copy(self):
+        table = ValueTable({(0, 0): 1})
+        other = table.copy()
+        other[(0, 0)] = 2
+        other[(1, 0)] = 3
+        self.assertEqual(dict(table), {(0, 0): 1})
+        self.assertEqual(dict(other), {(0, 0): 2, (1, 0): 3})
+
+
+    def test_003_memory(self):
+        table = ValueTable(n_states=1 << 16, n_actions=8)
+        for state in range(1 << 16):
+            for action in range(8):
+                table[(state, action)] = 1.0
+        self.assertEqual(table.nbytes, 9 * len(table))
+
+
+    def test_004_load_dict_pickle(self):
+        learner = QLearner()
+        learner.fit([(0, 0, 0), (1, 0, 0.1), (2, 1, 0.5), (3, 0, -1)])
+        up_learner = pickle.loads(pickle.dumps(learner))
+        up_learner._values = ValueTable(up_learner._values)
+        self.assertEqual([learner.val(i, 0) for i in range(4)],
+                         [up_learner.val(i, 0) for i in range(4)])
+
+
+    def test_005_vectorized(self):
+        table = ValueTable()
+        table[(5, 'up')] = 1
+        rows, cols = table.locate_many(np.array([5, 7, 5, 9]), np.array(['up', 'up', 'down', 'up']))
+        self.assertEqual(rows[0], table.states.index(5))
+        self.assertEqual(rows[0], rows[2])
+        self.assertEqual(table.rows_of(np.array([9, 5, 11])).tolist(),
+                         [table.states.index(9), table.states.index(5), -1])
+
+        table.add_at(rows, cols, np.array([1, 2, 3, 4]))
+        table.add_at(rows[:1], cols[:1], np.array([0.5]))
+        self.assertEqual(dict(table), {(5, 'up'): 2.5, (7, 'up'): 2, (5, 'down'): 3, (9, 'up'): 4})
+        self.assertEqual(len(table), 4)
+
+
+    def test_006_snapshot(self):
+        for values in [{}, ValueTable(n_states=1)]:
+            values[(0, 0)] = 1
+            snapshot = ValueSnapshot(values)
+            for _ in range(3):
+                expected = dict(values)
+                for state in range(random.randint(1, 40)):
+                    key = (state, random.randint(0, 3))
+                    snapshot.save(key)
+                    values[key] = random.random()
+                if isinstance(values, ValueTable):
+                    rows, cols = values.locate_many(np.array([0, 50]), np.array([0, 5]))
+                    snapshot.save_cells(rows, cols)
+                    values.add_at(rows, cols, np.array([1., 1.]))
+                for state in range(52):
+                    for action in range(6):
+                        self.assertEqual(snapshot.get((state, action), 0),
+                                         expected.get((state, action), 0))
+                snapshot.reset()
+                self.assertEqual(snapshot.get((0, 0)), values[(0, 0)])
+
+
+    def test_007_shared_index(self):
+        # Ids can be interned without a value, space is only allocated for those that have one
+        states = Interner()
+        table = ValueTable(n_states=1, states=states)
+        states.update(range(40))
+        self.assertIsNone(table.get((30, 0)))
+        self.assertEqual(table.blend(30, 0, 2, 0.5), 1)
+        self.assertEqual(table.blend(30, 0, 2, 0.5), 1.5)
+        self.assertEqual(table.array.shape, (40, 1))
+        self.assertEqual(dict(table), {(30, 0): 1.5})
+        self.assertRaises(KeyError, table.__delitem__, (35, 0))
+
+        # Learners backed by a table know the states it indexes, rather than a set of their own
+        learner = QLearner(dense=True)
+        learner.fit([(0, 0, 0), (1, 0, 0.1), (2, 1, 0.5), (3, 0, -1)])
+        self.assertIs(learner._all_states, learner._values.states)
+        self.assertEqual(learner.get_states(), set(range(4)))
+        up_learner = pickle.loads(pickle.dumps(learner))
+        self.assertIs(up_learner._all_states, up_learner._values.states)
+
+        # Learners pickled with sets of known states keep them up to date
+        up_learner._all_states = set(up_learner._all_states)
+        up_learner._all_actions = set(up_learner._all_actions)
+        up_learner.fit([(4, 2, 0), (5, 2, 1)])
+        self.assertEqual(up_learner.get_states(), set(range(6)))
+        self.assertEqual(up_learner.get_actions(), set(range(3)))
+
+
+class TestDenseLearner(TestLearner):
+    # pylint: disable=protected-access, invalid-name
+
+
+    def setUp(self):
+        self.cls = functools.partial(Learner, dense=True)
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest2.main())